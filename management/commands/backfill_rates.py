@@ -0,0 +1,95 @@
+import asyncio
+import datetime
+
+import dateutil.parser
+
+from sgateway.app import get_application
+from sgateway.services.currency_exchange.history import RateHistory
+from sgateway.services.currency_exchange.rate_table import RateTable
+from sgateway.services.currency_exchange.service import CurrencyExchangeService, registry
+from ..base import BaseCommand
+
+
+def parse_date(value):
+    return dateutil.parser.parse(value).date()
+
+
+class Command(BaseCommand):
+    """
+    Fills rates history (see `sgateway.services.currency_exchange.history`) for a range of dates, e.g.:
+
+        ./manage.py backfill_rates --start 2010-01-01 --end 2017-12-31 --concurrency 20
+
+    Dates that are already in the history (including weekends and holidays saved as aliases) are skipped.
+    Rates are fetched concurrently and written with `COPY` in batches.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=parse_date, required=True, help='First date')
+        parser.add_argument('--end', type=parse_date, default=None, help='Last date, yesterday by default')
+        parser.add_argument('--provider', default=None, help='Provider name, the first one with rates by default')
+        parser.add_argument('--concurrency', type=int, default=10, help='Concurrent requests to provider')
+        parser.add_argument('--batch-size', type=int, default=100, help='Dates written at once')
+
+    def execute(self, **options):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        # Outside of a running server the app knows its loop only if it's given one
+        app = get_application(loop=loop)
+        reference = app.config.get('CURRENCY_RATES_CONFIG', {}).get('REFERENCE_CURRENCY', 'EUR')
+        history = RateHistory(app, reference)
+
+        service_name, service_version = CurrencyExchangeService.__name__, CurrencyExchangeService.__version__
+        providers = registry.get_provider_instances(app, service_name, service_version, required_methods=['get_rates'])
+        if options['provider']:
+            providers = [x for x in providers if x.name == options['provider']]
+        if not providers:
+            raise Exception("No provider to fetch rates from")
+        provider = providers[0]
+
+        start = options['start']
+        end = options['end'] or datetime.date.today() - datetime.timedelta(days=1)
+        loop.run_until_complete(app.db.create_engine(loop))
+        loop.run_until_complete(app.http_client.start(loop))
+        connection = None
+        try:
+            saved_dates = loop.run_until_complete(history.get_dates(start, end, with_aliases=True))
+            dates = []
+            date = start
+            while date <= end:
+                if date not in saved_dates:
+                    dates.append(date)
+                date += datetime.timedelta(days=1)
+            print("{} dates to fetch from {}".format(len(dates), provider.name))
+
+            semaphore = asyncio.Semaphore(options['concurrency'])
+
+            async def fetch(date):
+                async with semaphore:
+                    try:
+                        rates = await provider.call_method('get_rates', reference, date=date)
+                    except Exception as e:
+                        print("  {}: {!r}".format(date, e))
+                        return None
+                    return RateTable.from_rates_model(provider.name, rates)
+
+            connection = app.db.blocking_connection()
+            inserted = 0
+            batch_size = options['batch_size']
+            for i in range(0, len(dates), batch_size):
+                batch = dates[i:i + batch_size]
+                fetched = loop.run_until_complete(asyncio.gather(*[fetch(x) for x in batch]))
+                # Provider answers with the last published rates for weekends and holidays
+                fetched = {date: x for date, x in zip(batch, fetched) if x is not None}
+                rate_tables = {x.date: x for x in fetched.values()}
+                aliases = {date: x.date for date, x in fetched.items()}
+                inserted += history.bulk_save(connection.connection.connection,  # psycopg2 connection
+                                              rate_tables.values(), aliases=aliases)
+                print("  {} - {}: {} dates, {} rates saved".format(batch[0], batch[-1], len(rate_tables),
+                                                                     inserted))
+        finally:
+            if connection is not None:
+                connection.close()
+            loop.run_until_complete(app.http_client.stop())
+            loop.run_until_complete(app.db.stop_engine())
+            loop.close()
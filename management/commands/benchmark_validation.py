@@ -0,0 +1,65 @@
+import timeit
+
+from jsonschema.validators import validate as validate_schema
+
+from sgateway.core.validation import AVAILABLE_BACKENDS, compile_validator
+from sgateway.services.email.schemas import EmailMessage
+from sgateway.services.tax_rates.schemas import SaleTaxQuery
+from ..base import BaseCommand
+
+EMAIL_MESSAGE_PAYLOAD = {
+    'from_email': {'email': 'sender@example.com', 'name': 'Sender'},
+    'reply_to': {'email': 'reply@example.com'},
+    'to': [{'email': 'first@example.com', 'name': 'First'}, {'email': 'second@example.com'}],
+    'cc': [{'email': 'cc@example.com'}],
+    'subject': 'Benchmark',
+    'body_plain_text': 'Hello',
+    'body_html': '<p>Hello</p>',
+    'transform_css': False,
+}
+
+SALE_TAX_QUERY_PAYLOAD = {
+    'sale_id': '1',
+    'customer_id': '1',
+    'date': '2017-11-19',
+    'currency': 'USD',
+    'amount': 300,
+    'lines': [
+        {'line_number': i, 'quantity': 1, 'amount_total': 100, 'item_code': 'T{}'.format(i)} for i in range(1, 4)
+    ],
+    'ship_from_address': {'street_line1': '351 30th Street NE', 'city': 'Ruskin', 'region_code': 'FL',
+                          'country_code': 'US', 'postal_code': '33570'},
+    'ship_to_address': {'street_line1': '1910 E Central Avenue', 'city': 'San Bernardino', 'region_code': 'CA',
+                        'country_code': 'US', 'postal_code': '92408'},
+}
+
+
+class Command(BaseCommand):
+    """
+    Compares per-request `jsonschema.validate` (the way request data was validated before) with
+    compiled validators, e.g.:
+
+        ./manage.py benchmark_validation --number 10000
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=10000, help='Validations per measurement')
+
+    def execute(self, **options):
+        number = options['number']
+        cases = (
+            ('EmailMessage', EmailMessage.get_schema(), EMAIL_MESSAGE_PAYLOAD),
+            ('SaleTaxQuery', SaleTaxQuery.get_schema(), SALE_TAX_QUERY_PAYLOAD),
+        )
+
+        for name, schema, payload in cases:
+            print("{} ({} validations):".format(name, number))
+            baseline = timeit.timeit(lambda: validate_schema(payload, schema), number=number)
+            print("  {:<28} {:8.2f} us/op".format('jsonschema.validate', baseline / number * 1e6))
+
+            for backend in AVAILABLE_BACKENDS:
+                validator = compile_validator(schema, backend=backend)
+                validator.validate(payload)
+                spent = timeit.timeit(lambda: validator.validate(payload), number=number)
+                print("  {:<28} {:8.2f} us/op (x{:.1f})".format(
+                    'compiled ({})'.format(validator.backend), spent / number * 1e6, baseline / spent))
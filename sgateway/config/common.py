@@ -10,6 +10,15 @@ APP_LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
 
 INTERNAL_GATEWAY_KEY = os.getenv('INTERNAL_GATEWAY_KEY', 'SECRET_KEY_HERE')
 
+# `sgateway.middlewares.authentication.AuthMiddleware`
+AUTH_CONFIG = {
+    'KEYS': {},  # Additional keys by `kid`, INTERNAL_GATEWAY_KEY is used for tokens without `kid`
+    'KEYS_FILE': os.getenv('INTERNAL_GATEWAY_KEYS_FILE', None),  # JSON {"kid": "secret"}, reloaded on change
+    'KEYS_FILE_CHECK_INTERVAL': 5,
+    'TOKENS_CACHE_SIZE': 10000,  # Verified tokens
+    'TOKENS_CACHE_TTL': 60 * 5,
+}
+
 INSTALLED_SERVICES = [
     'sgateway.services.email.service',
     'sgateway.services.currency_exchange.service',
@@ -41,10 +50,95 @@ SERVICES_PIPELINE_MIDDLEWARES = [
     'sgateway.middlewares.logger.LoggerMiddleware',  # Comes last
 ]
 
+# Shared upstream HTTP connections pool (see `sgateway.core.http.HTTPClientManager`)
+HTTP_CLIENT_CONFIG = {
+    'LIMIT': int(os.getenv('HTTP_CLIENT_LIMIT', 100)),  # Total connections
+    'LIMIT_PER_HOST': int(os.getenv('HTTP_CLIENT_LIMIT_PER_HOST', 20)),
+    'DNS_CACHE_TTL': 300,
+    'KEEPALIVE_TIMEOUT': 30,
+    'TIMEOUT': 60,
+    'PRECONNECT': False,  # Warm up connections to providers' APIs on startup
+}
+
+# Providers' circuit breakers, see `sgateway.core.circuit_breaker`. State is shared via Redis.
+CIRCUIT_BREAKER_CONFIG = {
+    'ENABLED': True,
+    'FAILURE_THRESHOLD': 5,  # Consecutive failures to open circuit
+    'COOLDOWN': 30,  # Seconds until a trial call is allowed to open circuit
+    'SYNC_INTERVAL': 1,  # Local view refresh period
+    'STATE_TTL': 60 * 60 * 24,
+}
+
+# `sgateway.services.currency_exchange.rate_table.RateTableManager`
+CURRENCY_RATES_CONFIG = {
+    'REFERENCE_CURRENCY': 'EUR',  # ECB rates, any other pair is triangulated
+    'PUBLICATION_TIME': '15:00',  # UTC, ECB publishes rates around 16:00 CET
+    'RETRY_INTERVAL': 60 * 10,  # While new rates are not published yet
+    'RETRY_WINDOW': 60 * 60 * 3,
+    'STORE_HISTORY': True,  # Keep published rates in Postgres, see `currency_exchange.history`
+    'TIMESERIES_MAX_DAYS': 366 * 5,
+    # Share rates between workers of a host through a file mapped into memory, see `core.snapshot`
+    'SNAPSHOT_PATH': os.getenv('CURRENCY_RATES_SNAPSHOT_PATH', None),
+    'SNAPSHOT_CHECK_INTERVAL': 1,
+    'SNAPSHOT_LOCK_INTERVAL': 10,  # How often workers try to become the refresher
+}
+
+# Time budget of a request (seconds), unless method has its own. Clients can shorten it with `X-Request-Timeout`.
+DEFAULT_REQUEST_TIMEOUT = 30
+
+# `sgateway.services.base.service.BaseService.hedged_provider_call`
+HEDGING_CONFIG = {
+    'PERCENTILE': 95,  # Call is hedged if provider doesn't answer within this percentile of its latency
+    'MIN_SAMPLES': 20,  # Calls measured to rely on the percentile, DEFAULT_DELAY is used until then
+    'DEFAULT_DELAY': 1,
+    'MIN_DELAY': 0.05,
+    'MAX_HEDGES': 1,  # Extra calls per request
+}
+
+# `sgateway.middlewares.rate_limiting.RateLimitingMiddleware`
+RATE_LIMITING_CONFIG = {
+    # Every worker reserves quotas by this many requests and admits requests locally. 0 - check every request in Redis.
+    'LEASE_SIZE': int(os.getenv('RATE_LIMITING_LEASE_SIZE', 0)),
+    'LEASE_IDLE_TTL': 10,  # Unspent leases are returned after this many seconds of inactivity
+    'LEASE_SYNC_INTERVAL': 5,
+}
+
+# Where `sgateway.middlewares.idempotency_key.IdempotencyKeyMiddleware` keeps locks. Use
+# `sgateway.middlewares.idempotency_key.PostgresIdempotencyStore` for a durable store.
+IDEMPOTENCY_STORE_CLASS = 'sgateway.middlewares.idempotency_key.RedisIdempotencyStore'
+
+# `sgateway.middlewares.caching.CacheMiddleware`
+CACHE_CONFIG = {
+    'TTL': 60 * 5,  # Shared (redis) cache
+    'LOCAL_TTL': 30,  # In-process cache, per worker
+    'LOCAL_MAXSIZE': 1024,
+    'STALE_TTL': 60,  # Serve expired entry up to this many seconds while it's being refreshed
+    'COALESCE_TIMEOUT': 10,  # How long identical requests wait for the one in flight
+}
+
+# `jsonschema` or `fastjsonschema` (if installed). By default the fastest available is used.
+SCHEMA_VALIDATION_BACKEND = os.getenv('SCHEMA_VALIDATION_BACKEND', None)
+
 CENTRAL_CONFIG_CLASS = 'sgateway.middlewares.central_config.DummyCentralConfig'
 
 AMQP_URL = os.getenv('MESSAGE_BUS_AMQP_URL', None)
 SERVICE_MQ_LOGGING = False
+# Logs are published by a background task, see `sgateway.middlewares.logger.LoggerMiddleware`
+MQ_LOGGING_CONFIG = {
+    'BUFFER_SIZE': 10000,
+    'BATCH_SIZE': 100,
+    'FLUSH_INTERVAL': 1,
+    'OVERFLOW_POLICY': 'drop_oldest',  # `drop_new`, `drop_oldest` or `block`
+    'BLOCK_TIMEOUT': 0.5,
+    # On-disk spool for logs that can't be sent to MQ. Disabled if not set.
+    'SPOOL_DIR': os.getenv('MQ_LOGGING_SPOOL_DIR', None),
+    'SPOOL_SEGMENT_SIZE': 16 * 1024 * 1024,
+    'SPOOL_MAX_SEGMENTS': 64,
+    'SPOOL_FSYNC': 'interval',  # `always`, `interval` or `never`
+    'SPOOL_FSYNC_INTERVAL': 1,
+    'SPOOL_REPLAY_RATE': 500,  # Records per second
+    'SPOOL_REPLAY_INTERVAL': 5,
+}
 
 # Services config
 DOCS_API_URL = os.getenv('DOCS_API_URL', 'https://docs.semilimes.info')
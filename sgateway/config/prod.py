@@ -2,6 +2,7 @@ from .common import *
 
 APP_LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
 SERVICE_MQ_LOGGING = True
+HTTP_CLIENT_CONFIG['PRECONNECT'] = True
 
 # TODO: Uncomment latter, when non-test account will be set up.
 # GODADDY_API_URL = "https://api.godaddy.com/v1/"
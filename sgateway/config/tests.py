@@ -15,6 +15,8 @@ CENTRAL_CONFIG_CLASS = 'middlewares.central_config.DummyCentralConfig'
 DB_CONFIG['connection_string'] = os.getenv('DB_URL', 'postgresql://localhost:5432/')
 DB_CONFIG['create_tmp_db'] = True  # See :ref:`sgateway.core.db.GatewayDB`
 
+IDEMPOTENCY_STORE_CLASS = 'sgateway.middlewares.idempotency_key.PostgresIdempotencyStore'
+
 # See pytest-redis
 REDIS_CONFIG = {
     'HOST': '127.0.0.1',
@@ -9,8 +9,10 @@ from sanic.handlers import ErrorHandler
 from sanic.request import Request
 from sl_mqlib.async import AsyncioUniversalChannel
 
+from sgateway.core.circuit_breaker import CircuitBreakerManager
 from sgateway.core.db import GatewayDB
 from sgateway.core.gateway_exceptions import BaseApiException, InternalError
+from sgateway.core.http import HTTPClientManager
 from sgateway.core.logs import app_logger
 from sgateway.core.logs import get_config as get_logging_config
 from sgateway.core.mq import GatewayMQHandler
@@ -78,6 +80,10 @@ class GatewayApp(Sanic):
         self.redis_pool = None
         self._init_redis()
 
+        self.http_client = self._init_http_client()
+
+        self.circuit_breakers = self._init_circuit_breakers()
+
         self.mq_channel = self._init_message_queue()
 
     @property
@@ -148,6 +154,45 @@ class GatewayApp(Sanic):
             self.redis_pool.close()
             await self.redis_pool.wait_closed()
 
+    def _init_http_client(self):
+        http_client = HTTPClientManager(self)
+
+        @self.listener('before_server_start')
+        async def _tearup_http_client(app, loop):
+            await http_client.start(loop)
+
+        @self.listener('after_server_start')
+        async def _preconnect_http_client(app, loop):
+            if not http_client.config.get('PRECONNECT'):
+                return
+
+            # Imported here, because services are discovered only when services blueprint is registered.
+            from sgateway.services.registry import ServiceRegistry
+
+            urls = []
+            for provider_cls in ServiceRegistry().get_all_providers():
+                urls.extend(provider_cls.get_preconnect_urls(app.config))
+            loop.create_task(http_client.preconnect(urls))
+
+        @self.listener('after_server_stop')
+        async def _teardown_http_client(app, loop):
+            await http_client.stop()
+
+        return http_client
+
+    def _init_circuit_breakers(self):
+        circuit_breakers = CircuitBreakerManager(self)
+
+        @self.listener('after_server_start')
+        async def _tearup_circuit_breakers(app, loop):
+            await circuit_breakers.start(loop)
+
+        @self.listener('before_server_stop')
+        async def _teardown_circuit_breakers(app, loop):
+            await circuit_breakers.stop()
+
+        return circuit_breakers
+
     def _init_message_queue(self):
         AMQP_URL = self.config.get('AMQP_URL')
         if not AMQP_URL:
@@ -155,10 +200,11 @@ class GatewayApp(Sanic):
             return
 
         mq_channel = AsyncioUniversalChannel(amqp_url=AMQP_URL)
-        GatewayMQHandler(self, mq_channel)
+        mq_handler = GatewayMQHandler(self, mq_channel)
 
         @self.listener('after_server_start')
         async def _tearup_channel(app, loop):
+            mq_handler.compile_pipelines()
             mq_channel.set_loop(loop)
             connected = await mq_channel.connect(fail_silently=True)
             if not connected:
@@ -0,0 +1,187 @@
+import asyncio
+import time
+
+from sgateway.core.logs import app_logger
+from sgateway.core.redis_scripts import RedisScript
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+#: Changes breaker state. KEYS - breaker key. ARGV - operation, now, failure threshold, cooldown, state ttl.
+#: Operations:
+#:  * `trial` - asks if a call is allowed. Call is always allowed when circuit is closed, otherwise only one
+#:    (trial) call per cooldown is allowed, and circuit gets half-open;
+#:  * `success` - closes circuit;
+#:  * `failure` - counts consecutive failure, opens circuit when threshold is reached or trial call failed.
+#: Returns {allowed, state, failures, opened_at}.
+CIRCUIT_BREAKER_SCRIPT = RedisScript("""
+local op, now = ARGV[1], tonumber(ARGV[2])
+local threshold, cooldown, ttl = tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+
+local data = redis.call('HMGET', KEYS[1], 'state', 'failures', 'opened_at')
+local state = data[1] or 'closed'
+local failures = tonumber(data[2]) or 0
+local opened_at = tonumber(data[3]) or 0
+local allowed = 1
+
+if op == 'trial' then
+    if state ~= 'closed' then
+        if now >= opened_at + cooldown then
+            state = 'half_open'
+            opened_at = now
+        else
+            allowed = 0
+        end
+    end
+elseif op == 'success' then
+    state = 'closed'
+    failures = 0
+elseif op == 'failure' then
+    failures = failures + 1
+    if state == 'half_open' or (state == 'closed' and failures >= threshold) then
+        state = 'open'
+        opened_at = now
+    end
+end
+
+redis.call('HMSET', KEYS[1], 'state', state, 'failures', failures, 'opened_at', opened_at)
+redis.call('EXPIRE', KEYS[1], ttl)
+return {allowed, state, tostring(failures), tostring(opened_at)}
+""")
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker of a single provider of a service. State is kept in Redis, so it's shared across workers,
+    and the breaker holds local view of it, refreshed by :class:`CircuitBreakerManager` periodically and
+    after every state change made by this worker.
+
+    Closed circuit allows all the calls. After `FAILURE_THRESHOLD` consecutive failures circuit gets open and
+    no calls are allowed for `COOLDOWN` seconds. After that, a single trial call is allowed (half-open): circuit
+    gets closed if it succeeds, or open for another cooldown otherwise.
+    """
+
+    __slots__ = ('manager', 'name', 'key', 'state', 'failures', 'opened_at')
+
+    def __init__(self, manager, name):
+        self.manager = manager
+        self.name = name
+        self.key = 'circuit_breaker_{}'.format(name)
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+
+    def update(self, state, failures, opened_at):
+        state = state.decode() if isinstance(state, bytes) else state
+        if state != self.state:
+            self.manager.log.info("Circuit `{}` is {} now".format(self.name, state))
+        self.state = state
+        self.failures = int(failures)
+        self.opened_at = float(opened_at)
+
+    @property
+    def is_available(self):
+        """
+        If call can be tried, according to the local view. Never blocks, so can be used by strategies.
+        """
+        return self.state == CLOSED or time.time() >= self.opened_at + self.manager.cooldown
+
+    async def _call_script(self, op):
+        with await self.manager.app.redis_pool as conn:
+            allowed, state, failures, opened_at = await CIRCUIT_BREAKER_SCRIPT(
+                conn, keys=[self.key],
+                args=[op, time.time(), self.manager.failure_threshold, self.manager.cooldown, self.manager.state_ttl])
+        self.update(state, failures, opened_at)
+        return bool(allowed)
+
+    async def allow_call(self):
+        """
+        :return: bool
+        """
+        if self.state == CLOSED:
+            return True
+        if not self.is_available:
+            return False
+        try:
+            return await self._call_script('trial')
+        except Exception:
+            self.manager.log.exception("Can not check circuit `{}`".format(self.name))
+            return True
+
+    async def record(self, success):
+        """
+        Counts call result. Successes are sent to Redis only if there is something to reset.
+        """
+        if success and self.state == CLOSED and not self.failures:
+            return
+        try:
+            await self._call_script('success' if success else 'failure')
+        except Exception:
+            self.manager.log.exception("Can not update circuit `{}`".format(self.name))
+
+
+class CircuitBreakerManager(object):
+    """
+    App-scoped holder of providers' circuit breakers. Refreshes local view of all the breakers used by this
+    worker from Redis every `SYNC_INTERVAL` seconds. See `CIRCUIT_BREAKER_CONFIG`.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        config = app.config.get('CIRCUIT_BREAKER_CONFIG', {})
+        self.enabled = config.get('ENABLED', True)
+        self.failure_threshold = config.get('FAILURE_THRESHOLD', 5)
+        self.cooldown = config.get('COOLDOWN', 30)
+        self.sync_interval = config.get('SYNC_INTERVAL', 1)
+        self.state_ttl = config.get('STATE_TTL', 60 * 60 * 24)
+        self.log = app_logger.getChild('circuit_breaker')
+        self._breakers = {}
+        self._sync_task = None
+
+    @property
+    def active(self):
+        return self.enabled and self.app.redis_pool is not None
+
+    def get(self, name):
+        """
+        :param name: breaker name, e.g. `<service key>.<provider name>`
+        :return: CircuitBreaker or None if breakers are not active
+        """
+        if not self.active:
+            return None
+        try:
+            return self._breakers[name]
+        except KeyError:
+            breaker = self._breakers[name] = CircuitBreaker(self, name)
+            return breaker
+
+    async def start(self, loop):
+        if self.enabled:
+            self._sync_task = loop.create_task(self._sync_periodically())
+
+    async def stop(self):
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            self._sync_task = None
+
+    async def sync(self):
+        breakers = list(self._breakers.values())
+        if not breakers or not self.active:
+            return
+        with await self.app.redis_pool as conn:
+            states = await asyncio.gather(*[conn.hmget(x.key, 'state', 'failures', 'opened_at') for x in breakers])
+        for breaker, (state, failures, opened_at) in zip(breakers, states):
+            if state is None:
+                # Expired or never opened
+                breaker.update(CLOSED, 0, 0)
+            else:
+                breaker.update(state, failures, opened_at)
+
+    async def _sync_periodically(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception:
+                self.log.exception("Can not sync circuit breakers")
@@ -122,6 +122,17 @@ class ConfigurationError(ServiceUnavailable):
     error_code = '009'
 
 
+class DeadlineExceeded(BaseApiException):
+    status_code = 504
+    error_code = '010'
+    description = 'Request can not be processed within its time budget'
+
+
+class CircuitOpenError(ProviderUnavailable):
+    description = 'Provider is temporarily disabled because of repeated failures'
+    client_retry = True
+
+
 # Rate limiting
 
 class QuotaExceeded(BaseApiException):
@@ -1,5 +1,6 @@
 import asyncio
 import collections
+import time
 from inspect import isawaitable, isfunction
 
 from threading import local
@@ -97,3 +98,63 @@ class LazyProperty(object):
             self.value_lock.release()
 
         return self.value
+
+
+class LRUCache(object):
+    """
+    Bounded mapping that evicts least recently used items. Items can optionally expire after `ttl` seconds.
+    Not thread safe (it's fine for asyncio).
+    """
+
+    __slots__ = ('maxsize', 'ttl', '_data', 'hits', 'misses')
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _count=False) is not None
+
+    def get(self, key, default=None, _count=True):
+        try:
+            value, expires_at = self._data[key]
+        except KeyError:
+            if _count:
+                self.misses += 1
+            return default
+
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            if _count:
+                self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        if _count:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        """
+        :param ttl: overrides default ttl for this item
+        """
+        ttl = ttl if ttl is not None else self.ttl
+        self._data[key] = (value, time.monotonic() + ttl if ttl is not None else None)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        try:
+            return self._data.pop(key)[0]
+        except KeyError:
+            return default
+
+    def clear(self):
+        self._data.clear()
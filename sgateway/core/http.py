@@ -0,0 +1,107 @@
+import asyncio
+
+import aiohttp
+
+from sgateway.core.logs import app_logger
+
+
+class BorrowedSession(object):
+    """
+    Makes shared `aiohttp.ClientSession` usable in `async with` blocks the same way as a
+    standalone one, but without closing it on exit.
+    """
+
+    __slots__ = ('session',)
+
+    def __init__(self, session):
+        self.session = session
+
+    async def __aenter__(self):
+        return self.session
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class HTTPClientManager(object):
+    """
+    App-scoped holder of upstream HTTP sessions.
+
+    All sessions share a single connector (connections keep-alive, per-host limits and DNS cache), and every
+    provider gets its own long-lived session with its default headers/auth, so upstream calls don't pay
+    TCP+TLS handshake and DNS resolution each time.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.config = dict(app.config.get('HTTP_CLIENT_CONFIG', {}))
+        self.log = app_logger.getChild('http_client')
+        self.connector = None
+        self._sessions = {}
+
+    async def start(self, loop):
+        self.connector = aiohttp.TCPConnector(
+            limit=self.config.get('LIMIT', 100),
+            limit_per_host=self.config.get('LIMIT_PER_HOST', 20),
+            use_dns_cache=True,
+            ttl_dns_cache=self.config.get('DNS_CACHE_TTL', 300),
+            keepalive_timeout=self.config.get('KEEPALIVE_TIMEOUT', 30),
+            loop=loop,
+        )
+
+    async def stop(self):
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions = {}
+
+        if self.connector is not None:
+            await self.connector.close()
+            self.connector = None
+
+    @property
+    def started(self):
+        return self.connector is not None
+
+    def get_session(self, name, headers=None, auth=None):
+        """
+        :param name: session owner name (e.g. provider name). Headers and auth are used only for session creation.
+        :param headers: default headers
+        :param auth: aiohttp.BasicAuth or None
+        :return: aiohttp.ClientSession
+        """
+        try:
+            return self._sessions[name]
+        except KeyError:
+            pass
+
+        if not self.started:
+            raise RuntimeError("HTTP client manager is not started")
+
+        timeout = aiohttp.ClientTimeout(total=self.config.get('TIMEOUT', 60))
+        session = aiohttp.ClientSession(connector=self.connector, connector_owner=False,
+                                        headers=headers, auth=auth, timeout=timeout)
+        self._sessions[name] = session
+        return session
+
+    async def preconnect(self, urls):
+        """
+        Warm up connections pool (DNS, TCP and TLS) for the given urls. Errors are ignored.
+
+        :param urls: iterable of urls
+        """
+        if not self.started:
+            return
+
+        session = self.get_session('_preconnect')
+
+        async def _touch(url):
+            try:
+                async with session.head(url, allow_redirects=False) as resp:
+                    await resp.release()
+            except Exception as e:
+                self.log.warning("Can not preconnect to {}: {}".format(url, e))
+
+        urls = set(urls)
+        if urls:
+            await asyncio.gather(*[_touch(url) for url in urls])
+            self.log.debug("Preconnected to: {}".format(', '.join(urls)))
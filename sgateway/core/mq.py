@@ -6,6 +6,7 @@ from sl_mqlib.exceptions import MessageRequireRequeue, AbandonMessage
 
 from sgateway.core.gateway_exceptions import BaseApiException, ServiceUnavailable, ServiceBadRequestError
 from sgateway.core.logs import app_logger
+from sgateway.services.pipeline import PipelinesRegistry
 from sgateway.services.registry import ServiceRegistry
 from sgateway.services.request import ServiceRequest, RequestHandler
 
@@ -32,6 +33,7 @@ class GatewayMQHandler(BaseMessageHandler):
         self.app = app
         self.registry = kwargs.pop('service_registry', ServiceRegistry())
         self.middlewares = self._locate_middleware_classes(app) if middlewares is None else middlewares
+        self.pipelines = PipelinesRegistry(self.middlewares)
         self.log = app_logger.getChild('mq.handler.{}'.format(self.QUEUE_NAME))
 
         super(GatewayMQHandler, self).__init__(**kwargs)
@@ -54,8 +56,21 @@ class GatewayMQHandler(BaseMessageHandler):
             middlewares.append(middleware_class(app))
         return middlewares
 
+    def compile_pipelines(self):
+        """
+        Build middleware pipelines (and request validators) for all registered services methods upfront.
+        """
+        services = [service_class(self.app) for service_class in self.registry.get_services()]
+        for service in services:
+            service.compile_validators()
+        self.pipelines.compile_services(services)
+
     def build_service_request(self, message):
-        request = GatewayMQRequest(self.app, message, '//{}'.format(self.QUEUE_NAME).encode(), {}, None, None, None)
+        headers = {}
+        if message.data.get('timeout'):
+            headers['X-Request-Timeout'] = str(message.data['timeout'])
+        request = GatewayMQRequest(self.app, message, '//{}'.format(self.QUEUE_NAME).encode(), headers,
+                                   None, None, None)
 
         try:
             _service_name, _service_version, _service_method = (
@@ -83,9 +98,10 @@ class GatewayMQHandler(BaseMessageHandler):
 
         service_request = self.build_service_request(message)
         handler = RequestHandler(service_request)
+        pipeline = self.pipelines.get(service_request.service, service_request.method)
 
         try:
-            response = await handler.make_response(self.middlewares)
+            response = await handler.make_response(pipeline)
         except BaseApiException as e:
             if e.client_retry:
                 self.log.info("Service call via MQ produced error, but will be requeued")
@@ -0,0 +1,32 @@
+import hashlib
+
+import aioredis
+
+
+class RedisScript(object):
+    """
+    Lua script executed server side. Script is called by its SHA1 digest, so the source is sent to Redis only
+    when it's not in the script cache yet (first call or after a restart/`SCRIPT FLUSH`).
+    """
+
+    __slots__ = ('source', 'digest')
+
+    def __init__(self, source):
+        self.source = source
+        self.digest = hashlib.sha1(source.encode()).hexdigest()
+
+    async def __call__(self, conn, keys=(), args=()):
+        """
+        :param conn: aioredis connection or pool
+        :param keys: list of redis keys script works with
+        :param args: list of script arguments
+        :return: script result
+        """
+        keys, args = list(keys), list(args)
+        try:
+            return await conn.evalsha(self.digest, keys=keys, args=args)
+        except aioredis.ReplyError as e:
+            if not str(e).startswith('NOSCRIPT'):
+                raise
+        # EVAL caches the script as well
+        return await conn.eval(self.source, keys=keys, args=args)
@@ -0,0 +1,138 @@
+import asyncio
+import fcntl
+import mmap
+import os
+import struct
+import time
+
+from sgateway.core.logs import app_logger
+
+
+class SharedSnapshot(object):
+    """
+    Binary snapshot shared by all workers of a host: one worker (refresher) writes it, the others map the file
+    read-only, so the data is fetched once and kept in memory once (in page cache) for any number of workers.
+
+    File is a fixed header (magic, version, payload length) followed by payload. Version is incremented on
+    every write. A new snapshot is written to a temporary file and renamed over the old one, so readers see
+    either the old or the new snapshot as a whole. Readers re-map the file once it's replaced, it's checked
+    at most every `check_interval` seconds.
+
+    Refresher is elected with exclusive `flock` of `<path>.lock`. The lock is held for the worker's lifetime
+    and is released by OS if the worker dies, so another one takes over.
+    """
+
+    _header = struct.Struct('>4sQI')  # magic, version, payload length
+    _magic = b'SGSS'
+
+    def __init__(self, path, check_interval=1):
+        self.path = str(path)
+        self.check_interval = check_interval
+        self.log = app_logger.getChild('snapshot')
+        self.version = 0
+        self._map = None
+        self._inode = None
+        self._checked_at = None
+        self._lock_file = None
+
+    @property
+    def is_refresher(self):
+        return self._lock_file is not None
+
+    def try_acquire(self):
+        """
+        Tries to become the refresher, never blocks.
+
+        :return: bool
+        """
+        if self._lock_file is not None:
+            return True
+        lock_file = open(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def release(self):
+        if self._lock_file is None:
+            return
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+        self._lock_file.close()
+        self._lock_file = None
+
+    def write(self, payload):
+        """
+        :param payload: bytes
+        :return: version of the written snapshot
+        """
+        self.check(force=True)
+        version = self.version + 1
+        self._write_file(version, payload)
+        self.check(force=True)
+        return version
+
+    async def write_async(self, payload, loop=None):
+        """
+        Same as `write`, but the file is written and synced in the default executor, so the loop isn't blocked.
+        Snapshot is re-mapped in the loop thread, as readers of the same process do.
+        """
+        loop = loop or asyncio.get_event_loop()
+        self.check(force=True)
+        version = self.version + 1
+        await loop.run_in_executor(None, self._write_file, version, payload)
+        self.check(force=True)
+        return version
+
+    def _write_file(self, version, payload):
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(self._header.pack(self._magic, version, len(payload)))
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self.path)
+
+    def check(self, force=False):
+        """
+        Re-maps the file if it's replaced.
+
+        :return: True if there is a new version
+        """
+        now = time.monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return False
+        with f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino == self._inode or stat.st_size < self._header.size:
+                return False
+            snapshot_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, length = self._header.unpack_from(snapshot_map)
+        if magic != self._magic or self._header.size + length > len(snapshot_map):
+            self.log.warning("Snapshot is corrupted: {}".format(self.path))
+            return False
+
+        # The old map is not closed explicitly: it's closed once nothing refers to its data anymore
+        self._map = snapshot_map
+        self._inode = stat.st_ino
+        self.version = version
+        return True
+
+    @property
+    def payload(self):
+        """
+        :return: read-only memoryview of the payload or None if there is no snapshot
+        """
+        if self._map is None:
+            return None
+        length = self._header.unpack_from(self._map)[2]
+        return memoryview(self._map)[self._header.size:self._header.size + length]
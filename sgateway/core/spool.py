@@ -0,0 +1,271 @@
+import asyncio
+import fcntl
+import os
+import struct
+import tempfile
+import time
+import zlib
+from contextlib import contextmanager
+
+from sgateway.core.logs import app_logger
+
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+
+class SegmentSpool(object):
+    """
+    Append-only on-disk spool of binary records.
+
+    Records are written into segment files of up to `segment_size` bytes, every record is prefixed with
+    its length and CRC32, so a torn write (e.g. on crash) is detected and the rest of segment is skipped.
+    When there are more than `max_segments` segments, the oldest one is dropped.
+
+    Segments are consumed oldest first and removed once all their records are consumed. Delivery is
+    at-least-once: progress within a segment is not persisted, so after restart it's replayed from the start.
+
+    Spool directory is owned by a single process: it's locked with `flock` while the spool is open. Processes
+    sharing a directory should use their own spools, see :func:`open_worker_spool` and :func:`orphaned_spools`.
+
+    `fsync` is done in the default executor (on a duplicate of the file descriptor), so it never blocks
+    the event loop. A record is durable once its fsync is completed.
+    """
+
+    _header = struct.Struct('>II')  # length, crc32
+    _suffix = '.seg'
+
+    def __init__(self, path, segment_size=16 * 1024 * 1024, max_segments=64, fsync='interval', fsync_interval=1):
+        """
+        :param path: directory for segments, created if not exists
+        :param fsync: one of :data:`FSYNC_POLICIES`
+        :param fsync_interval: seconds, for `interval` fsync policy
+        :raise: BlockingIOError if the spool is used by another process
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("Unknown fsync policy: {}".format(fsync))
+
+        self.path = str(path)
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.log = app_logger.getChild('spool')
+
+        self.appended = 0
+        self.dropped = 0  # records lost with dropped segments
+        self.corrupted = 0  # segments with broken records
+
+        os.makedirs(self.path, exist_ok=True)
+        self._lock_file = open(os.path.join(self.path, '.lock'), 'a')
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            raise
+
+        self._file = None
+        self._file_path = None
+        self._file_records = 0
+        self._synced_at = 0
+        self._consumed = {}  # segment path -> number of records consumed
+        segments = self.segments()
+        self._next_seq = int(os.path.basename(segments[-1])[:-len(self._suffix)]) + 1 if segments else 0
+
+    def segments(self):
+        """
+        :return: list of segment paths, oldest first
+        """
+        names = sorted(x for x in os.listdir(self.path) if x.endswith(self._suffix))
+        return [os.path.join(self.path, x) for x in names]
+
+    @property
+    def has_pending(self):
+        return bool(self._file_records) or any(x != self._file_path for x in self.segments())
+
+    def _open_segment(self):
+        self._file_path = os.path.join(self.path, '{:020d}{}'.format(self._next_seq, self._suffix))
+        self._next_seq += 1
+        self._file = open(self._file_path, 'ab')
+        self._file_records = 0
+
+        segments = self.segments()
+        for segment in segments[:max(0, len(segments) - self.max_segments)]:
+            self.dropped += sum(1 for _ in self.read_segment(segment))
+            self._remove(segment)
+            self.log.warning("Spool is full, segment dropped: {}".format(segment))
+
+    def _sync(self, force=False):
+        if self._file is None:
+            return
+        self._file.flush()
+        if self.fsync == 'never':
+            return
+        now = time.monotonic()
+        if force or self.fsync == 'always' or now - self._synced_at >= self.fsync_interval:
+            fd = os.dup(self._file.fileno())
+            asyncio.get_event_loop().run_in_executor(None, self._fsync, fd).add_done_callback(self._fsync_done)
+            self._synced_at = now
+
+    @staticmethod
+    def _fsync(fd):
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _fsync_done(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            self.log.warning("Can not fsync spool segment: {}".format(future.exception()))
+
+    def append(self, record):
+        """
+        :param record: bytes
+        """
+        if self._file is None:
+            self._open_segment()
+
+        self._file.write(self._header.pack(len(record), zlib.crc32(record)))
+        self._file.write(record)
+        self._file_records += 1
+        self.appended += 1
+        self._sync()
+
+        if self._file.tell() >= self.segment_size:
+            self.rotate()
+
+    def rotate(self):
+        """
+        Close current segment, so it can be consumed. The next record goes to a new one.
+        """
+        if self._file is None:
+            return
+        self._sync(force=True)
+        self._file.close()
+        self._file = None
+        self._file_path = None
+        self._file_records = 0
+
+    def close(self):
+        self.rotate()
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    def destroy(self):
+        """
+        Close the spool and remove its directory, if all the records are consumed.
+
+        :return: True if removed
+        """
+        if self.has_pending:
+            return False
+        self.close()
+        try:
+            os.remove(os.path.join(self.path, '.lock'))
+            os.rmdir(self.path)
+        except OSError:
+            return False
+        return True
+
+    def read_segment(self, segment):
+        """
+        :return: generator of records
+        """
+        with open(segment, 'rb') as f:
+            while True:
+                header = f.read(self._header.size)
+                if not header:
+                    return
+                if len(header) < self._header.size:
+                    break
+                length, crc = self._header.unpack(header)
+                record = f.read(length)
+                if len(record) < length or zlib.crc32(record) != crc:
+                    break
+                yield record
+        self.corrupted += 1
+        self.log.warning("Spool segment is corrupted, the rest is skipped: {}".format(segment))
+
+    def _remove(self, segment):
+        self._consumed.pop(segment, None)
+        try:
+            os.remove(segment)
+        except OSError:
+            pass
+
+    async def replay(self, publish, rate=None, batch_size=100):
+        """
+        Consume spooled records.
+
+        :param publish: function or coroutine function that takes a record. If it raises - replay stops
+            and is continued from the same record the next time.
+        :param rate: max records per second, unlimited if None
+        :param batch_size: records published between pauses
+        :return: number of records consumed
+        """
+        self.rotate()
+        consumed = 0
+        for segment in self.segments():
+            if not os.path.exists(segment):
+                # Dropped while records were published
+                continue
+            skip = self._consumed.get(segment, 0)
+            for i, record in enumerate(self.read_segment(segment)):
+                if i < skip:
+                    continue
+                result = publish(record)
+                if asyncio.iscoroutine(result):
+                    await result
+                self._consumed[segment] = i + 1
+                consumed += 1
+
+                if consumed % batch_size == 0:
+                    await asyncio.sleep(batch_size / rate if rate else 0)
+            self._remove(segment)
+        return consumed
+
+
+@contextmanager
+def _root_lock(root):
+    """
+    Serializes creation and adoption of spools within `root`, so a spool is never adopted before
+    its owner locks it.
+    """
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, '.lock'), 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def open_worker_spool(root, **kwargs):
+    """
+    Opens a spool of the current process in its own subdirectory of `root`.
+
+    :param kwargs: :class:`SegmentSpool` options
+    """
+    with _root_lock(root):
+        return SegmentSpool(tempfile.mkdtemp(prefix='{}-'.format(os.getpid()), dir=root), **kwargs)
+
+
+def orphaned_spools(root, **kwargs):
+    """
+    Spools in `root` left by processes that are gone (so they are not locked). Every returned spool is locked
+    by the current process until it's closed or destroyed.
+
+    :param kwargs: :class:`SegmentSpool` options
+    :return: list of :class:`SegmentSpool`
+    """
+    with _root_lock(root):
+        spools = []
+        for name in sorted(os.listdir(root)):
+            path = os.path.join(root, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            try:
+                spools.append(SegmentSpool(path, **kwargs))
+            except BlockingIOError:
+                continue
+    return spools
@@ -1,21 +1,80 @@
 import python_jsonschema_objects as pjo
 from jsl import Document
 
+#: Built models namespaces by schema (jsl class or `id()` of dict schema)
+_schema_models = {}
+
 
 def get_schema_models(schema):
     """
+    Builds models namespace only once per schema, so it's cheap to call it anywhere. Still, prefer calling it
+    on module import, so classes are built at startup.
+
     :param schema: dict or jsl class
     :return: models namespace
     """
 
     if type(schema) is dict:
-        pass
+        key = id(schema)
     elif issubclass(schema, Document):
-        schema = schema.get_schema()
+        key = schema
     else:
         raise TypeError("%s is not valid type" % type(schema))
 
-    return pjo.ObjectBuilder(schema).build_classes()
+    try:
+        source, models = _schema_models[key]
+    except KeyError:
+        pass
+    else:
+        # Identity check protects from `id()` reuse
+        if source is schema:
+            return models
+
+    json_schema = schema.get_schema() if key is schema else schema
+    models = pjo.ObjectBuilder(json_schema).build_classes()
+    _schema_models[key] = (schema, models)
+    return models
+
+
+def _as_primitive(value):
+    if isinstance(value, SlotsModel):
+        return value.as_dict()
+    if isinstance(value, (list, tuple)):
+        return [_as_primitive(x) for x in value]
+    return value
+
+
+class SlotsModel(object):
+    """
+    Lightweight alternative to `python_jsonschema_objects` models for hot (e.g. providers response) types.
+    No validation and no descriptors, just `__slots__` attributes; but the same `as_dict`/`for_json` API.
+    Unset (None) attributes are omitted from output.
+
+    ```
+    class Rate(SlotsModel):
+        __slots__ = ('currency', 'value')
+    ```
+    """
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.pop(name, None))
+        if kwargs:
+            raise TypeError("Unexpected {} attributes: {}".format(self.__class__.__name__, ', '.join(kwargs)))
+
+    def __repr__(self):
+        return "<{} {}>".format(self.__class__.__name__, self.as_dict())
+
+    def as_dict(self):
+        result = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if value is not None:
+                result[name] = _as_primitive(value)
+        return result
+
+    for_json = as_dict
 
 
 def get_domain_zone(domain):
@@ -0,0 +1,114 @@
+from jsonschema.exceptions import ValidationError
+from jsonschema.validators import validator_for
+
+from sgateway.core.helpers import LRUCache
+
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+
+__all__ = ['ValidationError', 'get_validator', 'compile_validator', 'AVAILABLE_BACKENDS', 'DEFAULT_BACKEND']
+
+#: `fastjsonschema` generates python code for a schema and is a lot faster, but it's optional.
+AVAILABLE_BACKENDS = ('jsonschema', 'fastjsonschema') if fastjsonschema else ('jsonschema',)
+DEFAULT_BACKEND = AVAILABLE_BACKENDS[-1]
+
+
+class CompiledValidator(object):
+    """
+    Validator compiled once for a schema. `validate` raises `jsonschema.exceptions.ValidationError`
+    regardless of backend used.
+    """
+
+    __slots__ = ('schema', 'backend', 'validate')
+
+    def __init__(self, schema, backend):
+        self.schema = schema
+        self.backend = backend
+        if backend == 'fastjsonschema':
+            self.validate = self._build_fastjsonschema(schema)
+        else:
+            self.validate = self._build_jsonschema(schema)
+
+    @staticmethod
+    def _build_jsonschema(schema):
+        cls = validator_for(schema)
+        cls.check_schema(schema)
+        return cls(schema).validate
+
+    @staticmethod
+    def _build_fastjsonschema(schema):
+        # jsonschema validates no formats unless format checker is given, so do the same here.
+        formats = {name: _any_format for name in _collect_formats(schema)}
+        validate = fastjsonschema.compile(schema, formats=formats)
+
+        def _validate(data):
+            try:
+                validate(data)
+            except fastjsonschema.JsonSchemaException as e:
+                path = [x for x in getattr(e, 'path', ())][1:]  # First item is always `data`
+                raise ValidationError(e.message, path=path)
+
+        return _validate
+
+
+def _any_format(value):
+    return True
+
+
+def _collect_formats(schema):
+    formats = set()
+    if isinstance(schema, dict):
+        if isinstance(schema.get('format'), str):
+            formats.add(schema['format'])
+        for value in schema.values():
+            formats |= _collect_formats(value)
+    elif isinstance(schema, list):
+        for value in schema:
+            formats |= _collect_formats(value)
+    return formats
+
+
+def compile_validator(schema, backend=None):
+    """
+    :param schema: dict
+    :param backend: one of :data:`AVAILABLE_BACKENDS`, :data:`DEFAULT_BACKEND` if None
+    :return: CompiledValidator
+    """
+    backend = backend or DEFAULT_BACKEND
+    if backend not in AVAILABLE_BACKENDS:
+        raise ValueError("Schema validation backend {} is not available".format(backend))
+
+    if backend != 'jsonschema':
+        try:
+            return CompiledValidator(schema, backend)
+        except Exception:
+            # Backends are not equally complete, so there is always a fallback.
+            pass
+    return CompiledValidator(schema, 'jsonschema')
+
+
+_validators = LRUCache(maxsize=512)
+
+
+def get_validator(schema, key=None, backend=None):
+    """
+    Returns compiled validator for schema, compiling it only on the first call.
+
+    By default validators are cached by schema identity, so it's intended for long-living schemas
+    (e.g. `ServiceMethod.request_schema`). Use `key` for schemas that are built dynamically.
+
+    :param schema: dict
+    :param key: hashable that identifies the schema
+    :param backend: see :func:`compile_validator`
+    :return: CompiledValidator
+    """
+    backend = backend or DEFAULT_BACKEND
+    cache_key = (key if key is not None else id(schema), backend)
+    validator = _validators.get(cache_key)
+    # Identity check protects from `id()` reuse; for keyed schemas it's enough for the schema to be equal.
+    if validator is None or (validator.schema is not schema and (key is None or validator.schema != schema)):
+        validator = compile_validator(schema, backend=backend)
+        _validators.set(cache_key, validator)
+    return validator
@@ -21,7 +21,8 @@ async def root(request):
     for serv in ServiceRegistry().get_services():
         serv = serv(request.app)
         enabled_services["{}_v{}".format(serv.__name__, serv.version)] = {
-            'providers': [str(x(request.app).name) for x in ServiceRegistry().get_providers(serv.name, serv.version)],
+            'providers': [str(x.name) for x in ServiceRegistry().get_provider_instances(request.app, serv.name,
+                                                                                          serv.version)],
         }
 
     data_str = json.dumps({
@@ -1,12 +1,75 @@
+import hashlib
+import json
+import os
+import time
+
 import jwt
 
 from sgateway.core.gateway_exceptions import UnauthorizedApiException, TokenMalformed
+from sgateway.core.helpers import LRUCache
 from sgateway.services.base.middleware import BaseMiddleware
 
 
 # from ssolib import ssoauth
 
 
+class KeyRing(object):
+    """
+    Active keys to verify tokens with, selected by `kid` token header. Tokens without `kid` are verified with
+    the default key (INTERNAL_GATEWAY_KEY).
+
+    Keys are taken from config and, optionally, from a JSON file (`{"kid": "secret"}`) that is re-read
+    when it's modified, so keys can be rotated without a restart.
+    """
+
+    def __init__(self, default_key, keys=None, keys_file=None, check_interval=5):
+        self.default_key = default_key
+        self.config_keys = dict(keys or {})
+        self.keys_file = keys_file
+        self.check_interval = check_interval
+        self.keys = dict(self.config_keys)
+        self._file_mtime = None
+        self._checked_at = 0
+        self.reload()
+
+    def __bool__(self):
+        return bool(self.default_key or self.keys)
+
+    def reload(self):
+        """
+        Re-read keys file if it's changed.
+        """
+        self._checked_at = time.monotonic()
+        if not self.keys_file:
+            return
+
+        try:
+            mtime = os.stat(self.keys_file).st_mtime
+        except OSError:
+            mtime = None
+        if mtime == self._file_mtime:
+            return
+
+        keys = dict(self.config_keys)
+        if mtime is not None:
+            with open(self.keys_file) as f:
+                keys.update(json.load(f))
+        self.keys = keys
+        self._file_mtime = mtime
+
+    def get(self, kid):
+        """
+        :param kid: key id or None for the default key
+        :return: secret or None
+        """
+        if kid is None:
+            return self.default_key
+
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self.reload()
+        return self.keys.get(kid)
+
+
 class AuthMiddleware(BaseMiddleware):
     """
     Supported auth types:
@@ -16,14 +79,70 @@ class AuthMiddleware(BaseMiddleware):
 
     Well... let's for now just work with requests on behalf of entity (entity_id required).
     user_id is optional and only some service methods will use user object.
+
+    Verified tokens are cached (by token digest) until they expire, so a token reused by a caller
+    is verified only once in a while.
     """
     INTERNAL_KEY = None
+    keyring = None
+    verified_tokens = None
 
     def on_registered(self):
         self.INTERNAL_KEY = self.app.config.get('INTERNAL_GATEWAY_KEY')
-        if not self.INTERNAL_KEY:
+        auth_config = self.app.config.get('AUTH_CONFIG', {})
+        self.keyring = KeyRing(self.INTERNAL_KEY,
+                               keys=auth_config.get('KEYS'),
+                               keys_file=auth_config.get('KEYS_FILE'),
+                               check_interval=auth_config.get('KEYS_FILE_CHECK_INTERVAL', 5))
+        if not self.keyring:
             raise Exception("INTERNAL_GATEWAY_KEY needs to be present to use AuthMiddleware")
 
+        self.token_cache_ttl = auth_config.get('TOKENS_CACHE_TTL', 60 * 5)
+        self.verified_tokens = LRUCache(maxsize=auth_config.get('TOKENS_CACHE_SIZE', 10000))
+
+    def get_stats(self):
+        return {
+            'tokens_cache_hits': self.verified_tokens.hits,
+            'tokens_cache_misses': self.verified_tokens.misses,
+        }
+
+    def verify_token(self, bearer_token):
+        """
+        :param bearer_token: str
+        :return: token data
+        """
+        cache_key = hashlib.sha256(bearer_token.encode()).digest()
+        cached = self.verified_tokens.get(cache_key)
+        if cached is not None:
+            kid, secret, token_data = cached
+            # Tokens signed with rotated out keys are not valid anymore
+            if self.keyring.get(kid) == secret:
+                return token_data
+            self.verified_tokens.pop(cache_key)
+
+        try:
+            kid = jwt.get_unverified_header(bearer_token).get('kid')
+        except jwt.InvalidTokenError:
+            raise TokenMalformed("Unable to decode token. Value is: {}".format(bearer_token))
+
+        secret = self.keyring.get(kid)
+        if not secret:
+            raise UnauthorizedApiException("Unknown key: {}".format(kid))
+
+        try:
+            token_data = jwt.decode(bearer_token, secret, algorithms=['HS256'])
+        except jwt.ExpiredSignatureError:
+            raise UnauthorizedApiException("Token expired")
+        except jwt.InvalidTokenError:
+            raise TokenMalformed("Unable to decode token. Value is: {}".format(bearer_token))
+
+        ttl = self.token_cache_ttl
+        if token_data.get('exp') is not None:
+            ttl = min(ttl, token_data['exp'] - time.time())
+        if ttl > 0:
+            self.verified_tokens.set(cache_key, (kid, secret, token_data), ttl=ttl)
+        return token_data
+
     def process_request(self, service_request):
         auth_header = service_request.request.headers.get('Authorization', '')
         self.log.debug("Auth header: {}".format(auth_header))
@@ -51,11 +170,7 @@ class AuthMiddleware(BaseMiddleware):
         elif not bearer_token:
             raise UnauthorizedApiException("No authorization provided")
 
-        secret = self.INTERNAL_KEY
-        try:
-            token_data = jwt.decode(bearer_token, secret, algorithms=['HS256'])
-        except jwt.exceptions.DecodeError:
-            raise TokenMalformed("Unable to decode token. Value is: {}".format(bearer_token))
+        token_data = self.verify_token(bearer_token)
 
         self.log.debug("Auth data: {}".format(token_data))
 
@@ -1,57 +1,238 @@
+import asyncio
 import base64
-import pickle
+import hashlib
+import json
+import struct
+import time
+from inspect import isawaitable
 
-from sgateway.services.base.middleware import BaseMiddleware
-from sgateway.services.request import ServiceResponse
-
-"""
-This straightforward CacheMiddleware is more about demonstration of how it could be implemented.
+from sanic.exceptions import InvalidUsage
 
-Release version must be much more thought through. E.g. pickling is not the best way to serialize response,
-and quering redis all the time will get a lot of cache misses.
-"""
+from sgateway.core.helpers import LRUCache
+from sgateway.services.base.middleware import BaseMiddleware
+from sgateway.services.request import PreRenderedResponse, ServiceStreamResponse
+from sgateway.services.utils import CachePolicy
 
 
 class CacheMiddleware(BaseMiddleware):
     """
-    Middleware expects `global_cache` param in `service_response.extra_params` and if presents -
-    saves response's `response_data` as binary.
+    Middleware caches rendered responses (JSON body, status and headers) of methods exposed with a
+    :class:`sgateway.services.utils.CachePolicy`. Responses with `global_cache` param in
+    `service_response.extra_params` are cached with the default policy as well.
+
+    Cache has two tiers: a small in-process LRU (per worker) in front of Redis. Hot keys are served
+    from the process memory without any round trip, and none of tiers needs response to be encoded again.
+
+    For methods with a cache policy, on a cache miss only one request per key (per worker) goes to the
+    service, concurrent identical requests wait for its result. Entries expired not longer than `STALE_TTL`
+    ago are still served, while a single background task refreshes them (stale-while-revalidate). Responses
+    of other methods are cached only if they ask for it, so their requests are neither coalesced nor refreshed.
 
-    It returns new `ServiceResponse` from process_request.
+    Background refresh calls the service method directly with the request that found the stale entry:
+    middlewares (auth, rate limiting, billing, logging) are not run for it. It's limited to `COALESCE_TIMEOUT`.
+
+    It returns new `PreRenderedResponse` from process_request.
     """
     _cache_key = "cached_response_{request_uniform}"
+    _cache_key_ext = '_cache_key'
+    _inflight_ext = '_cache_inflight'
+
+    #: Entry is prefixed with a timestamp the entry is fresh until.
+    _entry_header = struct.Struct('>d')
+
+    #: Headers that are specific to a particular request and must not be cached.
+    volatile_headers = frozenset(['X-Request-Cost', 'X-Request-Cost-Currency', 'X-Total-Quota', 'X-Service-Quota'])
+
+    def __init__(self, app):
+        super(CacheMiddleware, self).__init__(app)
+        config = app.config.get('CACHE_CONFIG', {})
+        self.default_policy = CachePolicy(ttl=config.get('TTL', 60 * 5))
+        self.stale_ttl = config.get('STALE_TTL', 0)
+        self.local_ttl = config.get('LOCAL_TTL', 30)
+        self.local_cache = LRUCache(maxsize=config.get('LOCAL_MAXSIZE', 1024))
+        self.coalesce_timeout = config.get('COALESCE_TIMEOUT', 10)
+        # cache key -> future of the request (or background refresh) that is going to fill the entry
+        self._inflight = {}
+
+    def _get_policy(self, service_request):
+        return service_request.method.cache_policy or self.default_policy
+
+    async def _get_request_uniform(self, service_request, policy):
+        request = service_request.request
+
+        if policy.vary_by_args is None:
+            query_string = request.query_string
+        else:
+            query_string = '&'.join('{}={}'.format(name, ','.join(request.args.getlist(name, default=[])))
+                                    for name in policy.vary_by_args)
+
+        parts = [service_request.path_repr, base64.b64encode(query_string.encode()).decode()]
+
+        if policy.vary_by_entity:
+            try:
+                parts.append(str(await service_request.entity_id))
+            except AttributeError:
+                parts.append('')
+
+        if request.method == 'POST':
+            # Normalized, so the same data in any formatting gets the same key.
+            body = json.dumps(request.json, sort_keys=True, separators=(',', ':'))
+            parts.append(hashlib.sha1(body.encode()).hexdigest())
+
+        return base64.b64encode('_'.join(parts).encode()).decode()
+
+    async def _get_cache_key(self, service_request):
+        """
+        :return: cache key or None if the request is not cacheable
+        """
+        policy = self._get_policy(service_request)
+        if not policy.allows(service_request.request.method):
+            return None
+        try:
+            request_uniform = await self._get_request_uniform(service_request, policy)
+        except InvalidUsage:
+            # Broken JSON body
+            return None
+        return self._cache_key.format(request_uniform=request_uniform)
+
+    def _is_cacheable(self, service_request, service_response):
+        if not service_response or isinstance(service_response, ServiceStreamResponse):
+            return False
+        if service_request.method.cache_policy is not None:
+            return service_response.request_fulfilled and service_response.status_code < 400
+        return bool(service_response.extra_params.get('global_cache'))
+
+    def _pack_entry(self, service_response, ttl):
+        cache_response = service_response.prerender()
+        for header in self.volatile_headers.intersection(cache_response.extra_headers):
+            del cache_response.extra_headers[header]
+        return self._entry_header.pack(time.time() + ttl) + cache_response.dumps()
 
-    def _get_request_uniform(self, service_request):
-        query_string = base64.b64encode(service_request.request.query_string.encode()).decode()
-        return base64.b64encode("{}_{}".format(service_request.path_repr,
-                                               query_string).encode()).decode()
+    def _unpack_entry(self, cache_val):
+        """
+        :return: tuple (fresh_until, PreRenderedResponse)
+        """
+        fresh_until, = self._entry_header.unpack_from(cache_val)
+        response = PreRenderedResponse.loads(cache_val[self._entry_header.size:], request_fulfilled=True)
+        return fresh_until, response
+
+    async def _get_cached(self, cache_key):
+        """
+        :return: bytes (packed entry) or None
+        """
+        cached_val = self.local_cache.get(cache_key)
+        if cached_val is not None:
+            return cached_val
+
+        with await self.app.redis_pool as conn:
+            # Both commands are pipelined within one round trip.
+            cached_val, ttl = await asyncio.gather(conn.get(cache_key), conn.ttl(cache_key))
+
+        if cached_val:
+            # Local copy must not outlive the shared one.
+            local_ttl = min(self.local_ttl, ttl) if ttl > 0 else self.local_ttl
+            self.local_cache.set(cache_key, cached_val, ttl=local_ttl)
+        return cached_val
+
+    async def _set_cached(self, cache_key, service_request, service_response):
+        """
+        :return: bytes (packed entry) or None if response is not cached
+        """
+        policy = self._get_policy(service_request)
+        ttl = policy.get_ttl(service_request)
+        cache_val = self._pack_entry(service_response, ttl)
+        if policy.max_size is not None and len(cache_val) - self._entry_header.size > policy.max_size:
+            self.log.debug("Response is too big to be cached. Key: {}".format(cache_key))
+            return None
+
+        self.local_cache.set(cache_key, cache_val, ttl=min(self.local_ttl, ttl + self.stale_ttl))
+        with await self.app.redis_pool as conn:
+            await conn.setex(cache_key, ttl + self.stale_ttl, cache_val)
+        self.log.debug("Put resp in cache. Key: {}".format(cache_key))
+        return cache_val
+
+    def _resolve_inflight(self, cache_key, cache_val):
+        future = self._inflight.pop(cache_key, None)
+        if future is not None and not future.done():
+            future.set_result(cache_val)
+
+    async def _wait_inflight(self, future):
+        """
+        :return: bytes (packed entry) or None if there is no result to share
+        """
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.coalesce_timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def _refresh(self, cache_key, service_request):
+        """
+        Calls service method in background to replace stale entry.
+        """
+        cache_val = None
+        try:
+            service_response = service_request.service.call_method(service_request.method.class_attr,
+                                                                   service_request)
+            if isawaitable(service_response):
+                service_response = await asyncio.wait_for(service_response, self.coalesce_timeout)
+            if self._is_cacheable(service_request, service_response):
+                cache_val = await self._set_cached(cache_key, service_request, service_response)
+        except asyncio.TimeoutError:
+            self.log.warning("Cache entry refresh timed out. Key: {}".format(cache_key))
+        except Exception:
+            self.log.exception("Can not refresh cache entry. Key: {}".format(cache_key))
+        finally:
+            self._resolve_inflight(cache_key, cache_val)
 
     async def process_request(self, service_request):
-        if service_request.request.method != 'GET':
+        cache_key = await self._get_cache_key(service_request)
+        if cache_key is None:
             return
-
-        cache_key = self._cache_key.format(request_uniform=self._get_request_uniform(service_request))
         self.log.debug('cache_key: {}'.format(cache_key))
 
-        with await self.app.redis_pool as conn:
-            cached_val = await conn.get(cache_key)
+        cached_val = await self._get_cached(cache_key)
+        coalesce = service_request.method.cache_policy is not None
 
         if cached_val:
-            val = pickle.loads(cached_val)
-            self.log.debug("Use cached val: {}".format(val))
-            service_request.add_loggable_property('from_cache', True)
-            return ServiceResponse(val, request_fulfilled=True)
+            fresh_until, response = self._unpack_entry(cached_val)
+            if fresh_until > time.time() or (self.stale_ttl and coalesce):
+                if fresh_until <= time.time() and cache_key not in self._inflight:
+                    self.log.debug("Serve stale val, refreshing: {}".format(cache_key))
+                    self._inflight[cache_key] = self.app.loop.create_future()
+                    self.app.loop.create_task(self._refresh(cache_key, service_request))
+                self.log.debug("Use cached val: {}".format(cache_key))
+                service_request.add_loggable_property('from_cache', True)
+                # Always a new response object: underlying middlewares are free to alter it.
+                return response
 
-    async def process_response(self, service_request, service_response, gateway_error):
-        if service_request.request.method != 'GET':
+        if not coalesce:
+            # Response is cached only if it has `global_cache`, don't make identical requests wait for it
+            service_request.add_extension(self._cache_key_ext, cache_key)
             return
-        if not service_response:
+
+        future = self._inflight.get(cache_key)
+        if future is not None:
+            cached_val = await self._wait_inflight(future)
+            if cached_val:
+                service_request.add_loggable_property('from_cache', True)
+                return self._unpack_entry(cached_val)[1]
+            # Nothing to share (e.g. response is not cacheable). Go to the service on its own.
+            return
+
+        # This request fills the entry
+        self._inflight[cache_key] = self.app.loop.create_future()
+        service_request.add_extension(self._cache_key_ext, cache_key)
+        service_request.add_extension(self._inflight_ext, True)
+
+    async def process_response(self, service_request, service_response, gateway_error):
+        cache_key = service_request.get_extension(self._cache_key_ext)
+        if cache_key is None:
             return
 
-        if service_response.extra_params.get('global_cache'):
-            cache_val = pickle.dumps(service_response.response_data)
-            cache_key = self._cache_key.format(request_uniform=self._get_request_uniform(service_request))
-            with await self.app.redis_pool as conn:
-                # Cache for 5 mins
-                await conn.setex(cache_key, 60 * 5, cache_val)
-            self.log.debug("Put resp in cache. Key: {}".format(cache_key))
+        cache_val = None
+        try:
+            if self._is_cacheable(service_request, service_response):
+                cache_val = await self._set_cached(cache_key, service_request, service_response)
+        finally:
+            if service_request.get_extension(self._inflight_ext):
+                self._resolve_inflight(cache_key, cache_val)
@@ -1,10 +1,15 @@
+import asyncio
 import time
+import zlib
+from pydoc import locate
 
-from sqlalchemy import Table, Column, Integer, String, desc
+from sqlalchemy import Table, Column, Index, Integer, LargeBinary, String
+from sqlalchemy.dialects.postgresql import insert
 
 from sgateway.core.db import metadata
 from sgateway.core.gateway_exceptions import RequestIdempotencyError
 from sgateway.services.base.middleware import BaseMiddleware
+from sgateway.services.request import PreRenderedResponse, ServiceStreamResponse
 
 IDEMPOTENCY_TTL = 60 * 60 * 24  # One day
 
@@ -13,10 +18,136 @@ IdempotencyModel = Table(
     Column('key', String(32)),
     Column('timestamp', Integer, nullable=False, default=time.time),
     Column('scope_id', String(60)),
-    # UniqueConstraint('key', 'scope_id', name='uix_1')
+    Column('response', LargeBinary, nullable=True),
+    Index('ix_idempotancy_request_lookup', 'key', 'scope_id', unique=True),
+    Index('ix_idempotancy_request_timestamp', 'timestamp'),
 )
 
 
+class BaseIdempotencyStore(object):
+    """
+    Keeps idempotency locks: the first request with a key acquires the lock, and duplicates are declined
+    until the lock is released (request failed) or expired. Once the request is fulfilled, its response is saved
+    along with the lock, so duplicates get it instead.
+    """
+
+    #: How often expired locks must be purged (seconds), None if store expires them itself.
+    purge_interval = None
+
+    def __init__(self, app, ttl):
+        self.app = app
+        self.ttl = ttl
+
+    async def acquire(self, key, scope_id):
+        """
+        :return: None if lock is acquired, or saved response (bytes) if the request is already fulfilled
+        :raise: RequestIdempotencyError if the lock is acquired by a request that is still in progress
+        """
+        raise NotImplementedError()
+
+    async def release(self, key, scope_id):
+        raise NotImplementedError()
+
+    async def save_response(self, key, scope_id, response):
+        """
+        :param response: bytes
+        """
+        raise NotImplementedError()
+
+    async def purge(self):
+        """
+        Delete expired locks.
+        """
+        return
+
+
+class RedisIdempotencyStore(BaseIdempotencyStore):
+    """
+    Lock is a key with expiry set atomically with `SET NX EX`, so Redis expires locks itself.
+    """
+
+    _lock_key = "idempotency_{scope_id}_{key}"
+    _response_key = "idempotency_response_{scope_id}_{key}"
+
+    async def acquire(self, key, scope_id):
+        if self.ttl <= 0:
+            return
+
+        lock_key = self._lock_key.format(scope_id=scope_id, key=key)
+        with await self.app.redis_pool as conn:
+            acquired = await conn.set(lock_key, int(time.time()), expire=self.ttl, exist=conn.SET_IF_NOT_EXIST)
+            if not acquired:
+                response, ttl = await asyncio.gather(
+                    conn.get(self._response_key.format(scope_id=scope_id, key=key)), conn.ttl(lock_key))
+                if response:
+                    return response
+                raise RequestIdempotencyError("Lock expiring in {} sec".format(ttl))
+
+    async def release(self, key, scope_id):
+        with await self.app.redis_pool as conn:
+            await conn.delete(self._lock_key.format(scope_id=scope_id, key=key))
+
+    async def save_response(self, key, scope_id, response):
+        if self.ttl <= 0:
+            return
+
+        with await self.app.redis_pool as conn:
+            await conn.setex(self._response_key.format(scope_id=scope_id, key=key), self.ttl, response)
+
+
+class PostgresIdempotencyStore(BaseIdempotencyStore):
+    """
+    Durable store. Locks are rows in `idempotancy_request`, expired ones are purged periodically.
+
+    There is one row per (key, scope_id), so the lock is acquired by a single insert: of concurrent requests
+    only one gets the row inserted (or an expired, not yet purged one replaced), the rest get a conflict.
+    """
+
+    purge_interval = 60 * 60
+
+    async def acquire(self, key, scope_id):
+        now = int(time.time())
+        async with self.app.db.connection() as connection:
+            q = insert(IdempotencyModel).values(key=key, scope_id=scope_id, timestamp=now).on_conflict_do_update(
+                index_elements=['key', 'scope_id'],
+                set_={'timestamp': now, 'response': None},
+                where=(IdempotencyModel.c.timestamp <= (now - self.ttl)),
+            ).returning(IdempotencyModel.c.key)
+            cursor = await connection.execute(q)
+            if await cursor.fetchone() is not None:
+                return
+
+            q = IdempotencyModel.select((IdempotencyModel.c.key == key) & (IdempotencyModel.c.scope_id == scope_id))
+            cursor = await connection.execute(q)
+            idempotency_obj = await cursor.fetchone()
+
+        if idempotency_obj is None:
+            # Released right after the conflict, next attempt may acquire it
+            raise RequestIdempotencyError("Lock is released")
+        if idempotency_obj.response is not None:
+            return bytes(idempotency_obj.response)
+        # We disallow new requests until previous request finished with some error (key will be deleted)
+        # or when timer expired.
+        raise RequestIdempotencyError("Lock expiring in {} sec".format(idempotency_obj.timestamp - (now - self.ttl)))
+
+    async def release(self, key, scope_id):
+        async with self.app.db.connection() as connection:
+            q = IdempotencyModel.delete().where((IdempotencyModel.c.key == key) &
+                                                (IdempotencyModel.c.scope_id == scope_id))
+            await connection.execute(q)
+
+    async def save_response(self, key, scope_id, response):
+        async with self.app.db.connection() as connection:
+            q = IdempotencyModel.update().where((IdempotencyModel.c.key == key) &
+                                                (IdempotencyModel.c.scope_id == scope_id)).values(response=response)
+            await connection.execute(q)
+
+    async def purge(self):
+        async with self.app.db.connection() as connection:
+            q = IdempotencyModel.delete().where(IdempotencyModel.c.timestamp <= (time.time() - self.ttl))
+            await connection.execute(q)
+
+
 class IdempotencyKeyMiddleware(BaseMiddleware):
     """
     Refer to https://brandur.org/idempotency-keys.
@@ -24,19 +155,50 @@ class IdempotencyKeyMiddleware(BaseMiddleware):
     of view) transfer can't happen twice, because of e.g. network problems - you send idempotency_key with
     every request, so gateway can understand that those requests are the same.
 
-    Now it's just decline inidempotent requests. But actually that's not the right way. I see two options here:
-    - on a duplicated request, we can return the saved response (e.g. pickled and stored in IdempotencyModel),
-    like we do for cache.
-    - or we can try to delegate decision to Service Method. So, in case with money transfer, service would lookup
-    database for the transfer with e.g. provided transaction id and return this transfer's status without creating
-    a new one. (in real world though it obviously would be a different scenario)
+    Locks are kept in a store (see `IDEMPOTENCY_STORE_CLASS` config): Redis by default, or Postgres if locks
+    must survive Redis flush.
+
+    On a duplicated request the saved response of the original one is returned (rendered and compressed, like
+    we do for cache). If the original request is still in progress - duplicate waits for it up to `wait_timeout`
+    seconds and is declined only after that. If the original one fails - the first waiting duplicate takes over.
     """
 
     webhook_friendly = True
 
-    def __init__(self, *args, ttl=IDEMPOTENCY_TTL, **kwargs):
+    #: Seconds between checks if the original request is finished.
+    poll_interval = 0.1
+
+    def __init__(self, *args, ttl=IDEMPOTENCY_TTL, store_class=None, wait_timeout=10, **kwargs):
         self.ttl = ttl
+        self.wait_timeout = wait_timeout
         super(IdempotencyKeyMiddleware, self).__init__(*args, **kwargs)
+        if store_class is None:
+            store_class = locate(self.app.config.get('IDEMPOTENCY_STORE_CLASS',
+                                                     'sgateway.middlewares.idempotency_key.RedisIdempotencyStore'))
+        self.store = store_class(self.app, ttl)
+        self._purge_task = None
+
+    def on_registered(self):
+        if not self.store.purge_interval:
+            return
+
+        @self.app.listener('after_server_start')
+        async def _start_purge(app, loop):
+            self._purge_task = loop.create_task(self._purge_periodically())
+
+        @self.app.listener('before_server_stop')
+        async def _stop_purge(app, loop):
+            if self._purge_task is not None:
+                self._purge_task.cancel()
+                self._purge_task = None
+
+    async def _purge_periodically(self):
+        while True:
+            try:
+                await self.store.purge()
+            except Exception:
+                self.log.exception("Can not purge expired idempotency locks")
+            await asyncio.sleep(self.store.purge_interval)
 
     async def get_scope(self, service_request):
         try:
@@ -50,23 +212,18 @@ class IdempotencyKeyMiddleware(BaseMiddleware):
         )
 
     async def check(self, service_request, key):
+        """
+        :return: saved response (bytes) of the original request or None if this request is the original one
+        """
         scope_id = await self.get_scope(service_request)
-
-        async with service_request.db_connection() as connection:
-            q = IdempotencyModel.select(
-                ((IdempotencyModel.c.key == key) &
-                 (IdempotencyModel.c.scope_id == scope_id) &
-                 (IdempotencyModel.c.timestamp > (time.time() - self.ttl))),
-                for_update=True).order_by(desc(IdempotencyModel.c.timestamp))
-            cursor = await connection.execute(q)
-            idempotency_obj = await cursor.fetchone()
-            if idempotency_obj:
-                # We disallow new requests until previous request finished with some error (key will be deleted)
-                # or when timer expired.
-                raise RequestIdempotencyError("Lock expiring in {} sec".format(
-                    idempotency_obj.timestamp - int(time.time() - self.ttl)))
-
-            await connection.execute(IdempotencyModel.insert().values(key=key, scope_id=scope_id))
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            try:
+                return await self.store.acquire(key, scope_id)
+            except RequestIdempotencyError:
+                if time.monotonic() + self.poll_interval > deadline:
+                    raise
+            await asyncio.sleep(self.poll_interval)
 
     async def process_request(self, service_request):
         if service_request.request is None:
@@ -77,7 +234,10 @@ class IdempotencyKeyMiddleware(BaseMiddleware):
         if not idempotency_key:
             return
 
-        await self.check(service_request, idempotency_key)
+        saved_response = await self.check(service_request, idempotency_key)
+        if saved_response is not None:
+            service_request.add_loggable_property('idempotent_replay', True)
+            return PreRenderedResponse.loads(zlib.decompress(saved_response), request_fulfilled=True)
         service_request.add_extension('_idempotency_key', idempotency_key)
 
     async def process_response(self, service_request, service_response, gateway_error):
@@ -88,9 +248,11 @@ class IdempotencyKeyMiddleware(BaseMiddleware):
         if not service_response or not service_response.request_fulfilled:
             # Free up on error:
             # We treat it like non-executed task, so it is now safe to repeat it.
-            scope_id = await self.get_scope(service_request)
+            await self.store.release(idempotency_key, await self.get_scope(service_request))
+            return
 
-            async with service_request.db_connection() as connection:
-                q = IdempotencyModel.delete().where((IdempotencyModel.c.key == idempotency_key) &
-                                                    (IdempotencyModel.c.scope_id == scope_id))
-                await connection.execute(q)
+        if isinstance(service_response, ServiceStreamResponse):
+            # Can't be replayed, so duplicates are just declined
+            return
+        await self.store.save_response(idempotency_key, await self.get_scope(service_request),
+                                       zlib.compress(service_response.prerender().dumps()))
@@ -1,7 +1,12 @@
+import asyncio
+import collections
+import json
 import time
+from inspect import isawaitable
 
 from sl_mqlib.serializer import JsonSerializer
 
+from sgateway.core.spool import open_worker_spool, orphaned_spools
 from sgateway.services.base.middleware import BaseMiddleware
 
 
@@ -13,8 +18,224 @@ class RequestStartTimeMiddleware(BaseMiddleware):
 
 
 class LoggerMiddleware(BaseMiddleware):
+    """
+    Logs every service request. With `SERVICE_MQ_LOGGING` logs are sent to MQ, but not on the request path:
+    records are put into a bounded buffer that a background task publishes in batches (every `BATCH_SIZE`
+    records or `FLUSH_INTERVAL` seconds).
+
+    When the buffer is full (e.g. MQ is stalled), `OVERFLOW_POLICY` decides what to do:
+        * `drop_new` - new record is dropped;
+        * `drop_oldest` - the oldest buffered record is dropped;
+        * `block` - request waits up to `BLOCK_TIMEOUT` seconds for the buffer to be drained, then record is dropped.
+
+    With `SPOOL_DIR` set, records that would be dropped or can't be published (MQ is unavailable) are written
+    to the on-disk spool instead (see :class:`sgateway.core.spool.SegmentSpool`), and replayed to MQ at
+    `SPOOL_REPLAY_RATE` records per second once it's available again. Every worker has its own spool in
+    `SPOOL_DIR`, spools of workers that are gone are replayed by the others.
+    """
     webhook_friendly = True
 
+    OVERFLOW_POLICIES = ('drop_new', 'drop_oldest', 'block')
+
+    def __init__(self, *args, **kwargs):
+        super(LoggerMiddleware, self).__init__(*args, **kwargs)
+        config = self.app.config.get('MQ_LOGGING_CONFIG', {})
+        self.buffer_size = config.get('BUFFER_SIZE', 10000)
+        self.batch_size = config.get('BATCH_SIZE', 100)
+        self.flush_interval = config.get('FLUSH_INTERVAL', 1)
+        self.overflow_policy = config.get('OVERFLOW_POLICY', 'drop_oldest')
+        self.block_timeout = config.get('BLOCK_TIMEOUT', 0.5)
+        if self.overflow_policy not in self.OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy: {}".format(self.overflow_policy))
+
+        # Spool is opened on start, in the worker process
+        self.spool = None
+        self.spool_dir = config.get('SPOOL_DIR')
+        self.spool_options = {
+            'segment_size': config.get('SPOOL_SEGMENT_SIZE', 16 * 1024 * 1024),
+            'max_segments': config.get('SPOOL_MAX_SEGMENTS', 64),
+            'fsync': config.get('SPOOL_FSYNC', 'interval'),
+            'fsync_interval': config.get('SPOOL_FSYNC_INTERVAL', 1),
+        }
+        self.replay_rate = config.get('SPOOL_REPLAY_RATE', 500)
+        self.replay_interval = config.get('SPOOL_REPLAY_INTERVAL', 5)
+
+        self.buffer = collections.deque()
+        self.published = 0
+        self.dropped = 0
+        self.failed = 0
+        self.spooled = 0
+        self.replayed = 0
+        self._flush_task = None
+        self._replay_task = None
+        self._flush_needed = None
+        self._drained = None
+
+    def on_registered(self):
+        if not self.app.config.get('SERVICE_MQ_LOGGING'):
+            return
+
+        @self.app.listener('after_server_start')
+        async def _start_flushing(app, loop):
+            self.start(loop)
+
+        @self.app.listener('before_server_stop')
+        async def _stop_flushing(app, loop):
+            await self.stop()
+
+    def start(self, loop):
+        self._flush_needed = asyncio.Event(loop=loop)
+        self._drained = asyncio.Event(loop=loop)
+        self._flush_task = loop.create_task(self._flush_periodically())
+        if self.spool_dir:
+            self.spool = open_worker_spool(self.spool_dir, **self.spool_options)
+            self._replay_task = loop.create_task(self._replay_periodically())
+
+    async def stop(self):
+        for task in (self._flush_task, self._replay_task):
+            if task is not None:
+                task.cancel()
+        self._flush_task = self._replay_task = None
+        # Whatever is left
+        await self.flush()
+        if self.spool is not None:
+            self.spool.close()
+
+    def get_stats(self):
+        return {
+            'buffered': len(self.buffer),
+            'published': self.published,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'spooled': self.spooled,
+            'replayed': self.replayed,
+        }
+
+    def _drop(self, records, failed=False):
+        """
+        :param records: list of tuples (service name, log data) that can't go to MQ now
+        :param failed: True if records failed to publish, otherwise they are dropped
+        """
+        if self.spool is not None:
+            spooled = 0
+            try:
+                for service_name, data in records:
+                    self.spool.append(json.dumps([service_name, data]).encode())
+                    spooled += 1
+                return
+            except Exception as e:
+                self.log.warning("Can not spool logs: {}".format(e))
+            finally:
+                self.spooled += spooled
+            records = records[spooled:]
+
+        if failed:
+            self.failed += len(records)
+        else:
+            self.dropped += len(records)
+
+    async def _publish_spooled(self, record):
+        service_name, data = json.loads(record.decode())
+        result = self.log_via_mq(service_name, data)
+        if isawaitable(result):
+            await result
+        self.replayed += 1
+
+    async def replay_orphaned(self):
+        """
+        Replay spools of workers that are gone, and remove them.
+        """
+        spools = orphaned_spools(self.spool_dir, **self.spool_options)
+        try:
+            for spool in spools:
+                replayed = await spool.replay(self._publish_spooled, rate=self.replay_rate,
+                                              batch_size=self.batch_size)
+                self.log.info("Replayed {} logs spooled by a gone worker".format(replayed))
+                spool.destroy()
+        finally:
+            for spool in spools:
+                spool.close()
+
+    async def _replay_periodically(self):
+        while True:
+            await asyncio.sleep(self.replay_interval)
+            if not (self.app.mq_channel and self.app.mq_channel.connected()):
+                continue
+            try:
+                if self.spool.has_pending:
+                    replayed = await self.spool.replay(self._publish_spooled, rate=self.replay_rate,
+                                                       batch_size=self.batch_size)
+                    self.log.info("Replayed {} spooled logs".format(replayed))
+                await self.replay_orphaned()
+            except Exception as e:
+                self.log.warning("Can not replay spooled logs: {}".format(e))
+
+    async def _flush_periodically(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_needed.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_needed.clear()
+            try:
+                await self.flush()
+            except Exception:
+                self.log.exception("Can not flush logs")
+
+    async def flush(self):
+        """
+        Publish all buffered records, `batch_size` records at a time.
+        """
+        while self.buffer:
+            batch = [self.buffer.popleft() for _ in range(min(self.batch_size, len(self.buffer)))]
+            if self._drained is not None:
+                self._drained.set()
+
+            for i, (service_name, data) in enumerate(batch):
+                try:
+                    result = self.log_via_mq(service_name, data)
+                    if isawaitable(result):
+                        await result
+                except Exception as e:
+                    self.log.warning("Can not send {} logs to MQ: {}".format(len(batch) - i, e))
+                    self._drop(batch[i:], failed=True)
+                    break
+                self.published += 1
+            # Let requests go between batches
+            await asyncio.sleep(0)
+
+    async def _wait_drained(self):
+        """
+        :return: True if there is a space in buffer
+        """
+        if self._drained is None:
+            return False
+
+        deadline = time.monotonic() + self.block_timeout
+        while len(self.buffer) >= self.buffer_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                return False
+            self._drained.clear()
+            self._flush_needed.set()
+            try:
+                await asyncio.wait_for(self._drained.wait(), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    async def enqueue(self, service_name, data):
+        if len(self.buffer) >= self.buffer_size:
+            if self.overflow_policy == 'drop_oldest':
+                self._drop([self.buffer.popleft()])
+            elif self.overflow_policy == 'drop_new' or not await self._wait_drained():
+                self._drop([(service_name, data)])
+                return
+
+        self.buffer.append((service_name, data))
+        if len(self.buffer) >= self.batch_size and self._flush_needed is not None:
+            self._flush_needed.set()
+
     def log_via_mq(self, service_name, data):
         if not self.app.mq_channel:
             raise ConnectionError("MQ producer not available")
@@ -26,7 +247,7 @@ class LoggerMiddleware(BaseMiddleware):
                                      routing_key='sgateway.log.service_request.{}'.format(service_name),
                                      serializer_class=JsonSerializer)
 
-    def process_response(self, service_request, service_response, gateway_error):
+    async def process_response(self, service_request, service_response, gateway_error):
 
         # Do internal debug logging
         if not service_response:
@@ -67,13 +288,6 @@ class LoggerMiddleware(BaseMiddleware):
 
 
         if self.app.config.get('SERVICE_MQ_LOGGING'):
-            try:
-                self.log_via_mq(service_request.service.name, log_data)
-            except Exception as e:
-                if self.app.debug:
-                    raise
-
-                # TODO: Ignore logging problem for now, but basically logs are essential.
-                self.log.warning("Can not send log to MQ: {}".format(e))
+            await self.enqueue(service_request.service.name, log_data)
         else:
             self.log.debug("Log data: {}".format(log_data))
@@ -1,4 +1,8 @@
+import asyncio
+import time
+
 from sgateway.core.gateway_exceptions import TotalQuotaExceeded, ServiceQuotaExceeded
+from sgateway.core.redis_scripts import RedisScript
 from sgateway.services.base.middleware import BaseMiddleware
 
 ONE_HOUR = 60 * 60
@@ -8,7 +12,12 @@ Rate limiting config must be stored in Central Config and be manageable by admin
 So something like `expose_method` decorator parameters is actually not a good place for it.
 
 Rate limits are applied on per-entity level. The quota could be extended by additional payments to Semilimes,
-so don't consider those as a constant values anyway. 
+so don't consider those as a constant values anyway.
+
+Algorithms:
+    * `fixed` - counter that is reset every `window` seconds (the default);
+    * `sliding` - sliding window counter, previous window counts in proportion to its overlap with the current one;
+    * `token_bucket` - bucket of `quota` tokens refilled evenly over the `window`.
 """
 
 RATE_LIMITS = {
@@ -16,6 +25,7 @@ RATE_LIMITS = {
     'total': {
         'quota': 5000,
         'window': ONE_HOUR,
+        'algorithm': 'sliding',
     },
     'per_service': {
         'email': {
@@ -27,14 +37,162 @@ RATE_LIMITS = {
             'quota': 100,
             'window': 60,
             'only_limit_fulfilled': True,
+            'algorithm': 'token_bucket',
         }
     },
 }
 
+ALGORITHMS = ('fixed', 'sliding', 'token_bucket')
+
+#: Checks and consumes all the limits at once.
+#: KEYS - limit keys. ARGV - now, then (algorithm, quota, window, cost) for every key.
+#: Returns {0, left_1, left_2, ..., reset_1, reset_2, ...} or {index of exceeded limit} and nothing is consumed then.
+#: `reset` is milliseconds until the current window of the limit ends, -1 if consumed quota is not tied to a window.
+#: Negative cost refunds previously consumed quota.
+RATE_LIMIT_SCRIPT = RedisScript("""
+local now = tonumber(ARGV[1])
+
+local function fixed(key, quota, window, consume)
+    if consume == 0 then
+        return tonumber(redis.call('GET', key) or '0')
+    end
+    if consume < 0 and redis.call('EXISTS', key) == 0 then
+        return 0
+    end
+    local usage = redis.call('INCRBY', key, consume)
+    if window > 0 and redis.call('TTL', key) < 0 then
+        redis.call('EXPIRE', key, window)
+    end
+    return usage
+end
+
+local function sliding(key, quota, window, consume)
+    local idx = math.floor(now / window)
+    local current = tonumber(redis.call('HGET', key, idx) or '0')
+    local previous = tonumber(redis.call('HGET', key, idx - 1) or '0')
+    if consume > 0 or (consume < 0 and current > 0) then
+        current = math.max(0, current + consume)
+        redis.call('HSET', key, idx, current)
+        redis.call('HDEL', key, idx - 2)
+        redis.call('EXPIRE', key, window * 2)
+    end
+    return current + previous * (1 - (now - idx * window) / window)
+end
+
+local function token_bucket(key, quota, window, consume)
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or quota
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(quota, tokens + math.max(0, now - ts) * quota / window)
+    if consume ~= 0 then
+        tokens = math.min(quota, tokens - consume)
+        redis.call('HMSET', key, 'tokens', tokens, 'ts', now)
+        redis.call('EXPIRE', key, math.ceil(window))
+    end
+    return quota - tokens
+end
+
+local function resets_in(key, algorithm, window)
+    if algorithm == 'fixed' then
+        return redis.call('PTTL', key)
+    elseif algorithm == 'sliding' then
+        return math.floor(((math.floor(now / window) + 1) * window - now) * 1000)
+    end
+    return -1
+end
+
+local algorithms = {fixed = fixed, sliding = sliding, token_bucket = token_bucket}
+local limits = {}
+for i = 1, #KEYS do
+    local offset = 2 + (i - 1) * 4
+    limits[i] = {algorithms[ARGV[offset]], tonumber(ARGV[offset + 1]), tonumber(ARGV[offset + 2]),
+                 tonumber(ARGV[offset + 3]), ARGV[offset]}
+end
+
+for i, limit in ipairs(limits) do
+    if limit[4] > 0 and limit[1](KEYS[i], limit[2], limit[3], 0) + limit[4] > limit[2] then
+        return {i}
+    end
+end
+
+local result = {0}
+for i, limit in ipairs(limits) do
+    result[i + 1] = math.floor(limit[2] - limit[1](KEYS[i], limit[2], limit[3], limit[4]))
+    result[#limits + i + 1] = resets_in(KEYS[i], limit[5], limit[3])
+end
+return result
+""")
+
+
+class QuotaLease(object):
+    """
+    Slice of a quota that is consumed in Redis upfront and then spent by the worker locally.
+    """
+
+    __slots__ = ('limit', 'tokens', 'left', 'used_at', 'expires_at')
+
+    def __init__(self, limit, tokens, left, expires_in=None):
+        """
+        :param limit: limit config
+        :param tokens: int, number of requests that can be admitted locally
+        :param left: int, requests left in Redis after the lease was taken
+        :param expires_in: seconds until the window the lease was taken in ends, None if lease is not tied to it
+        """
+        self.limit = limit
+        self.tokens = tokens
+        self.left = left
+        self.used_at = time.monotonic()
+        self.expires_at = None if expires_in is None else self.used_at + expires_in
+
+    def is_expired(self, now=None):
+        if self.expires_at is None:
+            return False
+        return (time.monotonic() if now is None else now) >= self.expires_at
+
 
 class RateLimitingMiddleware(BaseMiddleware):
+    """
+    Quota is checked and consumed (reserved) in a single atomic Redis call on request. If request
+    shouldn't be counted (error, or unfulfilled for `only_limit_fulfilled` services) - reservation is refunded.
+
+    With `LEASE_SIZE` set in `RATE_LIMITING_CONFIG`, every worker reserves quotas in slices (leases) and
+    admits requests from memory until the lease is spent, so Redis is not on the request path at all.
+    Leases are taken only for quotas much bigger than the lease, and when entity gets close to its quota
+    requests are checked in Redis one by one again. Leases that are not used for `LEASE_IDLE_TTL` seconds
+    are returned back to Redis in a batch.
+
+    Leases of window-based limits (`fixed`, `sliding`) expire with the window they were taken in: tokens
+    of an expired lease are neither spent nor returned, as they belong to a counter that is already reset.
+    """
+
+    #: Leases are taken only for limits with quota at least this many times bigger than the lease.
+    lease_quota_factor = 10
+    #: How many times a request tries to take leases, concurrent requests could spend or release them meanwhile.
+    lease_attempts = 3
+
     def __init__(self, *args, **kwargs):
         super(RateLimitingMiddleware, self).__init__(*args, **kwargs)
+        config = self.app.config.get('RATE_LIMITING_CONFIG', {})
+        self.lease_size = config.get('LEASE_SIZE', 0)
+        self.lease_idle_ttl = config.get('LEASE_IDLE_TTL', 10)
+        self.sync_interval = config.get('LEASE_SYNC_INTERVAL', 5)
+        self._leases = {}  # redis key -> QuotaLease
+        self._sync_task = None
+
+    def on_registered(self):
+        if not self.lease_size:
+            return
+
+        @self.app.listener('after_server_start')
+        async def _start_leases_sync(app, loop):
+            self._sync_task = loop.create_task(self._sync_leases())
+
+        @self.app.listener('before_server_stop')
+        async def _stop_leases_sync(app, loop):
+            if self._sync_task is not None:
+                self._sync_task.cancel()
+                self._sync_task = None
+            await self._release_leases()
 
     async def _get_total_key(self, service_request, entity_id):
         return 'total_api_usage_{}'.format(entity_id)
@@ -42,84 +200,176 @@ class RateLimitingMiddleware(BaseMiddleware):
     async def _get_service_key(self, service_request, entity_id):
         return 'service_usage_{}_{}'.format(service_request.service.name, entity_id)
 
-    async def process_request(self, service_request):
-
-        async def number_left(rconn, key_name, quota, expire):
-            """
-            :param rconn: aioredis.connection.RedisConnection or Pool
-            :param key_name: redis key
-            :param quota: int
-            :param expire: int
-            :return: Bool (if do need to raise error)
-            """
-
-            if quota >= 0:
-                current_usage = await rconn.get(key_name)
-                if current_usage is None:
-                    if expire:
-                        rconn.setex(key_name, expire, 0)
-                    else:
-                        rconn.set(key_name, 0)
-                    current_usage = 0
-            else:
-                current_usage = 0
+    @staticmethod
+    def _limit_key(key, limit):
+        algorithm = limit.get('algorithm', 'fixed')
+        if algorithm not in ALGORITHMS:
+            raise ValueError("Unknown rate limiting algorithm: {}".format(algorithm))
+        # Different algorithms keep different data types
+        return key if algorithm == 'fixed' else '{}:{}'.format(key, algorithm)
 
-            return quota - int(current_usage)
+    async def _get_limits(self, service_request, entity_id):
+        """
+        :return: list of tuples (extension name, exception class, redis key, limit config)
+        """
+        limits = []
+        service_limit = RATE_LIMITS['per_service'].get(service_request.service.name, {})
+        if service_limit.get('quota', -1) >= 0:
+            key = self._limit_key(await self._get_service_key(service_request, entity_id), service_limit)
+            limits.append(('service_requests_left', ServiceQuotaExceeded, key, service_limit))
 
-        try:
-            entity_id = await service_request.entity_id
-        except AttributeError:
-            return
+        total_limit = RATE_LIMITS['total']
+        if total_limit.get('quota', -1) >= 0:
+            key = self._limit_key(await self._get_total_key(service_request, entity_id), total_limit)
+            limits.append(('total_requests_left', TotalQuotaExceeded, key, total_limit))
+        return limits
 
-        total_limit, total_expire = RATE_LIMITS['total']['quota'], RATE_LIMITS['total']['window']
-        _service_limit = RATE_LIMITS['per_service'].get(service_request.service.name, {})
-        service_limit, service_expire = _service_limit.get('quota', -1), _service_limit.get('window', None)
+    async def _call_script(self, items):
+        """
+        :param items: list of tuples (redis key, limit config, cost)
+        :return: list, see `RATE_LIMIT_SCRIPT`
+        """
+        args = [time.time()]
+        for _, limit, cost in items:
+            args.extend([limit.get('algorithm', 'fixed'), limit['quota'], limit.get('window') or 0, cost])
 
         with await self.app.redis_pool as conn:
-            # Check service requests quota
-            service_requests_left = await number_left(conn, await self._get_service_key(service_request, entity_id),
-                                                      service_limit, service_expire)
+            return await RATE_LIMIT_SCRIPT(conn, keys=[x[0] for x in items], args=args)
 
-            if service_requests_left == 0:
-                raise ServiceQuotaExceeded()
+    async def _consume(self, limits, cost):
+        return await self._call_script([(key, limit, cost) for _, _, key, limit in limits])
 
-            if service_requests_left > 0:
-                service_request.add_extension('service_requests_left', service_requests_left)
+    def _is_leasable(self, limits):
+        return self.lease_size and all(
+            limit['quota'] >= self.lease_size * self.lease_quota_factor for _, _, _, limit in limits)
 
-            # Check overall requests quota
-            total_requests_left = await number_left(conn, await self._get_total_key(service_request, entity_id),
-                                                    total_limit, total_expire)
-            if total_requests_left == 0:
-                raise TotalQuotaExceeded()
+    async def _consume_leased(self, limits):
+        """
+        Admits request from local leases, taking new ones if needed.
 
-            if total_requests_left > 0:
-                service_request.add_extension('total_requests_left', total_requests_left)
+        :return: tuple (list of requests left per limit, list of spent leases) or None if leases can't be taken
+        """
+        for attempt in range(self.lease_attempts + 1):
+            now = time.monotonic()
+            leases = [self._leases.get(key) for _, _, key, _ in limits]
+            missing = [(key, limit) for (_, _, key, limit), lease in zip(limits, leases)
+                       if lease is None or lease.tokens <= 0 or lease.is_expired(now)]
+            if not missing:
+                break
+            if attempt == self.lease_attempts:
+                return None
 
-        self.log.debug("Rate Limit Quota is OK")
+            result = await self._call_script([(key, limit, self.lease_size) for key, limit in missing])
+            if result[0]:
+                return None
+            now = time.monotonic()
+            for (key, limit), left, resets_in in zip(missing, result[1:], result[len(missing) + 1:]):
+                expires_in = resets_in / 1000 if resets_in >= 0 else None
+                lease = self._leases.get(key)
+                if lease is None or lease.is_expired(now):
+                    self._leases[key] = QuotaLease(limit, self.lease_size, left, expires_in)
+                else:
+                    # Concurrent request could have taken a lease as well
+                    lease.tokens += self.lease_size
+                    lease.left = left
+                    lease.expires_at = None if expires_in is None else now + expires_in
 
-    async def process_response(self, service_request, service_response, gateway_error):
+        requests_left = []
+        for lease in leases:
+            lease.tokens -= 1
+            lease.used_at = now
+            requests_left.append(lease.left + lease.tokens)
+        return requests_left, leases
+
+    async def _release_leases(self, idle_for=0):
+        """
+        Returns unspent tokens of leases not used for `idle_for` seconds back to Redis in one call.
+        Expired leases are dropped.
+        """
+        now = time.monotonic()
+        released = [key for key, lease in self._leases.items()
+                    if now - lease.used_at >= idle_for or lease.is_expired(now)]
+        items = []
+        for key in released:
+            lease = self._leases.pop(key)
+            if lease.tokens > 0 and not lease.is_expired(now):
+                items.append((key, lease.limit, -lease.tokens))
+        if items:
+            await self._call_script(items)
+            self.log.debug("Released {} quota leases".format(len(items)))
+
+    async def _sync_leases(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self._release_leases(idle_for=self.lease_idle_ttl)
+            except Exception:
+                self.log.exception("Can not release quota leases")
+
+    def _refund_leased(self, limits, leases):
+        """
+        :param leases: leases the request was admitted from
+        :return: limits that have no lease to return the token to
+        """
+        now = time.monotonic()
+        not_refunded = []
+        for limit, lease in zip(limits, leases):
+            if lease.is_expired(now):
+                # Window is over, there is nothing to refund
+                continue
+            if self._leases.get(limit[2]) is lease:
+                lease.tokens += 1
+            else:
+                not_refunded.append(limit)
+        return not_refunded
+
+    async def process_request(self, service_request):
         try:
             entity_id = await service_request.entity_id
         except AttributeError:
             return
 
+        limits = await self._get_limits(service_request, entity_id)
+        if not limits:
+            return
+
+        leased = await self._consume_leased(limits) if self._is_leasable(limits) else None
+        if leased is not None:
+            requests_left, leases = leased
+            service_request.add_extension('_rate_limits_leased', leases)
+        else:
+            result = await self._consume(limits, 1)
+            if result[0]:
+                raise limits[result[0] - 1][1]()
+            requests_left = result[1:len(limits) + 1]
+
+        for (extension_name, _, _, _), left in zip(limits, requests_left):
+            service_request.add_extension(extension_name, left)
+        service_request.add_extension('_rate_limits_reserved', limits)
+
+        self.log.debug("Rate Limit Quota is OK")
+
+    async def process_response(self, service_request, service_response, gateway_error):
+        limits = service_request.get_extension('_rate_limits_reserved')
+        if not limits:
+            return
+
         _only_fulfilled = lambda: RATE_LIMITS['per_service'].get(
             service_request.service.name, {}).get('only_limit_fulfilled', False)
 
         if not service_response or (not service_response.request_fulfilled and _only_fulfilled()):
             # Don't count this request in quotas.
+            leases = service_request.get_extension('_rate_limits_leased')
+            if leases:
+                limits = self._refund_leased(limits, leases)
+            if limits:
+                await self._consume(limits, -1)
             return
 
-        with await self.app.redis_pool as conn:
-            pipe = conn.pipeline()
-            pipe.incr(await self._get_service_key(service_request, entity_id))
-            pipe.incr(await self._get_total_key(service_request, entity_id))
-            self.app.loop.create_task(pipe.execute())
-
         total_requests_left = service_request.get_extension('total_requests_left')
         if total_requests_left is not None:
-            service_response.add_header('X-Total-Quota', total_requests_left - 1)
+            service_response.add_header('X-Total-Quota', total_requests_left)
 
         service_requests_left = service_request.get_extension('service_requests_left')
         if service_requests_left is not None:
-            service_response.add_header('X-Service-Quota', service_requests_left - 1)
+            service_response.add_header('X-Service-Quota', service_requests_left)
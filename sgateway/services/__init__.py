@@ -1,7 +1,7 @@
 from .base.service import BaseService
 from .registry import ServiceRegistry
 from .request import ServiceRequest, ServiceResponse, RequestHandler
-from .utils import expose_method, webhook_callback
+from .utils import CachePolicy, NO_DEADLINE, expose_method, webhook_callback
 
-__all__ = ['BaseService', 'expose_method', 'webhook_callback',
+__all__ = ['BaseService', 'expose_method', 'webhook_callback', 'CachePolicy', 'NO_DEADLINE',
            'ServiceRequest', 'ServiceResponse', 'RequestHandler', 'ServiceRegistry']
@@ -1,16 +1,89 @@
+import asyncio
 import inspect
-from collections import namedtuple
+import time
+from collections import deque, namedtuple
 
-from sgateway.core.gateway_exceptions import ConfigurationError, ProviderError, BaseApiException
+import aiohttp
+
+from sgateway.core.gateway_exceptions import ConfigurationError, ProviderError, BaseApiException, CircuitOpenError
+from sgateway.core.http import BorrowedSession
 from sgateway.core.logs import app_logger
 
-ProviderMethod = namedtuple('ProviderMethod', ['name', 'class_attr'])
+ProviderMethod = namedtuple('ProviderMethod', ['name', 'class_attr', 'hedge_safe'])
+ProviderMethod.__new__.__defaults__ = (False,)
+
+
+class ProviderStats(object):
+    """
+    How provider performs in this worker: exponentially weighted moving averages of calls latency
+    and error rate, and number of calls in flight. Used by load-aware strategies.
+    """
+
+    __slots__ = ('decay', 'latency', 'error_rate', 'inflight', 'calls', 'errors', 'recent_latencies')
+
+    def __init__(self, decay=0.2, window=200):
+        """
+        :param decay: weight of the latest call in averages
+        :param window: number of the latest successful calls to calculate latency percentiles on
+        """
+        self.decay = decay
+        self.recent_latencies = deque(maxlen=window)
+        self.latency = None  # seconds, None until the first call is finished
+        self.error_rate = 0.0
+        self.inflight = 0
+        self.calls = 0
+        self.errors = 0
+
+    def call_started(self):
+        self.inflight += 1
+
+    def call_finished(self, latency, error=False):
+        self.inflight -= 1
+        self.calls += 1
+        if error:
+            self.errors += 1
+        else:
+            self.recent_latencies.append(latency)
+
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.decay * (latency - self.latency)
+        self.error_rate += self.decay * ((1.0 if error else 0.0) - self.error_rate)
+
+    def latency_percentile(self, percentile, min_samples=1):
+        """
+        :param percentile: 0-100
+        :param min_samples: None is returned if there are less calls measured
+        :return: seconds or None
+        """
+        if not self.recent_latencies or len(self.recent_latencies) < min_samples:
+            return None
+        latencies = sorted(self.recent_latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+    def call_cancelled(self):
+        # Latency is unknown, it's not counted
+        self.inflight -= 1
+
+    def as_dict(self):
+        return {
+            'latency': self.latency,
+            'error_rate': self.error_rate,
+            'inflight': self.inflight,
+            'calls': self.calls,
+            'errors': self.errors,
+        }
 
 
 class BaseServiceProvider(object):
     __verbose_name__ = None
     __maintainer_details__ = None
     _registered = False
+    #: Key of the service provider is constructed for, set by registry
+    service_key = None
+    #: Upstream urls to warm up connections to at startup (see `HTTP_CLIENT_CONFIG['PRECONNECT']`)
+    preconnect_urls = ()
 
     @property
     def name(self):
@@ -20,6 +93,7 @@ class BaseServiceProvider(object):
         super(BaseServiceProvider, self).__init__()
         self.app = app
         self.log = app_logger.getChild('providers.{}'.format(self.__class__.__name__))
+        self.stats = ProviderStats()
 
     @classmethod
     def _collect_methods(cls):
@@ -27,33 +101,103 @@ class BaseServiceProvider(object):
         for method_name, method_fn in [(n, m) for n, m in inspect.getmembers(cls)
                                        if hasattr(m, '_provider_method')]:
             found_methods.append(ProviderMethod(method_fn._method_name,
-                                                method_fn.__name__))
+                                                method_fn.__name__,
+                                                getattr(method_fn, '_hedge_safe', False)))
         return tuple(found_methods)
 
+    @classmethod
+    def get_preconnect_urls(cls, config):
+        """
+        Override it when urls depend on config.
+
+        :param config: app config
+        :return: list of urls
+        """
+        return list(cls.preconnect_urls)
+
+    def http_session(self, headers=None, auth=None):
+        """
+        Provider's long-lived session from app's :class:`core.http.HTTPClientManager`. Falls back to
+        a standalone session when manager is not running (e.g. in management commands).
+        Must be used as `async with self.http_session(...) as session`.
+
+        :param headers: default headers
+        :param auth: aiohttp.BasicAuth or None
+        :return: async context manager
+        """
+        http_client = getattr(self.app, 'http_client', None)
+        if http_client is None or not http_client.started:
+            return aiohttp.ClientSession(loop=self.app.loop, headers=headers, auth=auth)
+        session_name = '{}.{}'.format(self.__class__.__module__, self.__class__.__qualname__)
+        return BorrowedSession(http_client.get_session(session_name, headers=headers, auth=auth))
+
     def require_config(self, name):
         value = self.app.config.get(name, None)
         if value is None:
             raise ConfigurationError("{} is required to use {} provider".format(name, self.name))
         return value
 
+    @property
+    def circuit_breaker(self):
+        """
+        :return: :class:`sgateway.core.circuit_breaker.CircuitBreaker` or None if breakers are not used
+        """
+        circuit_breakers = getattr(self.app, 'circuit_breakers', None)
+        if circuit_breakers is None or self.service_key is None:
+            return None
+        return circuit_breakers.get('{}.{}'.format(self.service_key, self.name))
+
+    @property
+    def is_available(self):
+        """
+        False if provider's circuit is open.
+        """
+        breaker = self.circuit_breaker
+        return breaker is None or breaker.is_available
+
     def has_method(self, method_name):
         method = getattr(self, method_name, None)
         return (method and hasattr(method, '_provider_method'))
 
+    def is_hedge_safe(self, method_name):
+        method = getattr(self, method_name, None)
+        return getattr(method, '_hedge_safe', False)
+
     async def call_method(self, method_name, *args, **kwargs):
         method_ = getattr(self, method_name)
         silent = kwargs.pop('_silent', False)
         assert hasattr(method_, '_provider_method'), "Not allowed to be called"
+        breaker = self.circuit_breaker
+        if breaker is not None and not await breaker.allow_call():
+            raise CircuitOpenError("Provider {} is temporarily disabled".format(self.name))
+
+        started_at = time.monotonic()
+        self.stats.call_started()
         try:
             res = method_(*args, **kwargs)
             if inspect.isawaitable(res):
                 res = await res
+        except asyncio.CancelledError:
+            # It's an `Exception` on python < 3.8, e.g. a lost hedge or an expired deadline
+            self.stats.call_cancelled()
+            raise
         except Exception as e:
+            # Client errors (bad request data etc.) are not provider's fault
+            error = not isinstance(e, BaseApiException) or e.status_code >= 500
+            self.stats.call_finished(time.monotonic() - started_at, error=error)
+            if breaker is not None and error:
+                await breaker.record(success=False)
             if isinstance(e, BaseApiException):
                 raise
             # Catch any unexpected errors.
             if not silent:
                 self.log.exception(e)
             raise ProviderError("Error occurred during provider call. Try again later.")
+        except BaseException:
+            self.stats.call_cancelled()
+            raise
 
+        self.stats.call_finished(time.monotonic() - started_at)
+        if breaker is not None:
+            await breaker.record(success=True)
         return res
@@ -1,13 +1,18 @@
+import asyncio
 import inspect
 from collections import namedtuple
 
-from sgateway.core.gateway_exceptions import ProviderUnavailable, FailoverFailError
+from sgateway.core.gateway_exceptions import BaseApiException, ProviderUnavailable, FailoverFailError, CircuitOpenError
+from sgateway.core.gateway_exceptions import DeadlineExceeded
 from sgateway.core.gateway_exceptions import ServiceBadRequestError, ServiceInternalError
 from sgateway.core.logs import app_logger
+from sgateway.core.validation import get_validator
 from sgateway.services.request import ServiceResponse, ServiceStreamResponse
 from sgateway.services.strategies import RoundRobinStrategy
 
-ServiceMethod = namedtuple('ServiceMethod', ['name', 'class_attr', 'webhook', 'http_method', 'request_schema'])
+ServiceMethod = namedtuple('ServiceMethod', ['name', 'class_attr', 'webhook', 'http_method', 'request_schema',
+                                             'cache_policy', 'timeout'])
+ServiceMethod.__new__.__defaults__ = (None, None)
 
 
 class BaseService(object):
@@ -49,7 +54,9 @@ class BaseService(object):
                                                method_fn.__name__,
                                                method_fn._webhook,
                                                method_fn._http_method,
-                                               method_fn._request_schema or {}))
+                                               method_fn._request_schema or {},
+                                               method_fn._cache_policy,
+                                               method_fn._timeout))
         return tuple(found_methods)
 
     def iter_exposed_methods(self):
@@ -59,19 +66,37 @@ class BaseService(object):
         """
         yield from ((x.name, x) for x in self._methods)
 
+    def compile_validators(self):
+        """
+        Compiles request schema validators of exposed methods with the configured backend, so it's done
+        at startup rather than on the first request.
+        """
+        backend = self.app.config.get('SCHEMA_VALIDATION_BACKEND')
+        for _, method in self.iter_exposed_methods():
+            if method.request_schema:
+                get_validator(method.request_schema, backend=backend)
+
     def _get_available_providers(self, required_methods=None):
-        available_providers = self._service_registry.get_providers(self.name,
-                                                                   self.version,
-                                                                   required_methods=required_methods)
+        available_providers = self._service_registry.get_provider_instances(self.app,
+                                                                            self.name,
+                                                                            self.version,
+                                                                            required_methods=required_methods)
         if not available_providers:
             raise ProviderUnavailable("No providers available")
-        return (provider_class(self.app) for provider_class in available_providers)
+
+        # Skip providers with open circuit
+        available_providers = [x for x in available_providers if x.is_available]
+        if not available_providers:
+            raise CircuitOpenError("All providers are temporarily disabled")
+        return available_providers
 
     def _serialize_service(self):
         methods = {method.name: {
             'name': method.name,
             'http_method': method.http_method,
             'request_schema': method.request_schema or {},
+            'cache': method.cache_policy.as_dict() if method.cache_policy else None,
+            'timeout': method.timeout,
         } for _, method in self.iter_exposed_methods()}
 
         return {
@@ -138,11 +163,10 @@ class BaseService(object):
 
         # We don't even need strategy for this case. Just try to find provider among available.
         if provider_name is not None:
-            found_class = self._service_registry.get_provider(
-                service_request.service.name, service_request.service.version, provider_name)
-            if not found_class:
+            selected = self._service_registry.get_provider_instance(
+                self.app, service_request.service.name, service_request.service.version, provider_name)
+            if not selected:
                 raise ProviderUnavailable("Provider '{}' is unavailable for this service.".format(provider_name))
-            selected = found_class(self.app)
 
         # When we need to come up with best suitable
         if not selected:
@@ -168,6 +192,8 @@ class BaseService(object):
         This method tries to guaranty at-least-once delivery. It's up to providers to satisfy at-most-once delivery,
         so be careful.
 
+        Attempts are made only until request deadline, see :class:`sgateway.services.request.ServiceRequest`.
+
         :param service_request:
         :param method_name:
         :param args: passed to provider method
@@ -180,12 +206,18 @@ class BaseService(object):
 
         i = 1
         while available_providers:
-            provider = strategy.select(service_request, available_providers)
+            provider = await self._select_provider(strategy, service_request, available_providers)
+            if provider is None:
+                break
             try:
-                result = await provider.call_method(method_name, *args, _silent=silent, **kwargs)
+                service_request.check_deadline()
+                result = await service_request.within_deadline(
+                    provider.call_method(method_name, *args, _silent=silent, **kwargs))
+            except DeadlineExceeded:
+                raise
             except Exception as e:
                 available_providers.remove(provider)
-                if not silent:
+                if not silent and not isinstance(e, CircuitOpenError):
                     self.log.exception(e)
                 i += 1
                 continue
@@ -204,6 +236,97 @@ class BaseService(object):
 
         raise FailoverFailError()
 
+    async def _select_provider(self, strategy, service_request, providers):
+        selected = strategy.select(service_request, providers)
+        return await selected if inspect.isawaitable(selected) else selected
+
+    def _get_hedge_delay(self, provider):
+        """
+        :return: seconds to wait for provider's answer before the call is hedged
+        """
+        config = self.app.config.get('HEDGING_CONFIG', {})
+        delay = provider.stats.latency_percentile(config.get('PERCENTILE', 95),
+                                                  min_samples=config.get('MIN_SAMPLES', 20))
+        if delay is None:
+            delay = config.get('DEFAULT_DELAY', 1)
+        return max(delay, config.get('MIN_DELAY', 0.05))
+
+    async def hedged_provider_call(self, service_request, method_name, *args, strategy=None, **kwargs):
+        """
+        Calls method of provider selected by strategy. If provider doesn't answer in time (its p95 latency,
+        see `HEDGING_CONFIG`), the same call is made to the next selected provider, and the first successful
+        result is returned while the rest calls are cancelled. Failed call is followed by the next provider
+        immediately, like in :meth:`failover_provider_call`. Client errors (`BaseApiException` with status code
+        below 500) are not failures of a provider, so they are raised right away. If all providers fail, error of
+        the last one is raised.
+
+        Calls are hedged only for methods declared with `provide_method(hedge_safe=True)`, as the same call can be
+        executed by several providers. All the calls are cancelled on request deadline.
+
+        :param service_request:
+        :param method_name:
+        :param strategy: :ref:`BaseProviderChoiceStrategy` instance, the default one if None
+        :param args: passed to provider method
+        :param kwargs: passed to provider method
+        :return:
+        """
+        available_providers = list(self._get_available_providers([method_name]))
+        strategy = strategy if strategy is not None else self._get_strategy()
+        silent = kwargs.pop('_silent', False)
+        max_hedges = self.app.config.get('HEDGING_CONFIG', {}).get('MAX_HEDGES', 1)
+
+        calls = {}  # task -> provider
+        hedges = 0
+        delay = None
+        last_error = None
+        try:
+            while True:
+                # The first call, the next one after failure or the hedged one
+                provider = None
+                if available_providers:
+                    provider = await self._select_provider(strategy, service_request, available_providers)
+                if provider is not None:
+                    available_providers.remove(provider)
+                    calls[asyncio.ensure_future(
+                        provider.call_method(method_name, *args, _silent=silent, **kwargs))] = provider
+                    delay = self._get_hedge_delay(provider) if provider.is_hedge_safe(method_name) else None
+                if not calls:
+                    if last_error is not None:
+                        raise last_error
+                    raise FailoverFailError()
+
+                done = set()
+                while not done:
+                    can_hedge = delay is not None and hedges < max_hedges and available_providers
+                    timeout = delay if can_hedge else None
+                    time_left = service_request.time_left
+                    if time_left is not None and (timeout is None or time_left < timeout):
+                        timeout, can_hedge = time_left, False
+                    done, _ = await asyncio.wait(list(calls), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        if not can_hedge:
+                            raise DeadlineExceeded()
+                        hedges += 1
+                        break
+
+                for call in done:
+                    provider = calls.pop(call)
+                    if call.exception() is None:
+                        if hedges:
+                            service_request.add_loggable_property('hedged', True)
+                        # TODO: can we get out of this implicity?
+                        service_request.add_loggable_property('provider', provider.name)
+                        return call.result()
+                    last_error = call.exception()
+                    if isinstance(last_error, BaseApiException) and last_error.status_code < 500:
+                        raise last_error
+                    if not silent and not isinstance(last_error, CircuitOpenError):
+                        self.log.error("Provider call `{}` via {} failed".format(method_name, provider.name),
+                                       exc_info=last_error)
+        finally:
+            for call in calls:
+                call.cancel()
+
     def result(self, resp_data, **kwargs):
         request_fulfilled = kwargs.pop('request_fulfilled', True)
         return ServiceResponse(resp_data, request_fulfilled, **kwargs)
@@ -0,0 +1,100 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy
+
+DTYPE = numpy.float64
+ROUNDING = ROUND_HALF_UP
+MAX_EXACT_DIGITS = 15  #: Significant digits of amounts and rates that float64 keeps
+TIE_TOLERANCE = 1e-12  #: Relative error bound of results, a few float64 ulps of the amount, rates and triangulation
+
+
+class CrossRateMatrix(object):
+    """
+    Dense cross-rate matrix for bulk conversions: `matrix[index[a], index[b]]` is amount of currency `b`
+    for one unit of currency `a`.
+
+    Precision policy:
+        * rates are kept as float64, triangulated through the reference currency;
+        * amounts are converted to float64, which keeps up to :data:`MAX_EXACT_DIGITS` significant digits,
+          amounts that need more digits (see :meth:`fits`) must be converted in Decimal;
+        * every result is read back to Decimal from its shortest repr and quantized to the requested number of
+          decimal places with :data:`ROUNDING`;
+        * results within :data:`TIE_TOLERANCE` of a rounding tie can round either way, they are not rounded
+          (see :meth:`to_decimals`) and must be converted in Decimal as well.
+
+    So results match exact Decimal arithmetic as long as the caller converts the rejected amounts with
+    :meth:`.rate_table.RateTable.rate`, which are a tiny share of ordinary amounts.
+    """
+
+    __slots__ = ('currencies', 'index', 'matrix')
+
+    def __init__(self, rates):
+        """
+        :param rates: dict, currency -> amount of the currency for one unit of the reference currency
+        """
+        self.currencies = sorted(rates)
+        self.index = {currency: i for i, currency in enumerate(self.currencies)}
+        vector = numpy.array([float(rates[x]) for x in self.currencies], dtype=DTYPE)
+        self.matrix = vector[numpy.newaxis, :] / vector[:, numpy.newaxis]
+
+    @classmethod
+    def from_matrix(cls, currencies, matrix):
+        """
+        :param currencies: sorted currency codes
+        :param matrix: ready N x N array, e.g. mapped from a snapshot
+        """
+        cross_rates = cls.__new__(cls)
+        cross_rates.currencies = list(currencies)
+        cross_rates.index = {currency: i for i, currency in enumerate(cross_rates.currencies)}
+        cross_rates.matrix = matrix
+        return cross_rates
+
+    def __contains__(self, currency):
+        return currency in self.index
+
+    def indexes(self, currencies):
+        """
+        :return: numpy array of indexes
+        :raise: KeyError if a currency is unknown
+        """
+        return numpy.fromiter((self.index[x] for x in currencies), dtype=numpy.intp, count=len(currencies))
+
+    def rate(self, from_currency, to_currency):
+        """
+        :return: float rate
+        """
+        return self.matrix[self.index[from_currency], self.index[to_currency]]
+
+    def convert(self, amounts, from_currencies, to_currencies):
+        """
+        Vectorized conversion, all arguments are of the same length.
+
+        :param amounts: sequence of numbers
+        :return: numpy array of float64 amounts
+        """
+        amounts = numpy.asarray(amounts, dtype=DTYPE)
+        return amounts * self.matrix[self.indexes(from_currencies), self.indexes(to_currencies)]
+
+    @staticmethod
+    def fits(amount, precision):
+        """
+        :param amount: Decimal
+        :param precision: decimal places of the result
+        :return: True if the amount can be converted with float64 according to the precision policy
+        """
+        return len(amount.as_tuple().digits) + precision <= MAX_EXACT_DIGITS
+
+    @staticmethod
+    def to_decimals(values, precision):
+        """
+        Rounds results back to Decimal according to the precision policy.
+
+        :param precision: decimal places
+        :return: list of Decimal, None for results too close to a rounding tie (or not finite)
+        """
+        exponent = Decimal(1).scaleb(-precision)
+        scaled = numpy.abs(values) * 10.0 ** precision
+        with numpy.errstate(invalid='ignore'):
+            reliable = numpy.abs(scaled - numpy.floor(scaled) - 0.5) > scaled * TIE_TOLERANCE
+        return [Decimal(repr(x)).quantize(exponent, ROUNDING) if is_reliable else None
+                for x, is_reliable in zip(values.tolist(), reliable.tolist())]
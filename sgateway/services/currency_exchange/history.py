@@ -0,0 +1,145 @@
+import csv
+import io
+from collections import defaultdict
+from decimal import Decimal
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from .models import HistoricalRateAlias, HistoricalRateTable
+from .rate_table import RateTable
+
+
+class RateHistory(object):
+    """
+    Store of published rates (see :data:`.models.HistoricalRateTable`). Published rates never change, so
+    once rates of a date are saved they are served from the store instead of providers.
+
+    Only rates against the reference currency are kept, rate between any other two currencies is
+    triangulated the same way :class:`RateTable` does. Dates without published rates (weekends, holidays)
+    are saved as aliases of the date providers answered with (see :data:`.models.HistoricalRateAlias`).
+    """
+
+    def __init__(self, app, reference='EUR'):
+        self.app = app
+        self.reference = reference
+
+    async def get_table(self, date):
+        """
+        :param date: datetime.date
+        :return: :class:`RateTable` (of the published date for aliases) or None if rates of the date are not saved
+        """
+        columns, aliases = HistoricalRateTable.c, HistoricalRateAlias.c
+        published = select([aliases.published]).where(
+            (aliases.date == date) & (aliases.base == self.reference)).as_scalar()
+        q = select([columns.date, columns.currency, columns.rate, columns.provider]).where(
+            (columns.date == func.coalesce(published, date)) & (columns.base == self.reference))
+        async with self.app.db.connection() as connection:
+            rows = await (await connection.execute(q)).fetchall()
+        if not rows:
+            return None
+        return RateTable(rows[0].provider, self.reference, rows[0].date, {row.currency: row.rate for row in rows})
+
+    async def get_dates(self, start, end, with_aliases=False):
+        """
+        :param with_aliases: include dates saved as aliases
+        :return: set of dates within [start, end] that have saved rates
+        """
+        columns = HistoricalRateTable.c
+        q = select([columns.date]).distinct().where(
+            (columns.base == self.reference) & (columns.date >= start) & (columns.date <= end))
+        if with_aliases:
+            aliases = HistoricalRateAlias.c
+            q = q.union(select([aliases.date]).where(
+                (aliases.base == self.reference) & (aliases.date >= start) & (aliases.date <= end)))
+        async with self.app.db.connection() as connection:
+            return {row.date for row in await (await connection.execute(q)).fetchall()}
+
+    async def get_series(self, from_currency, to_currency, start, end):
+        """
+        Rate of a currency pair for every date within [start, end] that has saved rates of both currencies.
+
+        :return: list of (datetime.date, Decimal amount of `to_currency` for one unit of `from_currency`)
+        """
+        currencies = {from_currency, to_currency} - {self.reference}
+        if not currencies:
+            return [(date, Decimal(1)) for date in sorted(await self.get_dates(start, end))]
+
+        columns = HistoricalRateTable.c
+        q = select([columns.date, columns.currency, columns.rate]).where(
+            (columns.base == self.reference) & (columns.currency.in_(currencies)) &
+            (columns.date >= start) & (columns.date <= end))
+        async with self.app.db.connection() as connection:
+            rows = await (await connection.execute(q)).fetchall()
+
+        rates = defaultdict(dict)
+        for row in rows:
+            rates[row.date][row.currency] = row.rate
+        series = []
+        for date in sorted(rates):
+            if len(rates[date]) < len(currencies):
+                continue
+            rate_table = RateTable(None, self.reference, date, rates[date])
+            series.append((date, rate_table.rate(from_currency, to_currency)))
+        return series
+
+    def _rows(self, rate_table):
+        return [{'date': rate_table.date, 'base': rate_table.reference, 'currency': currency, 'rate': rate,
+                 'provider': rate_table.provider_name}
+                for currency, rate in rate_table.rates.items() if currency != rate_table.reference]
+
+    def _alias_rows(self, aliases):
+        return [{'date': date, 'base': self.reference, 'published': published}
+                for date, published in aliases.items() if date != published]
+
+    async def save(self, rate_table, date=None):
+        """
+        Saves rates of a table, already saved rates of the date are kept as is.
+
+        :param date: date the rates were requested for, saved as an alias if it's not the table's date
+        """
+        rows = self._rows(rate_table)
+        if not rows:
+            return
+        alias_rows = self._alias_rows({date: rate_table.date}) if date is not None else []
+        async with self.app.db.connection() as connection:
+            await connection.execute(insert(HistoricalRateTable).values(rows).on_conflict_do_nothing(
+                index_elements=['date', 'base', 'currency']))
+            if alias_rows:
+                await connection.execute(insert(HistoricalRateAlias).values(alias_rows).on_conflict_do_nothing(
+                    index_elements=['date', 'base']))
+
+    def bulk_save(self, connection, rate_tables, aliases=None):
+        """
+        Blocking bulk version of :meth:`save` for management commands. Rows are streamed with `COPY` into
+        a temporary table and moved from it with a single `INSERT ... ON CONFLICT DO NOTHING`.
+
+        :param connection: psycopg2 connection
+        :param rate_tables: iterable of :class:`RateTable`
+        :param aliases: dict, requested date -> date of the table providers answered with
+        :return: number of inserted rows
+        """
+        alias_rows = self._alias_rows(aliases or {})
+        columns = ('date', 'base', 'currency', 'rate', 'provider')
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for rate_table in rate_tables:
+            for row in self._rows(rate_table):
+                writer.writerow([row['date'].isoformat(), row['base'], row['currency'], str(row['rate']),
+                                 row['provider']])
+        buf.seek(0)
+
+        table_name = HistoricalRateTable.name
+        with connection:
+            with connection.cursor() as cursor:
+                cursor.execute("CREATE TEMP TABLE {0}_import (LIKE {0}) ON COMMIT DROP".format(table_name))
+                cursor.copy_expert("COPY {}_import ({}) FROM STDIN WITH CSV".format(table_name, ', '.join(columns)),
+                                   buf)
+                cursor.execute("INSERT INTO {0} ({1}) SELECT {1} FROM {0}_import "
+                               "ON CONFLICT (date, base, currency) DO NOTHING".format(table_name, ', '.join(columns)))
+                inserted = cursor.rowcount
+                if alias_rows:
+                    cursor.executemany("INSERT INTO {} (date, base, published) VALUES (%(date)s, %(base)s, "
+                                       "%(published)s) ON CONFLICT DO NOTHING".format(HistoricalRateAlias.name),
+                                       alias_rows)
+                return inserted
@@ -0,0 +1,24 @@
+from sqlalchemy import Table, Column, Date, String, Numeric, Index, PrimaryKeyConstraint
+
+from sgateway.core.db import metadata
+
+HistoricalRateTable = Table(
+    'currency_rate', metadata,
+    Column('date', Date, nullable=False),
+    Column('base', String(3), nullable=False),
+    Column('currency', String(3), nullable=False),
+    Column('rate', Numeric(), nullable=False),
+    Column('provider', String(60), nullable=False),
+    PrimaryKeyConstraint('date', 'base', 'currency', name='pk_currency_rate'),
+    Index('ix_currency_rate_pair', 'base', 'currency', 'date'),
+)
+
+#: Dates rates are not published for (weekends, holidays): providers answer with the last published rates,
+#: `published` is the date of those.
+HistoricalRateAlias = Table(
+    'currency_rate_alias', metadata,
+    Column('date', Date, nullable=False),
+    Column('base', String(3), nullable=False),
+    Column('published', Date, nullable=False),
+    PrimaryKeyConstraint('date', 'base', name='pk_currency_rate_alias'),
+)
@@ -1,39 +1,32 @@
 from decimal import Decimal
 
-import aiohttp
-
 from sgateway.core.gateway_exceptions import ProviderError
-from sgateway.core.utils import get_schema_models
-from .schemas import RatesSchema
+from .schemas import RatesModel, RateModel
 from ..base.provider import BaseServiceProvider
 from ..utils import provide_method
 
 
 class CurrencyExchangeProvider(BaseServiceProvider):
-    def __init__(self, *args, **kwargs):
-        super(CurrencyExchangeProvider, self).__init__(*args, **kwargs)
-        self.models_ns = get_schema_models(RatesSchema)
-
     def _default_request_headers(self):
         return {}
 
     @property
     def aiosession(self):
-        return aiohttp.ClientSession(loop=self.app.loop, headers=self._default_request_headers())
+        return self.http_session(headers=self._default_request_headers())
 
 
 class MockedProvider(CurrencyExchangeProvider):
     __name__ = '_mocked_'
 
-    @provide_method()
+    @provide_method(hedge_safe=True)
     async def get_rates(self, base, date=None, currencies=None):
         rates = {curr: 1 for curr in currencies}
 
-        rates_schema = self.models_ns.Rates(base=base, datetime=date.isoformat())
-        rates_schema.rates = [self.models_ns.Rate(currency=k, value=v) for k, v in rates.items()]
+        rates_schema = RatesModel(base=base, datetime=date.isoformat())
+        rates_schema.rates = [RateModel(currency=k, value=v) for k, v in rates.items()]
         return rates_schema
 
-    @provide_method()
+    @provide_method(hedge_safe=True)
     async def convert(self, query):
         rates = await self.get_rates(base=query.from_currency, currencies=query.to_currency)
         return {
@@ -52,8 +45,9 @@ class FixerioProvider(CurrencyExchangeProvider):
     Foreign exchange rates and currency conversion API
     The rates are updated daily around 4PM CET.
     """
+    preconnect_urls = ('http://api.fixer.io',)
 
-    @provide_method()
+    @provide_method(hedge_safe=True)
     async def get_rates(self, base, date=None, currencies=None):
         # E.g.
         # http://api.fixer.io/2000-01-03
@@ -80,8 +74,8 @@ class FixerioProvider(CurrencyExchangeProvider):
                 except:
                     raise ProviderError("Unexpected error [{}]: {}".format(resp.status, await resp.text()))
 
-        rates_schema = self.models_ns.Rates(base=resp_data['base'], datetime=resp_data['date'])
-        rates_schema.rates = [self.models_ns.Rate(currency=k, value=v) for k, v in resp_data['rates'].items()]
+        rates_schema = RatesModel(base=resp_data['base'], datetime=resp_data['date'])
+        rates_schema.rates = [RateModel(currency=k, value=v) for k, v in resp_data['rates'].items()]
         return rates_schema
 
     async def _get_currency_rate(self, from_currency, to_currency):
@@ -98,7 +92,7 @@ class FixerioProvider(CurrencyExchangeProvider):
 
         return {rate.currency: rate.value for rate in rates}
 
-    @provide_method()
+    @provide_method(hedge_safe=True)
     async def convert(self, query):
         rates = await self._get_currency_rate(query.from_currency, query.to_currency)
         return {
@@ -0,0 +1,294 @@
+import asyncio
+import datetime
+import struct
+from decimal import Decimal
+
+import dateutil.parser
+import numpy
+
+from sgateway.core.gateway_exceptions import ServiceBadRequestError
+from sgateway.core.logs import app_logger
+from sgateway.core.snapshot import SharedSnapshot
+from .cross_rates import CrossRateMatrix, DTYPE
+from .schemas import RatesModel, RateModel
+
+
+class RateTable(object):
+    """
+    Full set of rates of a provider against a single reference currency. Rate between any two currencies
+    is triangulated through the reference one, so the table answers for any base.
+    """
+
+    __slots__ = ('provider_name', 'reference', 'date', 'rates', '_cross_rates')
+
+    def __init__(self, provider_name, reference, date, rates):
+        """
+        :param reference: reference currency code
+        :param date: datetime.date rates are published for
+        :param rates: dict, currency -> Decimal amount of the currency for one unit of the reference currency
+        """
+        self.provider_name = provider_name
+        self.reference = reference
+        self.date = date
+        self.rates = dict(rates)
+        self.rates[reference] = Decimal(1)
+        self._cross_rates = None
+
+    @classmethod
+    def from_rates_model(cls, provider_name, rates_model):
+        """
+        Full rate set is fetched for bulk conversions mostly, so cross rates are built right away.
+
+        :param rates_model: :class:`RatesModel` returned by provider's `get_rates`
+        """
+        rate_table = cls(provider_name, rates_model.base, dateutil.parser.parse(rates_model.datetime).date(),
+                         {rate.currency: Decimal(str(rate.value)) for rate in rates_model.rates})
+        rate_table.build_cross_rates()
+        return rate_table
+
+    def build_cross_rates(self):
+        self._cross_rates = CrossRateMatrix(self.rates)
+        return self._cross_rates
+
+    @property
+    def cross_rates(self):
+        """
+        :class:`CrossRateMatrix` of the table, built on the first use.
+        """
+        if self._cross_rates is None:
+            return self.build_cross_rates()
+        return self._cross_rates
+
+    def _get(self, currency):
+        try:
+            return self.rates[currency]
+        except KeyError:
+            raise ServiceBadRequestError("Currency {} is not supported".format(currency))
+
+    def rate(self, from_currency, to_currency):
+        """
+        :return: Decimal amount of `to_currency` for one unit of `from_currency`
+        """
+        return self._get(to_currency) / self._get(from_currency)
+
+    def get_rates(self, base, currencies=None):
+        """
+        The same as providers' `get_rates`. Unknown currencies are skipped.
+
+        :param currencies: list of currency codes, all if empty
+        :return: :class:`RatesModel`
+        """
+        base_value = self._get(base)
+        currencies = [x for x in currencies or () if x] or sorted(self.rates)
+        rates_model = RatesModel(base=base, datetime=self.date.isoformat())
+        rates_model.rates = [RateModel(currency=currency, value=float(self.rates[currency] / base_value))
+                             for currency in currencies if currency in self.rates and currency != base]
+        return rates_model
+
+    def convert(self, amount, from_currency, to_currencies):
+        """
+        :param amount: Decimal
+        :return: dict, currency -> Decimal amount
+        """
+        return {currency: amount * self.rate(from_currency, currency) for currency in to_currencies}
+
+
+#: Snapshot layout: number of tables, then every table is a header (provider, reference, date ordinal, number
+#: of currencies N), N currency codes (sorted), padding to 8 bytes, N rates against the reference currency and
+#: N x N cross-rate matrix (little-endian float64).
+_snapshot_count = struct.Struct('<I')
+_snapshot_table = struct.Struct('<32s3sIH')
+_float_dtype = numpy.dtype(DTYPE).newbyteorder('<')
+
+
+def pack_rate_tables(rate_tables):
+    """
+    :return: bytes, see :func:`unpack_rate_tables`
+    """
+    rate_tables = list(rate_tables)
+    chunks = [_snapshot_count.pack(len(rate_tables))]
+    size = _snapshot_count.size
+    for rate_table in rate_tables:
+        cross_rates = rate_table.cross_rates
+        currencies = cross_rates.currencies
+        table_chunks = [
+            _snapshot_table.pack(rate_table.provider_name.encode(), rate_table.reference.encode(),
+                                 rate_table.date.toordinal(), len(currencies)),
+            ''.join(currencies).encode(),
+        ]
+        padding = -(size + sum(len(x) for x in table_chunks)) % 8
+        table_chunks.append(b'\0' * padding)
+        table_chunks.append(numpy.array([float(rate_table.rates[x]) for x in currencies], dtype=_float_dtype).tobytes())
+        table_chunks.append(numpy.ascontiguousarray(cross_rates.matrix, dtype=_float_dtype).tobytes())
+        chunks.extend(table_chunks)
+        size += sum(len(x) for x in table_chunks)
+    return b''.join(chunks)
+
+
+def unpack_rate_tables(buffer):
+    """
+    Cross-rate matrices are not copied, but refer to the buffer.
+
+    :param buffer: bytes or memoryview, e.g. :attr:`SharedSnapshot.payload`
+    :return: list of :class:`RateTable`
+    """
+    rate_tables = []
+    count, = _snapshot_count.unpack_from(buffer)
+    offset = _snapshot_count.size
+    for _ in range(count):
+        provider_name, reference, date, size = _snapshot_table.unpack_from(buffer, offset)
+        offset += _snapshot_table.size
+        currencies = bytes(buffer[offset:offset + 3 * size]).decode()
+        currencies = [currencies[i:i + 3] for i in range(0, len(currencies), 3)]
+        offset += 3 * size
+        offset += -offset % 8
+        rates = numpy.frombuffer(buffer, dtype=_float_dtype, count=size, offset=offset)
+        offset += rates.nbytes
+        matrix = numpy.frombuffer(buffer, dtype=_float_dtype, count=size * size, offset=offset).reshape(size, size)
+        offset += matrix.nbytes
+
+        rate_table = RateTable(provider_name.rstrip(b'\0').decode(), reference.decode(),
+                               datetime.date.fromordinal(date),
+                               {currency: Decimal(repr(rate)) for currency, rate in zip(currencies, rates.tolist())})
+        rate_table._cross_rates = CrossRateMatrix.from_matrix(currencies, matrix)
+        rate_tables.append(rate_table)
+    return rate_tables
+
+
+class RateTableManager(object):
+    """
+    Keeps rate tables of all service providers (that have `get_rates`) in memory and refreshes them in background.
+
+    Rates are published once a day (see `CURRENCY_RATES_CONFIG['PUBLICATION_TIME']`), so tables are refreshed
+    right after the publication. If provider doesn't have new rates yet (publication is late or it's a holiday),
+    it's retried every `RETRY_INTERVAL` seconds during `RETRY_WINDOW` seconds after the publication time.
+
+    Loaded tables are saved to :class:`.history.RateHistory`, if it's given, so the store keeps up to date.
+
+    With `SNAPSHOT_PATH` set, tables are shared by all workers through :class:`SharedSnapshot`: only the worker
+    that is elected as refresher fetches rates, the others serve tables from the snapshot.
+    """
+
+    def __init__(self, app, service_name, service_version, service_registry, history=None):
+        self.app = app
+        self.service_name = service_name
+        self.service_version = service_version
+        self.service_registry = service_registry
+        self.history = history
+        self.log = app_logger.getChild('currency_exchange.rate_tables')
+
+        config = app.config.get('CURRENCY_RATES_CONFIG', {})
+        self.reference = config.get('REFERENCE_CURRENCY', 'EUR')
+        self.publication_time = datetime.time(*map(int, config.get('PUBLICATION_TIME', '15:00').split(':')))
+        self.retry_interval = config.get('RETRY_INTERVAL', 60 * 10)
+        self.retry_window = config.get('RETRY_WINDOW', 60 * 60 * 3)
+
+        self.snapshot = None
+        if config.get('SNAPSHOT_PATH'):
+            self.snapshot = SharedSnapshot(config['SNAPSHOT_PATH'],
+                                           check_interval=config.get('SNAPSHOT_CHECK_INTERVAL', 1))
+        self.snapshot_lock_interval = config.get('SNAPSHOT_LOCK_INTERVAL', 10)
+
+        self.tables = {}  # provider name -> RateTable
+        self._attempted_at = None
+        self._task = None
+
+    def get_table(self):
+        """
+        :return: the most recent RateTable or None if there are no tables yet
+        """
+        if self.snapshot is not None:
+            self.load_snapshot()
+        if not self.tables:
+            return None
+        return max(self.tables.values(), key=lambda x: x.date)
+
+    async def refresh(self):
+        """
+        Fetches full rate tables from all providers concurrently.
+        """
+        self._attempted_at = datetime.datetime.utcnow()
+        providers = self.service_registry.get_provider_instances(self.app, self.service_name, self.service_version,
+                                                                 required_methods=['get_rates'])
+        results = await asyncio.gather(*[provider.call_method('get_rates', self.reference, _silent=True)
+                                         for provider in providers], return_exceptions=True)
+        for provider, result in zip(providers, results):
+            if isinstance(result, Exception):
+                self.log.warning("Can not fetch rates from {}: {!r}".format(provider.name, result))
+                continue
+            rate_table = self.tables[provider.name] = RateTable.from_rates_model(provider.name, result)
+            self.log.info("Rates of {} for {} are loaded".format(provider.name, result.datetime))
+            if self.history is not None:
+                try:
+                    await self.history.save(rate_table)
+                except Exception:
+                    self.log.exception("Can not save rates of {} to history".format(provider.name))
+
+        if self.snapshot is not None and self.snapshot.is_refresher and self.tables:
+            version = await self.snapshot.write_async(pack_rate_tables(self.tables.values()))
+            self.log.info("Rates snapshot {} is written".format(version))
+
+    def load_snapshot(self, force=False):
+        """
+        Replaces tables with the ones from the snapshot if there is a new version of it.
+        """
+        try:
+            if not self.snapshot.check(force=force):
+                return
+            self.tables = {x.provider_name: x for x in unpack_rate_tables(self.snapshot.payload)}
+        except Exception:
+            self.log.exception("Can not load rates snapshot")
+
+    def _is_fresh(self, published_at):
+        return bool(self.tables) and all(x.date >= published_at.date() for x in self.tables.values())
+
+    def seconds_until_refresh(self, now=None):
+        now = now or datetime.datetime.utcnow()
+        published_at = datetime.datetime.combine(now.date(), self.publication_time)
+        if published_at > now:
+            published_at -= datetime.timedelta(days=1)
+        next_publication = published_at + datetime.timedelta(days=1)
+
+        if not self.tables:
+            # Nothing to serve from
+            if self._attempted_at is None:
+                return 0
+            return max(0, self.retry_interval - (now - self._attempted_at).total_seconds())
+
+        if self._is_fresh(published_at):
+            return (next_publication - now).total_seconds()
+        if self._attempted_at is None or self._attempted_at < published_at:
+            return 0
+        if now < published_at + datetime.timedelta(seconds=self.retry_window):
+            return max(0, self.retry_interval - (now - self._attempted_at).total_seconds())
+        return (next_publication - now).total_seconds()
+
+    async def _refresh_periodically(self):
+        while True:
+            try:
+                is_refresher = self.snapshot is None or self.snapshot.try_acquire()
+            except Exception:
+                self.log.exception("Can not acquire rates snapshot lock")
+                is_refresher = False
+            if not is_refresher:
+                # Another worker refreshes the snapshot
+                await asyncio.sleep(self.snapshot_lock_interval)
+                continue
+            await asyncio.sleep(self.seconds_until_refresh())
+            try:
+                await self.refresh()
+            except Exception:
+                self.log.exception("Can not refresh rate tables")
+                self._attempted_at = datetime.datetime.utcnow()
+
+    async def start(self, loop):
+        if self.snapshot is not None:
+            self.load_snapshot(force=True)
+        self._task = loop.create_task(self._refresh_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.snapshot is not None:
+            self.snapshot.release()
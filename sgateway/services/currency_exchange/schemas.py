@@ -1,5 +1,7 @@
 import jsl
 
+from sgateway.core.utils import SlotsModel
+
 
 class RateSchema(jsl.Document):
     currency = jsl.StringField()
@@ -28,3 +30,42 @@ class ConvertQuerySchema(jsl.Document):
     class Options(object):
         definition_id = 'ConvertQuery'
         title = 'Convert Query'
+
+
+AMOUNT_MAX = 10 ** 15 - 1
+
+
+class ConvertBatchItemSchema(jsl.Document):
+    #: Number or decimal string, strings are taken as is (e.g. "10.10"), numbers - by their shortest repr.
+    #: Up to 15 integer digits and 12 decimal places, so results fit Decimal context precision.
+    amount = jsl.OneOfField([jsl.NumberField(minimum=0, maximum=AMOUNT_MAX),
+                             jsl.StringField(pattern=r'^[0-9]{1,15}(\.[0-9]{1,12})?$')], required=True)
+    from_currency = jsl.StringField(max_length=3, min_length=3, required=True)
+    to_currency = jsl.StringField(max_length=3, min_length=3, required=True)
+
+    class Options(object):
+        definition_id = 'ConvertBatchItem'
+
+
+class ConvertBatchQuerySchema(jsl.Document):
+    items = jsl.ArrayField(jsl.DocumentField(ConvertBatchItemSchema, as_ref=True), required=True, max_items=10000)
+    date = jsl.StringField(format='date')  #: Historical rates, the latest ones by default
+    precision = jsl.IntField(minimum=0, maximum=12)  #: Decimal places of results, 2 by default
+
+    class Options(object):
+        definition_id = 'ConvertBatchQuery'
+        title = 'Convert Batch Query'
+
+
+class RateModel(SlotsModel):
+    """
+    Lightweight :class:`RateSchema` model.
+    """
+    __slots__ = ('currency', 'value')
+
+
+class RatesModel(SlotsModel):
+    """
+    Lightweight :class:`RatesSchema` model.
+    """
+    __slots__ = ('base', 'rates', 'datetime')
@@ -1,19 +1,49 @@
-from decimal import Decimal
+import asyncio
+import datetime
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 
 import dateutil.parser
 
 from sgateway.core.core_exceptions import ValidationError
-from sgateway.core.gateway_exceptions import ServiceBadRequestError
+from sgateway.core.gateway_exceptions import ServiceBadRequestError, ServiceUnavailable
 from sgateway.core.utils import get_schema_models
+from .history import RateHistory
 from .providers import FixerioProvider, DummyProvider
-from .schemas import ConvertQuerySchema
+from .rate_table import RateTable, RateTableManager
+from .schemas import ConvertQuerySchema, ConvertBatchQuerySchema
 from ..base.service import BaseService
 from ..registry import ServiceRegistry
 from ..strategies import RoundRobinStrategy
-from ..utils import expose_method
+from ..utils import CachePolicy, expose_method
 
 registry = ServiceRegistry()
 
+convert_query_models = get_schema_models(ConvertQuerySchema)
+
+
+def rates_cache_ttl(service_request):
+    """
+    Historical rates never change, so they are cached for a long time.
+    """
+    try:
+        date = dateutil.parser.parse(service_request.get_arg('date', '')).date()
+    except ValueError:
+        return 60 * 5
+    if date < datetime.date.today():
+        return 60 * 60 * 24 * 30
+    return 60 * 5
+
+
+def parse_date(service_request, arg_name, default=None):
+    value = service_request.get_arg(arg_name)
+    if value is None:
+        return default
+    try:
+        return dateutil.parser.parse(value).date()
+    except ValueError:
+        raise ServiceBadRequestError("`{}` is incorrect".format(arg_name))
+
 
 @registry.register()
 class CurrencyExchangeService(BaseService):
@@ -24,24 +54,120 @@ class CurrencyExchangeService(BaseService):
     providers = (FixerioProvider, DummyProvider)
     provider_strategy = RoundRobinStrategy
 
-    @expose_method(http_method='GET')
-    async def rates(self, service_request):
-        prov = await self.get_provider(service_request, required_methods=['get_rates'])
+    def on_registered(self):
+        config = self.app.config.get('CURRENCY_RATES_CONFIG', {})
+        history = None
+        if config.get('STORE_HISTORY', True):
+            history = RateHistory(self.app, config.get('REFERENCE_CURRENCY', 'EUR'))
+        self._locals.rate_history = history
 
-        date = service_request.get_arg('date')
-        if date is not None:
-            try:
-                date = dateutil.parser.parse(date).date()
-            except ValueError:
-                raise ServiceBadRequestError("`date` is incorrect")
+        rate_tables = RateTableManager(self.app, self.name, self.version, self._service_registry, history=history)
+        self._locals.rate_tables = rate_tables
+
+        @self.app.listener('after_server_start')
+        async def _start_rate_tables(app, loop):
+            await rate_tables.start(loop)
+
+        @self.app.listener('before_server_stop')
+        async def _stop_rate_tables(app, loop):
+            await rate_tables.stop()
+
+    def get_rate_table(self):
+        """
+        :return: :class:`RateTable` with the latest rates or None if it's not loaded
+        """
+        rate_tables = getattr(self._get_locals(), 'rate_tables', None)
+        return rate_tables.get_table() if rate_tables is not None else None
+
+    def get_rate_history(self):
+        """
+        :return: :class:`RateHistory` or None if history is not stored
+        """
+        return getattr(self._get_locals(), 'rate_history', None)
+
+    async def get_historical_rate_table(self, service_request, date):
+        """
+        Rates of a past date from the history. If they are not saved yet, full set of rates is fetched from
+        a provider and saved, so every date is fetched only once. For weekends and holidays providers answer
+        with the last published rates, the requested date is saved as an alias of those.
+
+        :return: :class:`RateTable` or None if history is not stored
+        """
+        history = self.get_rate_history()
+        if history is None:
+            return None
+
+        try:
+            rate_table = await history.get_table(date)
+        except Exception:
+            self.log.exception("Can not load rates for {} from history".format(date))
+            return None
+        if rate_table is not None:
+            service_request.add_loggable_property('rates_history', True)
+            return rate_table
+
+        rates = await self.hedged_provider_call(service_request, 'get_rates', history.reference, date=date)
+        rate_table = RateTable.from_rates_model(service_request.get_loggable_properties().get('provider'), rates)
+        try:
+            await history.save(rate_table, date=date)
+        except Exception:
+            self.log.exception("Can not save rates for {} to history".format(date))
+        return rate_table
+
+    async def find_rate_table(self, service_request, date=None):
+        """
+        :param date: datetime.date or None for the latest rates
+        :return: :class:`RateTable` to serve rates of the date from or None if rates must be fetched as is
+        """
+        rate_table = self.get_rate_table()
+        if rate_table is not None and (date is None or date == rate_table.date):
+            return rate_table
+        if date is not None and date < datetime.date.today():
+            return await self.get_historical_rate_table(service_request, date)
+        return None
+
+    async def fetch_pair_rates(self, service_request, pairs, date=None):
+        """
+        Fetches rate of every currency pair once, with one provider call per source currency.
 
+        :param pairs: iterable of (from currency, to currency)
+        :return: dict, (from currency, to currency) -> Decimal rate
+        """
+        targets = defaultdict(set)
+        for from_currency, to_currency in pairs:
+            targets[from_currency].add(to_currency)
+        bases = list(targets)
+        results = await asyncio.gather(*[
+            self.hedged_provider_call(service_request, 'get_rates', base, date=date, currencies=sorted(targets[base]))
+            for base in bases])
+
+        pair_rates = {}
+        for base, rates in zip(bases, results):
+            values = {rate.currency: Decimal(str(rate.value)) for rate in rates.rates}
+            values[base] = Decimal(1)
+            for currency in targets[base]:
+                try:
+                    pair_rates[(base, currency)] = values[currency]
+                except KeyError:
+                    raise ServiceBadRequestError("Currency {} is not supported".format(currency))
+        return pair_rates
+
+    @expose_method(http_method='GET', cache=CachePolicy(ttl=rates_cache_ttl,
+                                                        vary_by_args=['date', 'currencies', 'base']))
+    async def rates(self, service_request):
+        date = parse_date(service_request, 'date')
         currencies = [x.strip() for x in service_request.get_arg('currencies', '').split(',')]
         base = service_request.get_arg('base', 'USD')
-        res = await prov.call_method('get_rates', base, date=date, currencies=currencies)
 
-        return self.result(res.as_dict(), global_cache=True)
+        rate_table = await self.find_rate_table(service_request, date)
+        if rate_table is not None:
+            return self.result(rate_table.get_rates(base, currencies).as_dict())
+
+        res = await self.hedged_provider_call(service_request, 'get_rates', base, date=date, currencies=currencies)
+
+        return self.result(res.as_dict())
 
-    @expose_method(http_method='GET')
+    @expose_method(http_method='GET', cache=CachePolicy(ttl=60 * 5, vary_by_args=['amount', 'from', 'to']))
     async def convert(self, service_request):
 
         try:
@@ -49,13 +175,103 @@ class CurrencyExchangeService(BaseService):
         except (TypeError, ValueError):
             raise ServiceBadRequestError("`amount` must be a valid number")
 
-        ns = get_schema_models(ConvertQuerySchema)
         try:
-            query = ns.ConvertQuery(to_currency=service_request.get_arg('to', '').split(','),
-                                    from_currency=service_request.get_arg('from'),
-                                    amount=float(amount))
+            query = convert_query_models.ConvertQuery(to_currency=service_request.get_arg('to', '').split(','),
+                                                      from_currency=service_request.get_arg('from'),
+                                                      amount=float(amount))
         except ValidationError as e:
             raise ServiceBadRequestError(str(e))
 
-        prov = await self.get_provider(service_request, required_methods=['convert'])
-        return self.result(await prov.convert(query), global_cache=True)
+        rate_table = self.get_rate_table()
+        if rate_table is not None:
+            return self.result(rate_table.convert(amount, str(query.from_currency),
+                                                  [str(x) for x in query.to_currency]))
+        return self.result(await self.hedged_provider_call(service_request, 'convert', query))
+
+    @expose_method(http_method='GET', cache=CachePolicy(ttl=60 * 60, vary_by_args=['from', 'to', 'start', 'end']))
+    async def timeseries(self, service_request):
+        """
+        Daily rates of a currency pair within [start, end] (`end` is today by default) from the history.
+        Dates without published rates (weekends, holidays) are omitted.
+        """
+        from_currency = service_request.get_arg('from', '').upper()
+        to_currency = service_request.get_arg('to', '').upper()
+        if len(from_currency) != 3 or len(to_currency) != 3:
+            raise ServiceBadRequestError("`from` and `to` must be valid currency codes")
+
+        start = parse_date(service_request, 'start')
+        end = parse_date(service_request, 'end', default=datetime.date.today())
+        if start is None or start > end:
+            raise ServiceBadRequestError("`start` must be a date before `end`")
+        max_days = self.app.config.get('CURRENCY_RATES_CONFIG', {}).get('TIMESERIES_MAX_DAYS', 366 * 5)
+        if (end - start).days > max_days:
+            raise ServiceBadRequestError("Range can not be longer than {} days".format(max_days))
+
+        history = self.get_rate_history()
+        if history is None:
+            raise ServiceUnavailable("Rates history is not available")
+
+        series = await history.get_series(from_currency, to_currency, start, end)
+        return self.result({
+            'from': from_currency,
+            'to': to_currency,
+            'rates': [{'date': date.isoformat(), 'value': float(value)} for date, value in series],
+        })
+
+    @expose_method(request_schema=ConvertBatchQuerySchema.get_schema(), http_method='POST',
+                   cache=CachePolicy(ttl=60 * 5, allow_post=True))
+    async def convert_batch(self, service_request):
+        """
+        Converts many amounts at once, results are rounded half up to `precision` decimal places. Amounts and
+        results are strings.
+
+        Amounts are converted with cross rates of a rate table in one vectorized pass (see precision policy of
+        :class:`.cross_rates.CrossRateMatrix`), amounts the policy rejects are converted in Decimal. If there
+        is no table for the date, rate of every currency pair is fetched once and results are computed in Decimal.
+        """
+        data = service_request.get_data()
+        date = None
+        if data.get('date'):
+            try:
+                date = dateutil.parser.parse(data['date']).date()
+            except ValueError:
+                raise ServiceBadRequestError("`date` is incorrect")
+        precision = data.get('precision', 2)
+
+        items = [(Decimal(str(x['amount'])), x['from_currency'].upper(), x['to_currency'].upper())
+                 for x in data['items']]
+        amounts, from_currencies, to_currencies = zip(*items) if items else ((), (), ())
+
+        exponent = Decimal(1).scaleb(-precision)
+
+        def _round(value):
+            try:
+                return value.quantize(exponent, ROUND_HALF_UP)
+            except InvalidOperation:
+                raise ServiceBadRequestError("Result {} doesn't fit precision {}".format(value, precision))
+
+        rate_table = await self.find_rate_table(service_request, date)
+        if rate_table is not None:
+            cross_rates = rate_table.cross_rates
+            for currency in set(from_currencies) | set(to_currencies):
+                if currency not in cross_rates:
+                    raise ServiceBadRequestError("Currency {} is not supported".format(currency))
+            results = cross_rates.to_decimals(cross_rates.convert([float(x) for x in amounts], from_currencies,
+                                                                  to_currencies), precision)
+            for i, (amount, from_currency, to_currency) in enumerate(items):
+                if results[i] is None or not cross_rates.fits(amount, precision):
+                    results[i] = _round(amount * rate_table.rate(from_currency, to_currency))
+        else:
+            pair_rates = await self.fetch_pair_rates(service_request, set(zip(from_currencies, to_currencies)),
+                                                     date=date)
+            results = [_round(amount * pair_rates[(from_currency, to_currency)])
+                       for amount, from_currency, to_currency in items]
+
+        return self.result({
+            'items': [{
+                'amount': str(amount),
+                'from_currency': from_currency,
+                'to_currency': to_currency,
+                'result': str(result),
+            } for (amount, from_currency, to_currency), result in zip(items, results)],
+        })
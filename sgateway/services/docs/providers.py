@@ -1,5 +1,3 @@
-import aiohttp
-
 from sgateway.core.gateway_exceptions import ProviderError
 from ..base.provider import BaseServiceProvider
 from ..utils import provide_method
@@ -12,6 +10,10 @@ class SemilimesProvider(BaseServiceProvider):
     Our hosted PDF generator API.
     """
 
+    @classmethod
+    def get_preconnect_urls(cls, config):
+        return [config['DOCS_API_URL']] if config.get('DOCS_API_URL') else []
+
     def __init__(self, *args, **kwargs):
         super(SemilimesProvider, self).__init__(*args, **kwargs)
         self.DOCS_API_URL = self.require_config('DOCS_API_URL')
@@ -24,7 +26,7 @@ class SemilimesProvider(BaseServiceProvider):
 
         :returns: binary file's chunks or raise exception
         """
-        aiosession = aiohttp.ClientSession(loop=self.app.loop, headers={})
+        aiosession = self.http_session()
         url = '{}/{}/'.format(self.DOCS_API_URL.rstrip('/'), 'htmltopdf')
         chunk_size = 1024 * 1024  # 1 MB
 
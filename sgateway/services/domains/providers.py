@@ -2,8 +2,6 @@ import datetime
 from abc import ABCMeta
 from collections import defaultdict
 
-import aiohttp
-
 from sgateway.core.gateway_exceptions import BaseApiException, ProviderError, ServiceInternalError
 from sgateway.core.utils import get_domain_zone
 from ..base.provider import BaseServiceProvider
@@ -38,6 +36,10 @@ class GoDaddyProvider(DomainsProvider):
     https://developer.godaddy.com/doc#!/_v1_domains/available
     """
 
+    @classmethod
+    def get_preconnect_urls(cls, config):
+        return [config['GODADDY_API_URL']] if config.get('GODADDY_API_URL') else []
+
     def api_url_build(self, resource):
         GODADDY_API_URL = self.require_config("GODADDY_API_URL")
         return "{}/{}".format(GODADDY_API_URL.rstrip("/"), resource.lstrip("/"))
@@ -47,11 +49,11 @@ class GoDaddyProvider(DomainsProvider):
         GODADDY_KEY = self.require_config('GODADDY_KEY')
         GODADDY_SECRET = self.require_config('GODADDY_SECRET')
 
-        return aiohttp.ClientSession(loop=self.app.loop, headers={
+        return self.http_session(headers={
             'Authorization': 'sso-key {API_KEY}:{API_SECRET}'.format(API_KEY=GODADDY_KEY, API_SECRET=GODADDY_SECRET),
         })
 
-    @provide_method()
+    @provide_method(hedge_safe=True)
     async def check_availability(self, domain):
         """
         https://developer.godaddy.com/doc#!/_v1_domains/available
@@ -6,8 +6,9 @@ from sl_mqlib.serializer import JsonSerializer
 
 from sgateway.core.gateway_exceptions import (
     ServiceBadRequestError, UnauthorizedApiException, ServiceRestricted, ProviderError,
-    ServiceUnavailable,
+    ServiceUnavailable, ProviderUnavailable,
 )
+from sgateway.core.helpers import LRUCache
 from sgateway.core.utils import get_domain_zone, get_schema_models
 from sgateway.services.base.strategy import BaseProviderChoiceStrategy
 from .models import IntentionTable, DomainsPurchasesTable, RegistrantAccountTable
@@ -15,10 +16,12 @@ from .providers import GoDaddyProvider, DomainIsNotAvailableYet
 from .schemas import DomainRegistrationClientFormSchema, DNSRecordsSchema
 from ..base.service import BaseService
 from ..registry import ServiceRegistry
-from ..utils import expose_method, webhook_callback
+from ..utils import CachePolicy, NO_DEADLINE, expose_method, webhook_callback
 
 registry = ServiceRegistry()
 
+dns_records_models = get_schema_models(DNSRecordsSchema)
+
 # Kinda in USD
 ZONES_PRICELIST = {
     'com': 0,
@@ -26,6 +29,9 @@ ZONES_PRICELIST = {
 
 
 class DomainRegistrationWorkflow(object):
+    #: Registration schemas depend only on provider and domain zone, and extra fields (agreements) change rarely.
+    _registration_schemas = LRUCache(maxsize=256, ttl=60 * 60)
+
     def __init__(self, service_request, intention, provider):
         self._intention = intention
         self.provider = provider
@@ -53,7 +59,19 @@ class DomainRegistrationWorkflow(object):
     # Internal methods and steps procedures
 
     @staticmethod
-    async def get_registration_schema(provider, domain):
+    def get_registration_schema_key(provider, domain):
+        return 'domain_registration', provider.name, get_domain_zone(domain)
+
+    @classmethod
+    async def get_registration_schema(cls, provider, domain):
+        """
+        :return: json schema (cached, so must not be modified)
+        """
+        key = cls.get_registration_schema_key(provider, domain)
+        registration_schema = cls._registration_schemas.get(key)
+        if registration_schema is not None:
+            return registration_schema
+
         registration_schema = DomainRegistrationClientFormSchema()
         registration_schema = registration_schema.get_schema()
 
@@ -63,6 +81,7 @@ class DomainRegistrationWorkflow(object):
 
         registration_schema['properties'].update(extra_props)
         registration_schema['required'].extend(extra_props.keys())
+        cls._registration_schemas.set(key, registration_schema)
         return registration_schema
 
     async def step_schedule_dns_update(self):
@@ -83,7 +102,8 @@ class DomainRegistrationWorkflow(object):
 
     async def step_validate_data(self):
         schema = await self.get_registration_schema(self.provider, self.domain)
-        data = self.service_request.get_data(schema=schema)
+        data = self.service_request.get_data(schema=schema,
+                                             schema_key=self.get_registration_schema_key(self.provider, self.domain))
         if self.provider.has_method('validate_registration_data'):
             await self.provider.validate_registration_data(
                 self.domain, data, client_ip=self.service_request.get_client_ip())
@@ -157,16 +177,15 @@ class DomainRegistrationWorkflow(object):
             )
 
     async def step_setup_dns(self):
-        models = get_schema_models(DNSRecordsSchema)
         new_records = [
             {'type': 'A', 'name': '@', 'data': '127.0.0.1'},
             {'type': 'CNAME', 'name': 'www', 'data': 'some.semilimes.com'},
         ]
 
-        instance = models.DomainDnsRecords()
+        instance = dns_records_models.DomainDnsRecords()
         instance.records = []
         for rec_dict in new_records:
-            instance.records.append(models.DNSRecord(**rec_dict))
+            instance.records.append(dns_records_models.DNSRecord(**rec_dict))
 
         records_data = json.loads(instance.serialize())
         account_data = self.provider_account['account_data'] if self.provider_account else None
@@ -176,16 +195,21 @@ class DomainRegistrationWorkflow(object):
         after domain registration. We don't know when it will become available, so we're trying to 
         make several attempts.
         
-        If we fail during or after attempts - it's on message queue to repeat the process again.
+        If we fail during or after attempts - it's on message queue to repeat the process again. The same when
+        request deadline doesn't leave time for the next attempt.
         """
         attempts = 5
         time_to_sleep = 2
         update_done = False
 
         while attempts > 0:
+            time_left = self.service_request.time_left
+            if time_left is not None and time_left <= time_to_sleep:
+                break
             await asyncio.sleep(time_to_sleep)
             try:
-                await self.provider.call_method('update_dns_records', self.domain, records_data, account_data)
+                await self.service_request.within_deadline(
+                    self.provider.call_method('update_dns_records', self.domain, records_data, account_data))
                 update_done = True
                 break
             except DomainIsNotAvailableYet:
@@ -206,20 +230,60 @@ class DomainRegistrationWorkflow(object):
 
 
 class DomainRegistrantStrategy(BaseProviderChoiceStrategy):
+    """
+    Selects the cheapest registrar the domain is available at. All registrars are asked concurrently and
+    those that didn't answer within `probe_timeout` are ignored.
+
+    Answers are cached for a short time, so checking availability and then creating registration intention
+    doesn't ask registrars twice.
+    """
+
+    #: Seconds to wait for registrars' answers (or less, if request deadline is closer)
+    probe_timeout = 5
+    #: (provider name, domain) -> check_availability result
+    _availability = LRUCache(maxsize=1024, ttl=30)
+
     def __init__(self, domain, *args, **kwargs):
         self.domain = domain
         super(DomainRegistrantStrategy, self).__init__(*args, **kwargs)
 
-    async def select(self, service_request, providers):
-        providers_price_list = []
+    async def _check_availability(self, provider):
+        key = (provider.name, self.domain.lower())
+        result = self._availability.get(key)
+        if result is None:
+            result = await provider.call_method('check_availability', self.domain)
+            self._availability.set(key, result)
+        return result
 
-        for provider in providers:
-            a = await provider.check_availability(self.domain)
-            if not a['available']:
-                continue
+    async def probe(self, service_request, providers):
+        """
+        :return: list of tuples (provider, check_availability result) of providers answered in time
+        """
+        timeout = self.probe_timeout
+        time_left = getattr(service_request, 'time_left', None)
+        if time_left is not None:
+            timeout = min(timeout, time_left)
+
+        checks = {asyncio.ensure_future(self._check_availability(provider)): provider for provider in providers}
+        if not checks:
+            return []
+        done, pending = await asyncio.wait(list(checks), timeout=timeout)
+        for check in pending:
+            check.cancel()
+            self.log.warning("Provider `{}` didn't answer in time".format(checks[check].name))
+
+        results = []
+        for check in done:
+            if check.exception() is None:
+                results.append((checks[check], check.result()))
+        return results
 
-            providers_price_list.append((provider, Decimal(a['price'])))
+    async def select(self, service_request, providers):
+        results = await self.probe(service_request, providers)
+        if not results:
+            raise ProviderUnavailable("Registrars are not available at the moment")
 
+        providers_price_list = [(provider, Decimal(a['price'])) for provider, a in results if a['available']]
         if len(providers_price_list) < 1:
             raise ServiceBadRequestError("This domain seems to be unavailable (or invalid). "
                                          "Check availability first or try again later.")
@@ -244,7 +308,7 @@ class DomainService(BaseService):
             raise ServiceBadRequestError("Domain zone is not supported")
         return fixed_price
 
-    @expose_method(http_method='GET')
+    @expose_method(http_method='GET', cache=CachePolicy(ttl=30, vary_by_args=['domain']))
     async def check_availability(self, service_request):
         domain = service_request.get_arg('domain')
         if not domain:
@@ -252,12 +316,16 @@ class DomainService(BaseService):
 
         price = self.get_domain_price(domain)
 
-        provider = await self.get_provider(service_request, required_methods=['check_availability'])
-        provider_resp = await provider.check_availability(domain)
+        # Answers are reused by `create_registration_intention`
+        results = await DomainRegistrantStrategy(domain=domain).probe(
+            service_request, self._get_available_providers(['check_availability']))
+        if not results:
+            raise ProviderUnavailable("Registrars are not available at the moment")
+        available = any(provider_resp['available'] for _, provider_resp in results)
 
         return self.result({
-            'price': price if provider_resp['available'] else None,
-            'available': provider_resp['available'],
+            'price': price if available else None,
+            'available': available,
         })
 
     @expose_method(http_method='GET')
@@ -271,7 +339,8 @@ class DomainService(BaseService):
         if not domain:
             raise ServiceBadRequestError("Domain arg is required")
 
-        provider = await self.get_provider(service_request, strategy=DomainRegistrantStrategy(domain=domain))
+        provider = await self.get_provider(service_request, required_methods=['check_availability'],
+                                           strategy=DomainRegistrantStrategy(domain=domain))
         schema = await DomainRegistrationWorkflow.get_registration_schema(provider, domain)
 
         intention = {
@@ -319,7 +388,7 @@ class DomainService(BaseService):
             raise ServiceUnavailable(client_retry=True)
         return self.result(None)
 
-    @expose_method(http_method='POST')
+    @expose_method(http_method='POST', timeout=NO_DEADLINE)
     async def submit_registration_intention(self, service_request):
         """
         Validates registration data and if all fine then do:
@@ -26,6 +26,7 @@ class SendgridProvider(BaseServiceProvider):
     RESTful V3 API provides functionality for managing user unsubscribes, templating emails,
     managing IP addresses, and enforcing TLS.
     """
+    preconnect_urls = ('https://api.sendgrid.com',)
 
     def __init__(self, *args, **kwargs):
         super(SendgridProvider, self).__init__(*args, **kwargs)
@@ -35,7 +36,7 @@ class SendgridProvider(BaseServiceProvider):
 
     @property
     def aiosession(self):
-        return aiohttp.ClientSession(loop=self.app.loop, headers=self.sendgrid._get_default_headers())
+        return self.http_session(headers=self.sendgrid._get_default_headers())
 
     async def send_via_http(self, data):
         """
@@ -103,6 +104,7 @@ class MailgunProvider(BaseServiceProvider):
     __maintainer_details__ = """
     https://documentation.mailgun.com/en/latest/api-sending.html#examples
     """
+    preconnect_urls = ('https://api.mailgun.net',)
 
     def __init__(self, *args, **kwargs):
         super(MailgunProvider, self).__init__(*args, **kwargs)
@@ -113,7 +115,7 @@ class MailgunProvider(BaseServiceProvider):
     def aiosession(self):
         MAILGUN_API_KEY = self.require_config('MAILGUN_API_KEY')
 
-        return aiohttp.ClientSession(loop=self.app.loop, headers={
+        return self.http_session(headers={
             'Accept': 'application/json',
         }, auth=aiohttp.BasicAuth('api', MAILGUN_API_KEY))
 
@@ -162,12 +164,13 @@ class PostmarkProvider(BaseServiceProvider):
     In addition, you can track statistics such as number of emails sent or processed, opens,
     bounces and spam complaints.
     """
+    preconnect_urls = ('https://api.postmarkapp.com',)
 
     @property
     def aiosession(self):
         POSTMARK_API_KEY = self.require_config('POSTMARK_API_KEY')
 
-        return aiohttp.ClientSession(loop=self.app.loop, headers={
+        return self.http_session(headers={
             'Accept': 'application/json',
             'Content-Type': 'application/json',
             'X-Postmark-Server-Token': POSTMARK_API_KEY,
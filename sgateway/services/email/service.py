@@ -1,9 +1,10 @@
 import premailer
 from sgateway.core.gateway_exceptions import ServiceInternalError
-from sgateway.services import BaseService, expose_method, webhook_callback
+from sgateway.services import BaseService, NO_DEADLINE, expose_method, webhook_callback
 from .providers import SendgridProvider, PostmarkProvider, MailgunProvider
 from .schemas import EmailMessage
 from ..registry import ServiceRegistry
+from ..strategies import PowerOfTwoChoicesStrategy
 
 registry = ServiceRegistry()
 
@@ -18,8 +19,9 @@ class EmailService(BaseService):
         PostmarkProvider,
         MailgunProvider,
     )
+    provider_strategy = PowerOfTwoChoicesStrategy
 
-    @expose_method(request_schema=EmailMessage.get_schema(), http_method='POST')
+    @expose_method(request_schema=EmailMessage.get_schema(), http_method='POST', timeout=NO_DEADLINE)
     async def send(self, service_request):
         data = service_request.get_data()
         self.log.debug("data is: %s", data)
@@ -0,0 +1,82 @@
+from collections import namedtuple
+from inspect import iscoroutinefunction
+
+#: Single compiled pipeline step: bound `process_request`/`process_response` and whether it must be awaited.
+PipelineStep = namedtuple('PipelineStep', ['handler', 'is_async'])
+
+
+class MiddlewarePipeline(object):
+    """
+    Pre-built request pipeline for a single route. Contains only middlewares that actually implement the phase
+    (and are allowed to run for the route), with sync/async resolved once, so `RequestHandler` doesn't need to
+    inspect middlewares on every request.
+    """
+
+    __slots__ = ('request_steps', 'response_steps')
+
+    def __init__(self, request_steps, response_steps):
+        self.request_steps = tuple(request_steps)
+        self.response_steps = tuple(response_steps)
+
+    @staticmethod
+    def _compile_step(middleware_obj, attr_name):
+        handler = getattr(middleware_obj, attr_name, None)
+        if handler is None:
+            return None
+        return PipelineStep(handler, iscoroutinefunction(handler))
+
+    @classmethod
+    def compile(cls, middlewares, is_webhook=False):
+        """
+        :param middlewares: list of middleware instances (ordering matters)
+        :param is_webhook: if True - only `webhook_friendly` middlewares get into pipeline
+        :return: MiddlewarePipeline
+        """
+        request_steps, response_steps = [], []
+
+        for middleware_obj in middlewares:
+            if is_webhook and not middleware_obj.webhook_friendly:
+                # Skip middlewares for webhooks. E.g., we don't need auth there.
+                continue
+
+            step = cls._compile_step(middleware_obj, 'process_request')
+            if step:
+                request_steps.append(step)
+
+            step = cls._compile_step(middleware_obj, 'process_response')
+            if step:
+                response_steps.append(step)
+
+        return cls(request_steps, response_steps)
+
+
+class PipelinesRegistry(object):
+    """
+    Holds compiled pipelines per (service, method, webhook). Pipelines are normally built at startup
+    with :meth:`compile_services`, but can also be built lazily for routes that weren't known at that time.
+    """
+
+    def __init__(self, middlewares):
+        self.middlewares = list(middlewares)
+        self._pipelines = {}
+
+    @staticmethod
+    def _get_key(service, method):
+        return service.name, service.version, method.name if method else None, bool(method and method.webhook)
+
+    def compile_services(self, services):
+        """
+        :param services: iterable of `BaseService` instances
+        """
+        for service in services:
+            for _, method in service.iter_exposed_methods():
+                self.get(service, method)
+
+    def get(self, service, method):
+        key = self._get_key(service, method)
+        try:
+            return self._pipelines[key]
+        except KeyError:
+            pipeline = MiddlewarePipeline.compile(self.middlewares, is_webhook=key[-1])
+            self._pipelines[key] = pipeline
+            return pipeline
@@ -32,11 +32,13 @@ class ServiceRegistry(metaclass=Singleton):
     ```
     """
 
-    __slots__ = ['_services', '_service_locals', '_providers']
+    __slots__ = ['_services', '_service_locals', '_providers', '_provider_instances']
 
     def __init__(self, *args, **kwargs):
         self._services = {}
         self._providers = {}
+        #: Providers are constructed once per app and reused, see :meth:`get_provider_instance`.
+        self._provider_instances = {}
         self._service_locals = defaultdict(_ServiceLocals)
 
     def __enter__(self):
@@ -100,6 +102,12 @@ class ServiceRegistry(metaclass=Singleton):
         except KeyError:
             return
 
+    def get_all_providers(self):
+        """
+        :return: set of provider classes of all registered services
+        """
+        return {provider['class'] for providers in self._providers.values() for provider in providers.values()}
+
     def get_providers(self, service_name, service_version=None, required_methods=None):
         """
         Returns providers that have all methods listed in required_methods.
@@ -113,10 +121,67 @@ class ServiceRegistry(metaclass=Singleton):
         except KeyError:
             return []
 
-        if required_methods:
-            providers = [name for name in all_providers
-                         if not set(required_methods) - set([m.name for m in all_providers[name]['methods']])]
-        else:
-            providers = all_providers.keys()
+        return [all_providers[name]['class'] for name in self._filter_providers(all_providers, required_methods)]
+
+    @staticmethod
+    def _filter_providers(all_providers, required_methods=None):
+        if not required_methods:
+            return list(all_providers.keys())
+
+        required_methods = set(required_methods)
+        return [name for name in all_providers
+                if not required_methods - set([m.name for m in all_providers[name]['methods']])]
+
+    def get_provider_instance(self, app, service_name, service_version, provider_name):
+        """
+        Returns provider instance that is constructed lazily on the first use and then reused for the app.
+
+        :param app: current app
+        :return: provider instance or None if there is no such provider
+        """
+        service_key = self.build_service_key(service_name, service_version)
+        try:
+            provider_class = self._providers[service_key][provider_name]['class']
+        except KeyError:
+            return
 
-        return [all_providers[name]['class'] for name in providers]
+        key = (service_key, provider_name)
+        instance = self._provider_instances.get(key)
+        if instance is None or instance.app is not app:
+            # Raises ConfigurationError if provider is misconfigured, so it won't be cached.
+            instance = provider_class(app)
+            instance.service_key = service_key
+            self._provider_instances[key] = instance
+        return instance
+
+    def get_provider_instances(self, app, service_name, service_version=None, required_methods=None):
+        """
+        The same as :meth:`get_providers`, but returns (cached) provider instances.
+        """
+        try:
+            all_providers = self._providers[self.build_service_key(service_name, service_version)]
+        except KeyError:
+            return []
+
+        return [self.get_provider_instance(app, service_name, service_version, name)
+                for name in self._filter_providers(all_providers, required_methods)]
+
+    def init_providers(self, app):
+        """
+        Constructs all providers of all registered services in advance, so the first requests don't pay for it
+        and configuration problems are visible at startup.
+
+        :param app: current app
+        :return: list of (provider class, exception) for providers that can not be constructed
+        """
+        errors = []
+        for service_cls in self.get_services():
+            service_name = inspect.getattr_static(service_cls, '__name__')
+            service_version = inspect.getattr_static(service_cls, '__version__')
+            for provider_class in self.get_providers(service_name, service_version):
+                try:
+                    self.get_provider_instance(app, service_name, service_version,
+                                               inspect.getattr_static(provider_class, '__name__'))
+                except Exception as e:
+                    errors.append((provider_class, e))
+        return errors
@@ -2,19 +2,25 @@ try:
     from types import AsyncGeneratorType
 except ImportError:
     raise Exception("Unsupported python installation. PEP 525 required (available in CPython 3.6)")
+import asyncio
+import json
+import struct
+import time
 from collections import namedtuple
 from inspect import isawaitable
 from types import GeneratorType
 
-from jsonschema.exceptions import ValidationError
-from jsonschema.validators import validate as validate_schema
 from sanic.exceptions import InvalidUsage
+from sanic.response import HTTPResponse, json_dumps
 from sanic.response import json as json_response
 from sanic.response import stream
 
-from sgateway.core.gateway_exceptions import BaseApiException, ServiceBadRequestError, InternalError
+from sgateway.core.gateway_exceptions import BaseApiException, ServiceBadRequestError, InternalError, DeadlineExceeded
 from sgateway.core.helpers import LazyProperty
 from sgateway.core.logs import app_logger
+from sgateway.core.validation import ValidationError, get_validator
+from sgateway.services.pipeline import MiddlewarePipeline
+from sgateway.services.utils import NO_DEADLINE
 
 LoggableProperty = namedtuple('LoggableProperty', ['name', 'value'])
 
@@ -25,9 +31,14 @@ class ServiceRequest(object):
     Technically, not only HTTP requests could be wrapped in ServiceRequest, but AMQP/websockets/etc.
 
     Can be extended with `extensions`.
+
+    Request has a deadline: the time budget is taken from `X-Request-Timeout` header (or `timeout` field of MQ
+    message), but can't exceed method's `timeout` or `DEFAULT_REQUEST_TIMEOUT`. Service method call and provider
+    calls made via failover/hedging are cancelled when the budget runs out. Requests of methods exposed with
+    `timeout=NO_DEADLINE` have no deadline regardless of the header.
     """
 
-    __slots__ = ('service', 'method', 'app', 'request', 'is_webhook', 'log',
+    __slots__ = ('service', 'method', 'app', 'request', 'is_webhook', 'log', 'deadline',
                  '_extensions', '_loggable_properties')
 
     def __init__(self, service, method, app, request=None):
@@ -50,6 +61,9 @@ class ServiceRequest(object):
         # They are not welcome to be set on Service level, but on a system level (e.g. by middlewares).
         self._loggable_properties = []
 
+        self.deadline = None  # time.monotonic() based
+        self.set_timeout(self._get_timeout())
+
     def __repr__(self):
         return repr("<Request {}>".format(self.path_repr))
 
@@ -61,6 +75,65 @@ class ServiceRequest(object):
             method=self.method.name,
         )
 
+    def _get_timeout(self):
+        timeout = getattr(self.method, 'timeout', None)
+        if timeout == NO_DEADLINE:
+            return None
+        timeout = timeout or getattr(self.app, 'config', {}).get('DEFAULT_REQUEST_TIMEOUT')
+        if self.request is None:
+            return timeout
+
+        try:
+            requested = float(self.request.headers.get('X-Request-Timeout', 0))
+        except (TypeError, ValueError):
+            self.log.warning("Invalid X-Request-Timeout: {}".format(self.request.headers.get('X-Request-Timeout')))
+            return timeout
+        if requested > 0:
+            return min(timeout, requested) if timeout else requested
+        return timeout
+
+    def set_timeout(self, seconds):
+        """
+        Shortens request deadline to `seconds` from now. Deadline is never extended.
+
+        :param seconds: number or None
+        """
+        if not seconds:
+            return
+        deadline = time.monotonic() + seconds
+        if self.deadline is None or deadline < self.deadline:
+            self.deadline = deadline
+
+    @property
+    def time_left(self):
+        """
+        :return: seconds left until deadline or None if there is no deadline
+        """
+        if self.deadline is None:
+            return None
+        return max(0, self.deadline - time.monotonic())
+
+    def check_deadline(self):
+        if self.time_left == 0:
+            raise DeadlineExceeded()
+
+    async def within_deadline(self, awaitable):
+        """
+        Awaits `awaitable`, cancelling it if request deadline comes first.
+
+        :raise: DeadlineExceeded
+        """
+        time_left = self.time_left
+        if time_left is None:
+            return await awaitable
+        try:
+            return await asyncio.wait_for(awaitable, time_left)
+        except asyncio.TimeoutError:
+            if self.time_left:
+                # Not ours
+                raise
+            raise DeadlineExceeded()
+
     def db_connection(self):
         """
         :return: coroutine
@@ -103,12 +176,14 @@ class ServiceRequest(object):
             prop.name: prop.value for prop in self._loggable_properties
         }
 
-    def get_data(self, schema=None, allow_use_args=True):
+    def get_data(self, schema=None, allow_use_args=True, schema_key=None):
         """
         If called for HTTP GET request - uses data from querystring. Otherwise, for HTTP POST/mq request
         trying to use request.json.
 
         Validates input if request_schema presents.
+        :param schema: schema to use instead of method's `request_schema`
+        :param schema_key: hashable cache key for dynamically built `schema` (see :func:`core.validation.get_validator`)
         :return: *validated* data from request
         """
 
@@ -127,7 +202,8 @@ class ServiceRequest(object):
 
         if schema:
             try:
-                validate_schema(data, schema)
+                get_validator(schema, key=schema_key,
+                              backend=self.app.config.get('SCHEMA_VALIDATION_BACKEND')).validate(data)
             except ValidationError as e:
                 raise ServiceBadRequestError("Input schema error", payload={'error_path': list(e.absolute_path),
                                                                             'error_message': e.message})
@@ -185,6 +261,86 @@ class ServiceResponse(object):
     def add_header(self, name, value):
         self.extra_headers[name] = value
 
+    @property
+    def status_code(self):
+        return self.extra_params.get('status_code', 200)
+
+    def render_body(self):
+        """
+        :return: bytes, the body `render_to_http_response` would produce
+        """
+        return json_dumps(self.response_data).encode()
+
+    def prerender(self):
+        """
+        :return: :class:`PreRenderedResponse` with the current state of this response
+        """
+        return PreRenderedResponse(self.render_body(), self.request_fulfilled, headers=self.extra_headers,
+                                   status_code=self.status_code)
+
+
+class PreRenderedResponse(ServiceResponse):
+    """
+    Response which body is already rendered (e.g. restored from cache), so it can be sent without encoding.
+    `response_data` is decoded only if anyone needs it; if it's replaced - body is rendered again.
+
+    Can be serialized to bytes with :meth:`dumps`.
+    """
+
+    _dumps_header = struct.Struct('>HI')
+
+    def __init__(self, body, request_fulfilled, headers=None, **kwargs):
+        """
+        :param body: bytes, rendered JSON
+        :param headers: dict
+        """
+        self._body = body
+        self._response_data = None
+        super(PreRenderedResponse, self).__init__(None, request_fulfilled, **kwargs)
+        self.extra_headers = dict(headers or {})
+
+    @property
+    def response_data(self):
+        if self._response_data is None and self._body is not None:
+            self._response_data = json.loads(self._body.decode())
+            # Decoded data is mutable, so the body can't be trusted anymore.
+            self._body = None
+        return self._response_data
+
+    @response_data.setter
+    def response_data(self, value):
+        if value is None:
+            return
+        self._response_data = value
+        self._body = None
+
+    def render_body(self):
+        if self._body is None:
+            return super(PreRenderedResponse, self).render_body()
+        return self._body
+
+    def render_to_http_response(self, service_request):
+        return HTTPResponse(body_bytes=self.render_body(), status=self.status_code, headers=self.extra_headers,
+                            content_type='application/json')
+
+    def dumps(self):
+        """
+        :return: bytes
+        """
+        headers = json.dumps(self.extra_headers).encode()
+        return b''.join((self._dumps_header.pack(self.status_code, len(headers)), headers, self.render_body()))
+
+    @classmethod
+    def loads(cls, data, request_fulfilled=True):
+        """
+        :param data: bytes from :meth:`dumps`
+        :return: PreRenderedResponse
+        """
+        status_code, headers_len = cls._dumps_header.unpack_from(data)
+        offset = cls._dumps_header.size
+        headers = json.loads(data[offset:offset + headers_len].decode())
+        return cls(data[offset + headers_len:], request_fulfilled, headers=headers, status_code=status_code)
+
 
 class ServiceStreamResponse(ServiceResponse):
     """
@@ -237,16 +393,25 @@ class RequestHandler(object):
         self.method = service_request.method
 
     async def make_response(self, middlewares):
+        """
+        :param middlewares: compiled :class:`services.pipeline.MiddlewarePipeline` or list of middlewares
+        :return: ServiceResponse
+        """
+        if isinstance(middlewares, MiddlewarePipeline):
+            pipeline = middlewares
+        else:
+            pipeline = MiddlewarePipeline.compile(middlewares, is_webhook=self.service_request.is_webhook)
+
         service_response = None
         exception = None
 
         try:
-            service_response = await self._run_gateway_middlewares('request', middlewares)
+            service_response = await self._run_request_pipeline(pipeline)
             if not service_response:
                 service_response_ = self.service.call_method(self.method.class_attr, self.service_request)
 
                 if isawaitable(service_response_):
-                    service_response = await service_response_
+                    service_response = await self.service_request.within_deadline(service_response_)
                 else:
                     service_response = service_response_
                 assert isinstance(service_response, ServiceResponse), \
@@ -255,8 +420,7 @@ class RequestHandler(object):
             exception = e
             raise
         finally:
-            service_response_ = await self._run_gateway_middlewares('response', middlewares, service_response,
-                                                                    exception)
+            service_response_ = await self._run_response_pipeline(pipeline, service_response, exception)
             if service_response_:
                 assert isinstance(service_response, ServiceResponse), \
                     "Response must be instance of ServiceResponse"
@@ -264,10 +428,7 @@ class RequestHandler(object):
 
         return service_response
 
-    async def _run_gateway_middlewares(self, handle_phase,
-                                       middlewares,
-                                       service_response: ServiceResponse = None,
-                                       gateway_error: BaseApiException = None):
+    async def _run_request_pipeline(self, pipeline):
         """
         There is a difference in Incoming Pipleline (request phase) and Outgoing Pipeline (response phase):
         *
@@ -277,29 +438,37 @@ class RequestHandler(object):
             During Outgoing processing - we go thought all the middlewares before return response.
             So response could be overrided/altered by underlying middlewares.
 
-        :param handle_phase: str, 'request'/'response'
-        :param middlewares: list of middlewares
+        :param pipeline: MiddlewarePipeline
+        :return: ServiceResponse or None
+        """
+        service_response = None
+        service_request = self.service_request
+
+        for handler, is_async in pipeline.request_steps:
+            _response = handler(service_request)
+            if is_async:
+                _response = await _response
+            if _response and service_response is None:
+                service_response = _response
+        return service_response
+
+    async def _run_response_pipeline(self, pipeline,
+                                     service_response: ServiceResponse = None,
+                                     gateway_error: BaseApiException = None):
+        """
+        See :meth:`_run_request_pipeline`.
+
+        :param pipeline: MiddlewarePipeline
         :param service_response: ServiceResponse instance or None
+        :param gateway_error: BaseApiException instance or None
         :return: ServiceResponse or None
         """
-        assert handle_phase in ('request', 'response')
-
-        for middleware_obj in middlewares:
-            if self.service_request.is_webhook and not middleware_obj.webhook_friendly:
-                # Skip middlewares for webhooks. E.g., we don't need auth there.
-                continue
-
-            if handle_phase == 'request':
-                _response = middleware_obj._process_request(self.service_request)
-                if isawaitable(_response):
-                    _response = await _response
-                if _response:
-                    if service_response is None:
-                        service_response = _response
-            elif handle_phase == 'response':
-                _response = middleware_obj._process_response(self.service_request, service_response, gateway_error)
-                if isawaitable(_response):
-                    _response = await _response
-                if _response:
-                    service_response = _response
+        service_request = self.service_request
+
+        for handler, is_async in pipeline.response_steps:
+            _response = handler(service_request, service_response, gateway_error)
+            if is_async:
+                _response = await _response
+            if _response:
+                service_response = _response
         return service_response
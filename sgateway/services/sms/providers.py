@@ -26,6 +26,7 @@ class TwillioProvider(BaseServiceProvider):
     Sending a message is as simple as POSTing to the Messages resource. We'll outline required and optional
     parameters, messaging services, alphanumeric sender ID, rate limiting, and handling message replies below.
     """
+    preconnect_urls = ('https://api.twilio.com',)
 
     def __init__(self, *args, **kwargs):
         super(TwillioProvider, self).__init__(*args, **kwargs)
@@ -39,7 +40,7 @@ class TwillioProvider(BaseServiceProvider):
         TWILLIO_SID = self.require_config('TWILLIO_SID')
         TWILLIO_TOKEN = self.require_config('TWILLIO_TOKEN')
 
-        return aiohttp.ClientSession(loop=self.app.loop, headers={
+        return self.http_session(headers={
             'Accept': 'application/json',
         }, auth=aiohttp.BasicAuth(TWILLIO_SID, TWILLIO_TOKEN))
 
@@ -1,12 +1,14 @@
 from sgateway.core.gateway_exceptions import ServiceInternalError
 from sgateway.core.utils import get_schema_models
-from sgateway.services import BaseService, expose_method
+from sgateway.services import BaseService, NO_DEADLINE, expose_method
 from .providers import TwillioProvider
 from .schemas import SMSMessage
 from ..registry import ServiceRegistry
 
 registry = ServiceRegistry()
 
+sms_models = get_schema_models(SMSMessage)
+
 
 @registry.register
 class SMSService(BaseService):
@@ -17,13 +19,12 @@ class SMSService(BaseService):
         TwillioProvider,
     )
 
-    @expose_method(request_schema=SMSMessage.get_schema(), http_method='POST')
+    @expose_method(request_schema=SMSMessage.get_schema(), http_method='POST', timeout=NO_DEADLINE)
     async def send(self, service_request):
         data = service_request.get_data()
         self.log.debug("data is: %s", data)
 
-        SmsMessage = get_schema_models(SMSMessage).SmsMessage
-        data_obj = SmsMessage(**data)
+        data_obj = sms_models.SmsMessage(**data)
 
         result = await self.failover_provider_call(service_request, 'send_sms', data_obj)
         if not result:
@@ -1,3 +1,4 @@
+import random
 from operator import itemgetter
 
 from sgateway.core.gateway_exceptions import InternalError
@@ -54,3 +55,49 @@ class RoundRobinStrategy(BaseProviderChoiceStrategy):
 
         # print("%s num_calls: %s", provider.__name__, self.calls_storage.get(provider.name))
         return provider
+
+
+class LeastLoadedStrategy(BaseProviderChoiceStrategy):
+    """
+    Selects provider with the lowest expected cost of a call, based on provider's stats (see
+    :class:`sgateway.services.base.provider.ProviderStats`): EWMA latency plus error rate penalty, multiplied by
+    the number of calls in flight. Providers without stats yet are selected first, so they get measured.
+
+    Stats are collected per worker, so it's not distributed as well.
+
+    With `choices` set only that many random providers are compared (see :class:`PowerOfTwoChoicesStrategy`).
+    """
+
+    #: Number of random providers to compare, None to compare all of them
+    choices = None
+    #: Seconds, expected cost of a failed call (i.e. of retrying it via another provider). Failing providers
+    #: usually fail fast, so latency alone would make them look good.
+    error_penalty = 1.0
+
+    def score(self, provider):
+        stats = provider.stats
+        if stats.latency is None:
+            return 0
+        return (stats.latency + stats.error_rate * self.error_penalty) * (stats.inflight + 1)
+
+    def select(self, request, providers):
+        providers = list(providers)
+        if self.choices is not None and len(providers) > self.choices:
+            providers = random.sample(providers, self.choices)
+        else:
+            # Ties are broken randomly
+            random.shuffle(providers)
+
+        try:
+            return min(providers, key=self.score)
+        except ValueError:
+            return None
+
+
+class PowerOfTwoChoicesStrategy(LeastLoadedStrategy):
+    """
+    Compares two random providers and selects the least loaded one. Unlike picking the least loaded among all,
+    it doesn't send all the traffic to the same provider between stats updates.
+    """
+
+    choices = 2
@@ -1,17 +1,14 @@
 import aiohttp
 
 from sgateway.core import gateway_exceptions
-from sgateway.core.utils import get_schema_models
 from sgateway.services.base.provider import BaseServiceProvider
 from sgateway.services.utils import provide_method
 from .constants import ALAVARA_MOCK_RESPONSE
-from .schemas import SaleTaxResponse
+from .schemas import SaleTaxResponseModel, SaleLineTaxResultModel, SaleLineTaxesModel
 
 
 def parse_alavara_tax_rates_response(data):
-    models = get_schema_models(SaleTaxResponse)
-
-    resp = models.SaleTaxResponse()
+    resp = SaleTaxResponseModel()
     resp.total_tax = data['totalTax']
     resp.lines = []
 
@@ -21,7 +18,7 @@ def parse_alavara_tax_rates_response(data):
         for tax in line['details']:
             tax_code_id = u'{country}_{jurisType}_{jurisName}'.format(**tax)
 
-            line_taxes.append(models.SaleLineTaxes(
+            line_taxes.append(SaleLineTaxesModel(
                 rate=tax['rate'], tax_name=tax['taxName'],
                 country=tax.get('country', ''),
                 region=tax.get('region', ''),
@@ -30,7 +27,7 @@ def parse_alavara_tax_rates_response(data):
                 tax_jurisdiction=tax.get('jurisName', ''),
             ))
 
-        resp.lines.append(models.SaleLineTaxResult(
+        resp.lines.append(SaleLineTaxResultModel(
             line_number=int(line['lineNumber']),
             taxes=line_taxes,
         ))
@@ -38,8 +35,7 @@ def parse_alavara_tax_rates_response(data):
 
 
 def parse_taxjar_tax_rates_response(data):
-    models = get_schema_models(SaleTaxResponse)
-    resp = models.SaleTaxResponse()
+    resp = SaleTaxResponseModel()
     # return resp
     raise NotImplementedError
 
@@ -48,7 +44,7 @@ class MockedProvider(BaseServiceProvider):
     __name__ = '_mocked_'
     supported_countries = ['US']
 
-    @provide_method()
+    @provide_method(hedge_safe=True)
     def taxes_for_sale(self, sale_data):
         test_data = ALAVARA_MOCK_RESPONSE
         return parse_alavara_tax_rates_response(test_data)
@@ -65,13 +61,17 @@ class AvataxProvider(BaseServiceProvider):
 
     supported_countries = ['US']
 
+    @classmethod
+    def get_preconnect_urls(cls, config):
+        return [config['AVATAX_API_URL']] if config.get('AVATAX_API_URL') else []
+
     @property
     def aiosession(self):
         # See https://developer.avalara.com/avatax/authentication-in-rest/
         ALAVARA_ACCOUNT_ID = self.require_config('ALAVARA_ACCOUNT_ID')
         ALAVARA_LICENCE_KEY = self.require_config('ALAVARA_LICENCE_KEY')
 
-        return aiohttp.ClientSession(loop=self.app.loop, headers={
+        return self.http_session(headers={
             'Accept': 'application/json',
         }, auth=aiohttp.BasicAuth(ALAVARA_ACCOUNT_ID, ALAVARA_LICENCE_KEY))
 
@@ -79,7 +79,7 @@ class AvataxProvider(BaseServiceProvider):
         AVATAX_API_URL = self.require_config("AVATAX_API_URL")
         return "{}/{}".format(AVATAX_API_URL.rstrip("/"), resource.lstrip("/"))
 
-    @provide_method()
+    @provide_method(hedge_safe=True)
     async def taxes_for_sale(self, sale_data):
         """
         It uses `CreateTransaction`:
@@ -168,12 +168,16 @@ class TaxJarProvider(BaseServiceProvider):
 
     supported_countries = []
 
+    @classmethod
+    def get_preconnect_urls(cls, config):
+        return [config['TAXJAR_API_URL']] if config.get('TAXJAR_API_URL') else []
+
     @property
     def aiosession(self):
         # See https://developers.taxjar.com/api/reference/#authentication
         TAXJAR_API_TOKEN = self.require_config('TAXJAR_API_TOKEN')
 
-        return aiohttp.ClientSession(loop=self.app.loop, headers={
+        return self.http_session(headers={
             'Accept': 'application/json',
             'Authorization': 'Bearer {}'.format(TAXJAR_API_TOKEN),
         })
@@ -1,5 +1,7 @@
 import jsl
 
+from sgateway.core.utils import SlotsModel
+
 
 class SaleLine(jsl.Document):
     line_number = jsl.NumberField(minimum=1, required=True)
@@ -69,3 +71,24 @@ class SaleTaxResponse(jsl.Document):
 
     class Options(object):
         title = 'Sale Tax Response'
+
+
+class SaleLineTaxesModel(SlotsModel):
+    """
+    Lightweight :class:`SaleLineTaxes` model.
+    """
+    __slots__ = ('rate', 'tax_name', 'country', 'region', 'tax_code_id', 'tax_type', 'tax_jurisdiction')
+
+
+class SaleLineTaxResultModel(SlotsModel):
+    """
+    Lightweight :class:`SaleLineTaxResult` model.
+    """
+    __slots__ = ('line_number', 'taxes')
+
+
+class SaleTaxResponseModel(SlotsModel):
+    """
+    Lightweight :class:`SaleTaxResponse` model.
+    """
+    __slots__ = ('total_tax', 'lines')
@@ -1,4 +1,4 @@
-from sgateway.services import BaseService, expose_method
+from sgateway.services import BaseService, CachePolicy, expose_method
 from sgateway.services.base.strategy import BaseProviderChoiceStrategy
 from .providers import AvataxProvider, TaxJarProvider
 from .schemas import SaleTaxQuery
@@ -23,7 +23,7 @@ class DomesticSaleStrategy(BaseProviderChoiceStrategy):
             if not self.country in getattr(provider, 'supported_countries', []):
                 continue
             suitable_providers.append(provider)
-        return suitable_providers[0]
+        return suitable_providers[0] if suitable_providers else None
 
 
 @registry.register
@@ -36,13 +36,12 @@ class TaxRatesService(BaseService):
         TaxJarProvider,
     )
 
-    @expose_method(request_schema=SaleTaxQuery.get_schema(), http_method='POST')
+    @expose_method(request_schema=SaleTaxQuery.get_schema(), http_method='POST',
+                   cache=CachePolicy(ttl=60 * 10, allow_post=True))
     async def taxes_for_sale(self, service_request):
         query_data = service_request.get_data()
-        provider = await self.get_provider(service_request, required_methods=['taxes_for_sale'],
-                                           strategy=DomesticSaleStrategy('US'))
-
-        resp = await provider.call_method('taxes_for_sale', query_data)
+        resp = await self.hedged_provider_call(service_request, 'taxes_for_sale', query_data,
+                                               strategy=DomesticSaleStrategy('US'))
         resp_data = resp.for_json()
         return self.result(resp_data)
 
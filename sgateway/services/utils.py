@@ -1,8 +1,51 @@
 #: Only this methods can be used for service methods
 ALLOWED_METHODS = ['GET', 'POST']
 
+#: `expose_method(timeout=NO_DEADLINE)` - requests of the method have no deadline, so the method is never cancelled
+#: half way, e.g. between a purchase at provider and saving it. Provider calls are bounded by their own timeouts.
+NO_DEADLINE = 0
 
-def expose_method(http_method=None, request_schema=None, method_name=None, webhook=False):
+
+class CachePolicy(object):
+    """
+    Describes how responses of a service method are cached by `sgateway.middlewares.caching.CacheMiddleware`.
+    """
+
+    __slots__ = ('ttl', 'vary_by_args', 'vary_by_entity', 'max_size', 'allow_post')
+
+    def __init__(self, ttl, vary_by_args=None, vary_by_entity=False, max_size=None, allow_post=False):
+        """
+        :param ttl: seconds, or callable that takes `ServiceRequest` and returns seconds
+        :param vary_by_args: names of query arguments that make the cache key. If None - whole query string is used.
+        :param vary_by_entity: if True - every entity gets its own cache entries
+        :param max_size: max size of response body (bytes) to be cached
+        :param allow_post: if True - POST requests are also cached, keyed by the normalized JSON body
+        """
+        self.ttl = ttl
+        self.vary_by_args = tuple(sorted(vary_by_args)) if vary_by_args is not None else None
+        self.vary_by_entity = vary_by_entity
+        self.max_size = max_size
+        self.allow_post = allow_post
+
+    def get_ttl(self, service_request):
+        if callable(self.ttl):
+            return self.ttl(service_request)
+        return self.ttl
+
+    def allows(self, http_method):
+        return http_method == 'GET' or (http_method == 'POST' and self.allow_post)
+
+    def as_dict(self):
+        return {
+            'ttl': None if callable(self.ttl) else self.ttl,
+            'vary_by_args': list(self.vary_by_args) if self.vary_by_args is not None else None,
+            'vary_by_entity': self.vary_by_entity,
+            'max_size': self.max_size,
+            'allow_post': self.allow_post,
+        }
+
+
+def expose_method(http_method=None, request_schema=None, method_name=None, webhook=False, cache=None, timeout=None):
     """
     Decorator to register method as service method and allow to expose it via url
 
@@ -10,12 +53,19 @@ def expose_method(http_method=None, request_schema=None, method_name=None, webho
     :param request_schema:
     :param method_name:
     :param webhook:
+    :param cache: :class:`CachePolicy` or ttl (seconds) for a default one
+    :param timeout: max time budget of a request (seconds), `DEFAULT_REQUEST_TIMEOUT` if None, or
+        :data:`NO_DEADLINE` for methods with side effects
     :return:
     """
     # Mark class method
     http_method = (http_method or 'GET').upper()
     if http_method not in ALLOWED_METHODS:
         raise ValueError("HTTP method {} is not allowed for exposed method".format(http_method))
+    if cache is not None and not isinstance(cache, CachePolicy):
+        cache = CachePolicy(ttl=cache)
+    if cache is not None and not cache.allows(http_method):
+        raise ValueError("Cache policy doesn't allow HTTP method {}".format(http_method))
 
     def wrap(fn):
         fn._method_name = method_name or fn.__name__
@@ -23,6 +73,8 @@ def expose_method(http_method=None, request_schema=None, method_name=None, webho
         fn._webhook = webhook
         fn._http_method = http_method
         fn._request_schema = request_schema
+        fn._cache_policy = cache
+        fn._timeout = timeout
         return fn
 
     return wrap
@@ -42,10 +94,18 @@ def webhook_callback(*args, **kwargs):
     return wrap
 
 
-def provide_method(**kwargs):
+def provide_method(hedge_safe=False, **kwargs):
+    """
+    Decorator to register method as provider method
+
+    :param hedge_safe: if True - method has no side effects, so it can be called on several providers at once
+        (see :meth:`sgateway.services.base.service.BaseService.hedged_provider_call`)
+    :return:
+    """
     def wrap(fn):
         fn._method_name = fn.__name__
         fn._provider_method = True
+        fn._hedge_safe = hedge_safe
         return fn
 
     return wrap
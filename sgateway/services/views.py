@@ -5,6 +5,7 @@ from sanic import Blueprint, response
 
 from sgateway.core.gateway_exceptions import ServiceNotFound, ServiceUnavailable
 from . import ServiceRegistry, ServiceRequest, RequestHandler
+from .pipeline import PipelinesRegistry
 
 
 class ServicesBlueprint(Blueprint):
@@ -16,16 +17,24 @@ class ServicesBlueprint(Blueprint):
         self.service_registry = kwargs.pop('service_registry', ServiceRegistry())
         self._middleware_classes = kwargs.pop('middleware_classes', None)
         self._registered_for_app = None
+        self._services = []
+        self.pipelines = None
         super(ServicesBlueprint, self).__init__(*args, **kwargs)
 
     def _service_request_handler_factory(self, service, method):
+        pipeline = None
+
         async def request_handler(request, *args, **kwargs):
             """
             :return: HttpResponse
             """
+            nonlocal pipeline
+            if pipeline is None:
+                pipeline = self.pipelines.get(service, method)
+
             service_request = ServiceRequest(service, method, request.app, request)
             handler = RequestHandler(service_request)
-            service_response = await handler.make_response(self.gateway_middlewares)
+            service_response = await handler.make_response(pipeline)
             if not service_response:
                 raise ServiceUnavailable("Service didn't return any response")
             return service_response.render_to_http_response(service_request)
@@ -66,7 +75,13 @@ class ServicesBlueprint(Blueprint):
                     stream=False,
                 )(self._service_request_handler_factory(service, method))
 
+            service.compile_validators()
             service.on_registered()
+            self._services.append(service)
+
+        # Construct providers upfront. Misconfigured ones are still tried lazily (and fail) on use.
+        for provider_class, error in self.service_registry.init_providers(app):
+            app.logger.warning("Provider {} is not available: {}".format(provider_class.__name__, error))
 
     def register_middlewares(self, app):
         # Register services specific middlewares
@@ -82,6 +97,10 @@ class ServicesBlueprint(Blueprint):
             mw.on_registered()
             self.gateway_middlewares.append(mw)
 
+        # Build per-route pipelines upfront, so request handling doesn't have to inspect middlewares.
+        self.pipelines = PipelinesRegistry(self.gateway_middlewares)
+        self.pipelines.compile_services(self._services)
+
     def register(self, app, options):
         if self._registered_for_app and self._registered_for_app is not app:
             raise RuntimeError("Blueprint already registered in another app")
@@ -1,5 +1,6 @@
 import sys
 
+import aioredis
 import pytest
 from pytest_redis import factories
 
@@ -59,6 +60,17 @@ async def app_database(gateway_app):
         await gateway_app.db.stop_engine()
 
 
+@pytest.fixture()
+async def app_redis(gateway_app):
+    redis_config = gateway_app.config['REDIS_CONFIG']
+    gateway_app.redis_pool = await aioredis.create_pool((redis_config['HOST'], int(redis_config['PORT'])))
+    try:
+        yield gateway_app.redis_pool
+    finally:
+        gateway_app.redis_pool.close()
+        await gateway_app.redis_pool.wait_closed()
+
+
 @pytest.yield_fixture(scope='function')
 def service_registry():
 
@@ -22,6 +22,7 @@ def test_gateway_app_running(gateway_app, app_server):
     assert gateway_app.loop
     assert gateway_app.redis_pool
     assert gateway_app.db
+    assert gateway_app.http_client.started
 
 
 def test_wsgi_app(monkeypatch):
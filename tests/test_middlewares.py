@@ -1,13 +1,25 @@
+import asyncio
+import json
+import time
 import uuid
 
+import jwt
 import pytest
 
 from sgateway.core.base_app import SGatewayRequest
 from sgateway.core.gateway_exceptions import ServiceInternalError, ServiceBadRequestError, InternalError
-from sgateway.middlewares.idempotency_key import IdempotencyKeyMiddleware
+from sgateway.core.gateway_exceptions import RequestIdempotencyError, ServiceQuotaExceeded, UnauthorizedApiException
+from sgateway.middlewares.authentication import AuthMiddleware
+from sgateway.middlewares.caching import CacheMiddleware
+from sgateway.middlewares.idempotency_key import IdempotencyKeyMiddleware, PostgresIdempotencyStore
+from sgateway.middlewares.idempotency_key import RedisIdempotencyStore
+from sgateway.middlewares.logger import LoggerMiddleware
+from sgateway.middlewares.rate_limiting import RATE_LIMITS, RateLimitingMiddleware
+from sgateway.services.base.middleware import BaseMiddleware
 from sgateway.services.base.service import BaseService, ServiceMethod
-from sgateway.services.request import ServiceRequest, ServiceResponse
-from sgateway.services.utils import expose_method, webhook_callback
+from sgateway.services.pipeline import MiddlewarePipeline, PipelinesRegistry
+from sgateway.services.request import ServiceRequest, ServiceResponse, PreRenderedResponse
+from sgateway.services.utils import CachePolicy, expose_method, webhook_callback
 
 
 class ServiceForTest(BaseService):
@@ -39,7 +51,7 @@ async def test_key_idempotency(gateway_app, app_database):
     """
     TODO: rewrite as class test suite
     """
-    mw = IdempotencyKeyMiddleware(gateway_app, ttl=999)
+    mw = IdempotencyKeyMiddleware(gateway_app, ttl=999, wait_timeout=0)
     request_with_key = SGatewayRequest('/'.encode(), {'X-Idempotency-Key': str(uuid.uuid4())[:32]}, None, method='GET',
                                        transport=None)
     request_no_key = SGatewayRequest('/'.encode(), {}, None, method='GET', transport=None)
@@ -74,7 +86,7 @@ async def test_key_idempotency(gateway_app, app_database):
         await mw.process_request(sr)
 
     # Check TTL
-    mw_ttl_0 = IdempotencyKeyMiddleware(gateway_app, ttl=-1)
+    mw_ttl_0 = IdempotencyKeyMiddleware(gateway_app, ttl=-1, wait_timeout=0)
     sr = ServiceRequest(service, method, gateway_app, request_with_key)
     await mw_ttl_0.process_request(sr)
 
@@ -110,3 +122,428 @@ async def test_key_idempotency(gateway_app, app_database):
     # and third request works like a charm
     sr3 = ServiceRequest(service, method, gateway_app, request_with_key)
     assert not await mw.process_request(sr3)
+
+
+@pytest.mark.asyncio
+async def test_key_idempotency_postgres_store(gateway_app, app_database):
+    store = PostgresIdempotencyStore(gateway_app, 999)
+    key = str(uuid.uuid4())[:32]
+
+    # Only one of concurrent requests acquires the lock
+    results = await asyncio.gather(*[store.acquire(key, 'scope') for _ in range(5)], return_exceptions=True)
+    assert results.count(None) == 1
+    assert all(isinstance(r, RequestIdempotencyError) for r in results if r is not None)
+
+    await store.save_response(key, 'scope', b'response')
+    assert await store.acquire(key, 'scope') == b'response'
+
+    # Expired lock is taken over even if not purged yet
+    assert await PostgresIdempotencyStore(gateway_app, -1).acquire(key, 'scope') is None
+    with pytest.raises(RequestIdempotencyError):
+        await store.acquire(key, 'scope')
+
+
+@pytest.mark.asyncio
+async def test_key_idempotency_redis_store(gateway_app, app_redis):
+    mw = IdempotencyKeyMiddleware(gateway_app, ttl=999, store_class=RedisIdempotencyStore, wait_timeout=0)
+    request_with_key = SGatewayRequest('/'.encode(), {'X-Idempotency-Key': str(uuid.uuid4())[:32]}, None, method='GET',
+                                       transport=None)
+    service = ServiceForTest(gateway_app)
+    method = ServiceMethod('test', 'test_method', False, 'GET', None)
+
+    sr = ServiceRequest(service, method, gateway_app, request_with_key)
+    assert not await mw.process_request(sr)
+    with pytest.raises(ServiceBadRequestError):
+        await mw.process_request(ServiceRequest(service, method, gateway_app, request_with_key))
+
+    # Lock is dropped on unfulfilled request
+    await mw.process_response(sr, ServiceResponse({}, request_fulfilled=False), None)
+    sr = ServiceRequest(service, method, gateway_app, request_with_key)
+    assert not await mw.process_request(sr)
+
+    # Fulfilled response is replayed
+    await mw.process_response(sr, ServiceResponse({'success': True}, request_fulfilled=True, status_code=201), None)
+    replayed = await mw.process_request(ServiceRequest(service, method, gateway_app, request_with_key))
+    assert isinstance(replayed, PreRenderedResponse)
+    assert replayed.status_code == 201
+    assert replayed.response_data == {'success': True}
+
+
+@pytest.mark.asyncio
+async def test_key_idempotency_wait_original(gateway_app, app_redis, event_loop):
+    mw = IdempotencyKeyMiddleware(gateway_app, ttl=999, store_class=RedisIdempotencyStore, wait_timeout=5)
+    request_with_key = SGatewayRequest('/'.encode(), {'X-Idempotency-Key': str(uuid.uuid4())[:32]}, None, method='GET',
+                                       transport=None)
+    service = ServiceForTest(gateway_app)
+    method = ServiceMethod('test', 'test_method', False, 'GET', None)
+
+    original = ServiceRequest(service, method, gateway_app, request_with_key)
+    assert not await mw.process_request(original)
+
+    duplicates = [event_loop.create_task(mw.process_request(ServiceRequest(service, method, gateway_app,
+                                                                           request_with_key)))
+                  for _ in range(3)]
+    await asyncio.sleep(0.2)
+    assert not any(x.done() for x in duplicates)
+
+    await mw.process_response(original, ServiceResponse({'success': True}, request_fulfilled=True), None)
+    for response in await asyncio.gather(*duplicates):
+        assert response.response_data == {'success': True}
+
+
+def test_compiled_pipeline(gateway_app):
+    class RequestOnlyMiddleware(BaseMiddleware):
+        def process_request(self, service_request):
+            return
+
+    class WebhookMiddleware(BaseMiddleware):
+        webhook_friendly = True
+
+        async def process_request(self, service_request):
+            return
+
+        def process_response(self, service_request, service_response, gateway_error):
+            return
+
+    request_only, webhook_mw = RequestOnlyMiddleware(gateway_app), WebhookMiddleware(gateway_app)
+
+    pipeline = MiddlewarePipeline.compile([request_only, webhook_mw])
+    assert [step.is_async for step in pipeline.request_steps] == [False, True]
+    assert len(pipeline.response_steps) == 1
+    assert not pipeline.response_steps[0].is_async
+
+    # Not webhook friendly middlewares are excluded for webhooks
+    pipeline = MiddlewarePipeline.compile([request_only, webhook_mw], is_webhook=True)
+    assert len(pipeline.request_steps) == 1
+    assert pipeline.request_steps[0].is_async
+
+    pipelines = PipelinesRegistry([request_only, webhook_mw])
+    service = ServiceForTest(gateway_app)
+    pipelines.compile_services([service])
+    assert pipelines.get(service, service.get_method('test_method')) is pipelines.get(
+        service, service.get_method('test_method'))
+    assert len(pipelines.get(service, service.get_method('test_webhook')).request_steps) == 1
+
+
+def test_prerendered_response():
+    resp = ServiceResponse({'rates': {'USD': 1.2}}, request_fulfilled=True, status_code=201)
+    resp.add_header('X-Test', 'yes')
+
+    restored = PreRenderedResponse.loads(resp.prerender().dumps())
+    assert restored.status_code == 201
+    assert restored.extra_headers == {'X-Test': 'yes'}
+    assert restored.render_body() == resp.render_body()
+    assert restored.response_data == {'rates': {'USD': 1.2}}
+
+    # Altered data gets rendered again
+    restored.response_data['rates']['USD'] = 1.3
+    assert restored.render_body() == ServiceResponse({'rates': {'USD': 1.3}}, True).render_body()
+
+
+@pytest.mark.asyncio
+async def test_cache_local_tier(gateway_app):
+    mw = CacheMiddleware(gateway_app)
+    service = ServiceForTest(gateway_app)
+    method = ServiceMethod('test', 'test_method', False, 'GET', None)
+    request = SGatewayRequest('/?base=EUR'.encode(), {}, None, method='GET', transport=None)
+
+    sr = ServiceRequest(service, method, gateway_app, request)
+    resp = ServiceResponse({'success': True}, request_fulfilled=True)
+    mw.local_cache.set(await mw._get_cache_key(sr), mw._pack_entry(resp, 60))
+
+    # Served from process memory, no redis involved (pool isn't even created)
+    cached = await mw.process_request(ServiceRequest(service, method, gateway_app, request))
+    assert isinstance(cached, PreRenderedResponse)
+    assert cached.response_data == {'success': True}
+    assert cached is not await mw.process_request(ServiceRequest(service, method, gateway_app, request))
+
+
+@pytest.mark.asyncio
+async def test_cache_coalescing(gateway_app, event_loop, monkeypatch):
+    gateway_app._loop = event_loop
+    mw = CacheMiddleware(gateway_app)
+    service = ServiceForTest(gateway_app)
+    method = ServiceMethod('test', 'test_method', False, 'GET', None, CachePolicy(ttl=60))
+    request = SGatewayRequest('/?base=EUR'.encode(), {}, None, method='GET', transport=None)
+    cache_key = await mw._get_cache_key(ServiceRequest(service, method, gateway_app, request))
+
+    # Stale entry is served, and refreshed in background once
+    mw.stale_ttl = 60
+    mw.local_cache.set(cache_key, mw._pack_entry(ServiceResponse({'success': False}, request_fulfilled=True), -1))
+    for _ in range(2):
+        response = await mw.process_request(ServiceRequest(service, method, gateway_app, request))
+        assert response.response_data == {'success': False}
+    assert len(mw._inflight) == 1
+    await asyncio.sleep(0.01)
+    assert not mw._inflight
+
+    # Refresh of a hanging method gives up after the coalesce timeout
+    async def _hang(*args):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(service, 'call_method', lambda *args: _hang())
+    mw.coalesce_timeout = 0.01
+    mw._inflight[cache_key] = event_loop.create_future()
+    await mw._refresh(cache_key, ServiceRequest(service, method, gateway_app, request))
+    assert not mw._inflight
+
+    async def _cache_miss(cache_key):
+        return None
+
+    monkeypatch.setattr(mw, '_get_cached', _cache_miss)
+
+    # Concurrent requests wait for the one that is already in flight
+    mw._inflight[cache_key] = event_loop.create_future()
+    waiters = [event_loop.create_task(mw.process_request(ServiceRequest(service, method, gateway_app, request)))
+               for _ in range(3)]
+    await asyncio.sleep(0)
+    mw._resolve_inflight(cache_key, mw._pack_entry(ServiceResponse({'success': True}, request_fulfilled=True), 60))
+    for response in await asyncio.gather(*waiters):
+        assert response.response_data == {'success': True}
+    assert not mw._inflight
+
+    # Nothing to share - waiters go to the service on their own
+    mw._inflight[cache_key] = event_loop.create_future()
+    waiter = event_loop.create_task(mw.process_request(ServiceRequest(service, method, gateway_app, request)))
+    await asyncio.sleep(0)
+    mw._resolve_inflight(cache_key, None)
+    assert await waiter is None
+
+    # Requests of methods without a cache policy are not coalesced
+    mw._inflight[cache_key] = event_loop.create_future()
+    sr = ServiceRequest(service, ServiceMethod('test', 'test_method', False, 'GET', None), gateway_app, request)
+    assert await mw.process_request(sr) is None
+    assert sr.get_extension(mw._inflight_ext) is None
+    await mw.process_response(sr, ServiceResponse({'success': True}, request_fulfilled=True), None)
+    assert not mw._inflight[cache_key].done()
+
+
+@pytest.mark.asyncio
+async def test_cache_policy_keys(gateway_app):
+    class CachedService(BaseService):
+        __name__ = 'cached_service'
+
+        @expose_method(cache=CachePolicy(ttl=30, vary_by_args=['domain']))
+        def check(self, service_request):
+            return self.result({'success': True})
+
+        @expose_method(http_method='POST', cache=CachePolicy(ttl=30, allow_post=True))
+        def calculate(self, service_request):
+            return self.result({'success': True})
+
+    mw = CacheMiddleware(gateway_app)
+    service = CachedService(gateway_app)
+    methods = dict(service.iter_exposed_methods())
+    assert service.get_service_schema()['methods']['check']['cache']['ttl'] == 30
+
+    async def _get_key(method, url, body=None, http_method='GET'):
+        request = SGatewayRequest(url.encode(), {}, None, method=http_method, transport=None)
+        request.body = body
+        return await mw._get_cache_key(ServiceRequest(service, method, gateway_app, request))
+
+    # Only listed arguments matter
+    assert await _get_key(methods['check'], '/?domain=a.com&_=1') == await _get_key(methods['check'], '/?domain=a.com')
+    assert await _get_key(methods['check'], '/?domain=a.com') != await _get_key(methods['check'], '/?domain=b.com')
+
+    # POST is keyed by normalized body
+    key = await _get_key(methods['calculate'], '/', b'{"a": 1, "b": 2}', 'POST')
+    assert key == await _get_key(methods['calculate'], '/', b'{"b":2,"a":1}', 'POST')
+    assert key != await _get_key(methods['calculate'], '/', b'{"b":2,"a":2}', 'POST')
+    assert await _get_key(methods['calculate'], '/', b'{broken', 'POST') is None
+
+    # No POST caching without a policy
+    assert await _get_key(ServiceMethod('test', 'test_method', False, 'POST', None), '/', b'{}', 'POST') is None
+
+    with pytest.raises(ValueError):
+        expose_method(http_method='POST', cache=30)
+
+
+class EntityServiceRequest(ServiceRequest):
+    __slots__ = ()
+
+    @property
+    async def entity_id(self):
+        return 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('algorithm', ['fixed', 'sliding', 'token_bucket'])
+async def test_rate_limiting(gateway_app, app_redis, monkeypatch, algorithm):
+    monkeypatch.setitem(RATE_LIMITS['per_service'], 'test_service', {
+        'quota': 2,
+        'window': 60,
+        'only_limit_fulfilled': True,
+        'algorithm': algorithm,
+    })
+    mw = RateLimitingMiddleware(gateway_app)
+    service = ServiceForTest(gateway_app)
+    method = ServiceMethod('test', 'test_method', False, 'GET', None)
+    request = SGatewayRequest('/'.encode(), {}, None, method='GET', transport=None)
+
+    async def _request(request_fulfilled=True):
+        sr = EntityServiceRequest(service, method, gateway_app, request)
+        await mw.process_request(sr)
+        resp = ServiceResponse({}, request_fulfilled=request_fulfilled)
+        await mw.process_response(sr, resp, None)
+        return resp
+
+    assert (await _request()).extra_headers['X-Service-Quota'] == 1
+    # Unfulfilled request is refunded
+    assert 'X-Service-Quota' not in (await _request(request_fulfilled=False)).extra_headers
+    assert (await _request()).extra_headers['X-Service-Quota'] == 0
+
+    with pytest.raises(ServiceQuotaExceeded):
+        await mw.process_request(EntityServiceRequest(service, method, gateway_app, request))
+
+
+@pytest.mark.asyncio
+async def test_rate_limiting_leases(gateway_app, app_redis, monkeypatch):
+    monkeypatch.setitem(RATE_LIMITS['per_service'], 'test_service', {'quota': 100, 'window': 60})
+    monkeypatch.setitem(RATE_LIMITS, 'total', {'quota': 1000, 'window': 60})
+    mw = RateLimitingMiddleware(gateway_app)
+    mw.lease_size = 10
+    service = ServiceForTest(gateway_app)
+    method = ServiceMethod('test', 'test_method', False, 'GET', None)
+    request = SGatewayRequest('/'.encode(), {}, None, method='GET', transport=None)
+    service_key = await mw._get_service_key(EntityServiceRequest(service, method, gateway_app, request), 1)
+    with await app_redis as conn:
+        await conn.delete(service_key)
+
+    for _ in range(5):
+        sr = EntityServiceRequest(service, method, gateway_app, request)
+        await mw.process_request(sr)
+        await mw.process_response(sr, ServiceResponse({}, request_fulfilled=True), None)
+
+    # Whole lease is consumed in redis, but spent locally
+    with await app_redis as conn:
+        assert int(await conn.get(service_key)) == 10
+    assert mw._leases[service_key].tokens == 5
+    assert sr.get_extension('service_requests_left') == 95
+    # Lease expires with the window
+    assert 0 < mw._leases[service_key].expires_at - time.monotonic() <= 60
+
+    # Unspent tokens are returned
+    await mw._release_leases()
+    assert not mw._leases
+    with await app_redis as conn:
+        assert int(await conn.get(service_key)) == 5
+
+    # Leases released by a concurrent request while another one is being taken
+    sr = EntityServiceRequest(service, method, gateway_app, request)
+    await mw.process_request(sr)
+    mw._leases[service_key].tokens = 0
+    call_script = mw._call_script
+
+    async def _call_script(items):
+        mw._call_script = call_script
+        result = await call_script(items)
+        await mw._release_leases()
+        return result
+
+    mw._call_script = _call_script
+    sr = EntityServiceRequest(service, method, gateway_app, request)
+    await mw.process_request(sr)
+    assert mw._leases[service_key].tokens == 9
+    with await app_redis as conn:
+        assert int(await conn.get(service_key)) == 25
+
+    # Tokens of an expired lease are neither refunded nor returned
+    for lease in mw._leases.values():
+        lease.expires_at = time.monotonic() - 1
+    await mw.process_response(sr, ServiceResponse({}, request_fulfilled=False), None)
+    await mw._release_leases(idle_for=60)
+    assert not mw._leases
+    with await app_redis as conn:
+        assert int(await conn.get(service_key)) == 25
+
+
+def test_auth_tokens_cache(gateway_app, tmpdir):
+    keys_file = tmpdir.join('keys.json')
+    keys_file.write(json.dumps({'k1': 'secret1'}))
+    gateway_app.config['AUTH_CONFIG'] = dict(gateway_app.config['AUTH_CONFIG'], KEYS_FILE=str(keys_file),
+                                             KEYS_FILE_CHECK_INTERVAL=0)
+    mw = AuthMiddleware(gateway_app)
+    mw.on_registered()
+
+    token = jwt.encode({'entity_id': 1}, gateway_app.config['INTERNAL_GATEWAY_KEY'], algorithm='HS256').decode()
+    for _ in range(3):
+        assert mw.verify_token(token) == {'entity_id': 1}
+    assert mw.get_stats() == {'tokens_cache_hits': 2, 'tokens_cache_misses': 1}
+
+    # Expiration is respected
+    expired = jwt.encode({'entity_id': 1, 'exp': int(time.time()) - 1}, gateway_app.config['INTERNAL_GATEWAY_KEY'],
+                         algorithm='HS256').decode()
+    with pytest.raises(UnauthorizedApiException):
+        mw.verify_token(expired)
+
+    # Keys are selected by `kid` and can be rotated
+    token = jwt.encode({'entity_id': 2}, 'secret1', algorithm='HS256', headers={'kid': 'k1'}).decode()
+    assert mw.verify_token(token) == {'entity_id': 2}
+    keys_file.write(json.dumps({'k2': 'secret2'}))
+    keys_file.setmtime(time.time() + 10)
+    with pytest.raises(UnauthorizedApiException):
+        mw.verify_token(token)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('policy', ['drop_new', 'drop_oldest'])
+async def test_logger_buffer(gateway_app, monkeypatch, policy):
+    gateway_app.config['MQ_LOGGING_CONFIG'] = dict(gateway_app.config['MQ_LOGGING_CONFIG'], BUFFER_SIZE=3,
+                                                   BATCH_SIZE=2, OVERFLOW_POLICY=policy)
+    mw = LoggerMiddleware(gateway_app)
+    published = []
+    monkeypatch.setattr(mw, 'log_via_mq', lambda service_name, data: published.append(data['n']))
+
+    for n in range(5):
+        await mw.enqueue('test_service', {'n': n})
+    assert mw.get_stats() == {'buffered': 3, 'published': 0, 'dropped': 2, 'failed': 0, 'spooled': 0, 'replayed': 0}
+
+    await mw.flush()
+    assert published == ([0, 1, 2] if policy == 'drop_new' else [2, 3, 4])
+    assert mw.get_stats()['published'] == 3
+
+
+@pytest.mark.asyncio
+async def test_logger_spool(gateway_app, monkeypatch, tmpdir):
+    gateway_app.config['MQ_LOGGING_CONFIG'] = dict(gateway_app.config['MQ_LOGGING_CONFIG'], SPOOL_DIR=str(tmpdir),
+                                                   SPOOL_SEGMENT_SIZE=100, SPOOL_FSYNC='always')
+    mw = LoggerMiddleware(gateway_app)
+    mw.start(asyncio.get_event_loop())
+
+    def _mq_unavailable(service_name, data):
+        raise ConnectionError("MQ producer not available")
+
+    monkeypatch.setattr(mw, 'log_via_mq', _mq_unavailable)
+    for n in range(10):
+        await mw.enqueue('test_service', {'n': n})
+    await mw.flush()
+    assert mw.get_stats()['spooled'] == 10
+    assert len(mw.spool.segments()) > 1
+
+    # Torn write is detected
+    with open(mw.spool.segments()[-1], 'ab') as f:
+        f.write(b'\x00\x00\x00\x10{"n"')
+
+    published = []
+    monkeypatch.setattr(mw, 'log_via_mq', lambda service_name, data: published.append(data['n']))
+    assert await mw.spool.replay(mw._publish_spooled, rate=1000, batch_size=3) == 10
+    assert published == list(range(10))
+    assert not mw.spool.has_pending
+    assert mw.spool.corrupted == 1
+
+    # Spool of a worker that is gone is replayed by another one
+    monkeypatch.setattr(mw, 'log_via_mq', _mq_unavailable)
+    for n in range(10, 12):
+        await mw.enqueue('test_service', {'n': n})
+    await mw.flush()
+    other = LoggerMiddleware(gateway_app)
+    other.start(asyncio.get_event_loop())
+    monkeypatch.setattr(other, 'log_via_mq', lambda service_name, data: published.append(data['n']))
+    await other.replay_orphaned()
+    assert published == list(range(10))
+
+    await mw.stop()
+    await other.replay_orphaned()
+    assert published == list(range(12))
+    assert [x for x in tmpdir.listdir() if x.isdir()] == [tmpdir.join(other.spool.path.rsplit('/', 1)[-1])]
+    await other.stop()
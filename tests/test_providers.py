@@ -1,10 +1,15 @@
+import asyncio
+
+import aiohttp
 import pytest
 
 from sgateway.core import gateway_exceptions
+from sgateway.core.circuit_breaker import CircuitBreakerManager, OPEN, CLOSED
 from sgateway.services.base.provider import BaseServiceProvider
 from sgateway.services.base.service import BaseService
 from sgateway.services.registry import ServiceRegistry
 from sgateway.services.request import ServiceRequest
+from sgateway.services.utils import provide_method
 
 
 @pytest.mark.asyncio
@@ -60,3 +65,165 @@ async def test_provider_selection_concrete(gateway_app, service_registry):
 
     provider = await service.get_provider(sreq, provider_name='test_provider1')
     assert provider.name == 'test_provider1'
+
+
+@pytest.mark.asyncio
+async def test_provider_http_session(gateway_app, event_loop):
+    class TestProvider(BaseServiceProvider):
+        __name__ = 'test_provider'
+
+    provider = TestProvider(gateway_app)
+
+    # Standalone session when app's http client is not running
+    session = provider.http_session()
+    assert isinstance(session, aiohttp.ClientSession)
+    await session.close()
+
+    await gateway_app.http_client.start(event_loop)
+    try:
+        async with provider.http_session(headers={'X-Test': '1'}) as session1:
+            pass
+        async with provider.http_session() as session2:
+            pass
+        assert session1 is session2
+        assert not session1.closed
+        assert session1.connector is gateway_app.http_client.connector
+    finally:
+        await gateway_app.http_client.stop()
+    assert session1.closed
+
+
+@pytest.mark.asyncio
+async def test_provider_instances_reused(gateway_app, service_registry):
+    class TestProvider1(BaseServiceProvider):
+        __name__ = 'test_provider1'
+
+    class MisconfiguredProvider(BaseServiceProvider):
+        __name__ = 'misconfigured'
+
+        def __init__(self, *args, **kwargs):
+            super(MisconfiguredProvider, self).__init__(*args, **kwargs)
+            self.require_config('SOME_NOT_EXISTING_CONFIG')
+
+    @service_registry.register()
+    class ServiceForTest(BaseService):
+        __name__ = 'test_service'
+        providers = (TestProvider1, MisconfiguredProvider)
+
+    errors = service_registry.init_providers(gateway_app)
+    assert [provider_class for provider_class, _ in errors] == [MisconfiguredProvider]
+    assert isinstance(errors[0][1], gateway_exceptions.ConfigurationError)
+
+    service = service_registry.get_service('test_service', 1)(gateway_app)
+    sreq = ServiceRequest(service, None, gateway_app, None)
+
+    provider = await service.get_provider(sreq, provider_name='test_provider1')
+    assert provider is await service.get_provider(sreq, provider_name='test_provider1')
+    assert provider is service_registry.get_provider_instance(gateway_app, 'test_service', 1, 'test_provider1')
+
+    with pytest.raises(gateway_exceptions.ConfigurationError):
+        await service.get_provider(sreq, provider_name='misconfigured')
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker(gateway_app, app_redis, service_registry):
+    calls = {'test_provider1': 0}
+    upstream = {'ok': False}
+
+    class TestProvider1(BaseServiceProvider):
+        __name__ = 'test_provider1'
+
+        @provide_method()
+        def test(self):
+            calls[self.name] += 1
+            if not upstream['ok']:
+                raise NotImplementedError()
+            return self.name
+
+    class TestProvider2(BaseServiceProvider):
+        __name__ = 'test_provider2'
+
+        @provide_method()
+        def test(self):
+            return self.name
+
+    @service_registry.register()
+    class ServiceForTest(BaseService):
+        __name__ = 'test_service'
+        providers = (TestProvider1, TestProvider2)
+
+    gateway_app.circuit_breakers.failure_threshold = 2
+    gateway_app.circuit_breakers.cooldown = 0.5
+    service = service_registry.get_service('test_service', 1)(gateway_app)
+    sreq = ServiceRequest(service, None, gateway_app, None)
+    provider = service_registry.get_provider_instance(gateway_app, 'test_service', 1, 'test_provider1')
+    breaker = provider.circuit_breaker
+    with await app_redis as conn:
+        await conn.delete(breaker.key)
+
+    for _ in range(2):
+        assert await service.failover_provider_call(sreq, 'test', _silent=True) == 'test_provider2'
+    assert calls['test_provider1'] == 2
+    assert breaker.state == OPEN
+
+    # Open provider is not tried at all
+    assert provider not in service._get_available_providers(['test'])
+    assert await service.failover_provider_call(sreq, 'test', _silent=True) == 'test_provider2'
+    with pytest.raises(gateway_exceptions.CircuitOpenError):
+        await provider.call_method('test')
+    assert calls['test_provider1'] == 2
+
+    # State is shared with other workers
+    other_worker = CircuitBreakerManager(gateway_app)
+    other_breaker = other_worker.get(breaker.name)
+    assert other_breaker.state == CLOSED
+    await other_worker.sync()
+    assert other_breaker.state == OPEN
+
+    # Single trial call after cooldown
+    await asyncio.sleep(0.5)
+    upstream['ok'] = True
+    assert provider.is_available
+    assert await other_breaker.allow_call()
+    assert not await breaker.allow_call()
+    await other_breaker.record(success=True)
+    await gateway_app.circuit_breakers.sync()
+    assert breaker.state == CLOSED
+    assert await provider.call_method('test') == 'test_provider1'
+
+
+@pytest.mark.asyncio
+async def test_provider_call_cancelled(gateway_app, event_loop, service_registry):
+    records = []
+
+    class Breaker(object):
+        async def allow_call(self):
+            return True
+
+        async def record(self, success):
+            records.append(success)
+
+    class TestProvider(BaseServiceProvider):
+        __name__ = 'test_provider'
+        circuit_breaker = Breaker()
+
+        @provide_method()
+        async def test(self):
+            await asyncio.sleep(1)
+
+    @service_registry.register()
+    class ServiceForTest(BaseService):
+        __name__ = 'test_service'
+        providers = (TestProvider,)
+
+    provider = service_registry.get_provider_instance(gateway_app, 'test_service', 1, 'test_provider')
+    task = event_loop.create_task(provider.call_method('test'))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    # Cancelled call (lost hedge, expired deadline) is neither an error nor a failure of the provider
+    assert provider.stats.errors == 0
+    assert provider.stats.inflight == 0
+    assert records == []
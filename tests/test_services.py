@@ -1,18 +1,29 @@
+import asyncio
+import datetime
 import json
+from decimal import Decimal
 
 import pytest
 
-from sgateway.core import gateway_exceptions
+from management.commands import backfill_rates
+from sgateway.app import get_application
+from sgateway.core import gateway_exceptions, validation
 from sgateway.core.utils import get_schema_models
+from sgateway.core.validation import AVAILABLE_BACKENDS, DEFAULT_BACKEND, ValidationError, get_validator
 from sgateway.services.base.provider import BaseServiceProvider
 from sgateway.services.base.service import BaseService
+from sgateway.services.currency_exchange.cross_rates import CrossRateMatrix
+from sgateway.services.currency_exchange.history import RateHistory
+from sgateway.services.currency_exchange.rate_table import RateTable, RateTableManager
+from sgateway.services.currency_exchange.schemas import ConvertBatchQuerySchema, RatesModel, RateModel
+from sgateway.services.currency_exchange.service import CurrencyExchangeService
 from sgateway.services.email.providers import MockedProvider as EmailMockedProvider
 from sgateway.services.email.schemas import EmailMessage
 from sgateway.services.email.service import EmailService
 from sgateway.services.registry import ServiceRegistry
 from sgateway.services.tax_rates.providers import MockedProvider as TaxratesMockedProvider
 from sgateway.services.tax_rates.service import TaxRatesService
-from sgateway.services.utils import expose_method
+from sgateway.services.utils import expose_method, provide_method
 from .base import BaseServiceTestCase
 
 
@@ -88,6 +99,40 @@ def test_request_schema(gateway_app, service_factory, request_factory):
     assert response.response_data['longitude'] == data['longitude']
 
 
+@pytest.mark.parametrize('backend', AVAILABLE_BACKENDS)
+def test_compiled_validators(backend):
+    schema = EmailMessage.get_schema()
+    validator = get_validator(schema, backend=backend)
+    assert validator is get_validator(schema, backend=backend)
+
+    with pytest.raises(ValidationError) as exc_info:
+        validator.validate({'from_email': {'email': 'test@email.com'}, 'to': [], 'subject': '',
+                            'body_plain_text': ''})
+    assert list(exc_info.value.absolute_path) == ['to']
+
+    # Dynamically built schemas are cached by key
+    dynamic_validator = get_validator(dict(schema), key='test_dynamic', backend=backend)
+    assert dynamic_validator is get_validator(dict(schema), key='test_dynamic', backend=backend)
+
+
+def test_service_validators(gateway_app, monkeypatch):
+    class ServiceForTest(BaseService):
+        __name__ = 'test_service'
+
+        @expose_method(http_method='POST', request_schema={'type': 'object'})
+        def test_method(self, service_request):
+            return self.result({})
+
+    schema = ServiceForTest(gateway_app).get_method('test_method').request_schema
+    # Default backend is resolved the same way for any caller
+    assert get_validator(schema) is get_validator(schema, backend=DEFAULT_BACKEND)
+
+    # Validators are compiled with the configured backend
+    monkeypatch.setitem(gateway_app.config, 'SCHEMA_VALIDATION_BACKEND', 'jsonschema')
+    ServiceForTest(gateway_app).compile_validators()
+    assert validation._validators.get((id(schema), 'jsonschema')).backend == 'jsonschema'
+
+
 class TestEmail(BaseServiceTestCase):
     service_cls = EmailService
     providers_cls = [EmailMockedProvider]
@@ -163,3 +208,290 @@ class TestTaxRates(BaseServiceTestCase):
         assert tax_line['country'] == 'US'
         assert tax_line['region'] == 'FL'
         assert tax_line['tax_type'] == 'Sales'
+
+
+def test_schema_models_cached():
+    assert get_schema_models(EmailMessage) is get_schema_models(EmailMessage)
+
+    schema = EmailMessage.get_schema()
+    assert get_schema_models(schema) is get_schema_models(schema)
+
+
+def test_slots_model():
+    rates = RatesModel(base='USD', datetime='2017-11-19')
+    rates.rates = [RateModel(currency='EUR', value=0.85)]
+    assert rates.as_dict() == {'base': 'USD', 'datetime': '2017-11-19',
+                               'rates': [{'currency': 'EUR', 'value': 0.85}]}
+
+    with pytest.raises(AttributeError):
+        rates.unknown = 1
+    with pytest.raises(TypeError):
+        RateModel(unknown=1)
+
+
+def test_rate_table():
+    rates_model = RatesModel(base='EUR', datetime='2017-11-17')
+    rates_model.rates = [RateModel(currency='USD', value=1.1795), RateModel(currency='GBP', value=0.89183)]
+    table = RateTable.from_rates_model('test_provider', rates_model)
+    assert table.date == datetime.date(2017, 11, 17)
+
+    assert table.rate('EUR', 'USD') == Decimal('1.1795')
+    assert table.rate('USD', 'GBP') == Decimal('0.89183') / Decimal('1.1795')
+    assert table.rate('GBP', 'GBP') == 1
+
+    usd_rates = table.get_rates('USD', ['EUR', 'GBP', 'XXX']).as_dict()
+    assert usd_rates['base'] == 'USD'
+    assert usd_rates['datetime'] == '2017-11-17'
+    assert usd_rates['rates'] == [{'currency': 'EUR', 'value': float(1 / Decimal('1.1795'))},
+                                  {'currency': 'GBP', 'value': float(Decimal('0.89183') / Decimal('1.1795'))}]
+    assert [x.currency for x in table.get_rates('USD', ['']).rates] == ['EUR', 'GBP']
+
+    assert table.convert(Decimal('10'), 'EUR', ['USD', 'GBP']) == {'USD': Decimal('11.795'), 'GBP': Decimal('8.9183')}
+    with pytest.raises(gateway_exceptions.ServiceBadRequestError):
+        table.convert(Decimal('10'), 'XXX', ['USD'])
+
+
+def test_cross_rate_matrix():
+    cross_rates = CrossRateMatrix({'EUR': Decimal(1), 'USD': Decimal('1.1795'), 'GBP': Decimal('0.89183')})
+    assert cross_rates.currencies == ['EUR', 'GBP', 'USD']
+    assert 'USD' in cross_rates and 'XXX' not in cross_rates
+    assert cross_rates.rate('EUR', 'USD') == 1.1795
+    assert cross_rates.rate('USD', 'EUR') == 1 / 1.1795
+    assert (cross_rates.matrix.diagonal() == 1).all()
+
+    results = cross_rates.convert([10, 10, 0.5, 100], ['EUR', 'USD', 'EUR', 'GBP'], ['USD', 'USD', 'USD', 'USD'])
+    # Rounding is half up, results too close to a tie (11.795) are left to Decimal
+    assert cross_rates.to_decimals(results, 2) == [None, Decimal('10.00'), Decimal('0.59'), Decimal('132.26')]
+    assert cross_rates.to_decimals(cross_rates.convert([0.0051], ['EUR'], ['EUR']), 2) == [Decimal('0.01')]
+    assert cross_rates.fits(Decimal('1234567890.12'), 2)
+    assert not cross_rates.fits(Decimal('1234567890123456.78'), 2)
+    with pytest.raises(KeyError):
+        cross_rates.convert([1], ['EUR'], ['XXX'])
+
+    table = RateTable('test_provider', 'EUR', datetime.date(2017, 11, 17), {'USD': Decimal('1.1795')})
+    assert table.cross_rates is table.cross_rates
+    assert table.cross_rates.currencies == ['EUR', 'USD']
+
+
+@pytest.mark.asyncio
+async def test_rate_table_manager(gateway_app, service_registry):
+    calls = []
+
+    class TestProvider(BaseServiceProvider):
+        __name__ = 'test_provider'
+
+        @provide_method(hedge_safe=True)
+        async def get_rates(self, base, date=None, currencies=None):
+            calls.append(base)
+            rates_model = RatesModel(base=base, datetime='2017-11-17')
+            rates_model.rates = [RateModel(currency='USD', value=1.1795)]
+            return rates_model
+
+    @service_registry.register()
+    class ServiceForTest(BaseService):
+        __name__ = 'test_service'
+        providers = (TestProvider,)
+
+    gateway_app.config['CURRENCY_RATES_CONFIG'] = dict(gateway_app.config['CURRENCY_RATES_CONFIG'],
+                                                       PUBLICATION_TIME='15:00', RETRY_INTERVAL=600,
+                                                       RETRY_WINDOW=3600)
+    manager = RateTableManager(gateway_app, 'test_service', 1, service_registry)
+    assert manager.get_table() is None
+    assert manager.seconds_until_refresh() == 0
+
+    await manager.refresh()
+    assert calls == ['EUR']
+    assert manager.get_table().rate('USD', 'EUR') == 1 / Decimal('1.1795')
+
+    # Rates are fresh until the next publication
+    now = datetime.datetime(2017, 11, 17, 16, 0)
+    manager._attempted_at = now
+    assert manager.seconds_until_refresh(now) == 23 * 60 * 60
+    # New rates are expected, but not published yet
+    now = datetime.datetime(2017, 11, 20, 15, 0)
+    assert manager.seconds_until_refresh(now) == 0
+    manager._attempted_at = now
+    assert manager.seconds_until_refresh(now + datetime.timedelta(minutes=5)) == 5 * 60
+    # Retries are over for today
+    assert manager.seconds_until_refresh(now + datetime.timedelta(hours=2)) == 22 * 60 * 60
+
+
+@pytest.mark.asyncio
+async def test_rate_tables_snapshot(gateway_app, service_registry, tmpdir, event_loop, monkeypatch):
+    calls = []
+
+    class TestProvider(BaseServiceProvider):
+        __name__ = 'test_provider'
+
+        @provide_method(hedge_safe=True)
+        async def get_rates(self, base, date=None, currencies=None):
+            calls.append(base)
+            rates_model = RatesModel(base=base, datetime='2017-11-17')
+            rates_model.rates = [RateModel(currency='USD', value=1.1795), RateModel(currency='GBP', value=0.89183)]
+            return rates_model
+
+    @service_registry.register()
+    class ServiceForTest(BaseService):
+        __name__ = 'test_service'
+        providers = (TestProvider,)
+
+    gateway_app.config['CURRENCY_RATES_CONFIG'] = dict(gateway_app.config['CURRENCY_RATES_CONFIG'],
+                                                       SNAPSHOT_PATH=str(tmpdir.join('rates.snapshot')),
+                                                       SNAPSHOT_CHECK_INTERVAL=0)
+    # Two workers
+    refresher = RateTableManager(gateway_app, 'test_service', 1, service_registry)
+    worker = RateTableManager(gateway_app, 'test_service', 1, service_registry)
+    assert refresher.snapshot.try_acquire()
+    assert not worker.snapshot.try_acquire()
+    assert worker.get_table() is None
+
+    await refresher.refresh()
+    table = worker.get_table()
+    assert calls == ['EUR']
+    assert worker.snapshot.version == 1
+    assert (table.provider_name, table.reference, table.date) == ('test_provider', 'EUR', datetime.date(2017, 11, 17))
+    assert table.rate('USD', 'GBP') == Decimal('0.89183') / Decimal('1.1795')
+    assert table.cross_rates.currencies == ['EUR', 'GBP', 'USD']
+    assert (table.cross_rates.matrix == refresher.get_table().cross_rates.matrix).all()
+    assert worker.get_table() is table
+
+    await refresher.refresh()
+    assert worker.get_table() is not table
+    assert worker.snapshot.version == 2
+
+    # Failed election is logged and retried
+    def _lock_failed():
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(worker.snapshot, 'try_acquire', _lock_failed)
+    worker.snapshot_lock_interval = 0.01
+    task = event_loop.create_task(worker._refresh_periodically())
+    await asyncio.sleep(0.05)
+    assert not task.done()
+    task.cancel()
+    monkeypatch.undo()
+
+    # Another worker takes over once the refresher is gone
+    await refresher.stop()
+    assert worker.snapshot.try_acquire()
+    await worker.stop()
+
+
+@pytest.mark.asyncio
+async def test_rate_history(gateway_app, app_database):
+    history = RateHistory(gateway_app, 'EUR')
+    date = datetime.date(2017, 11, 17)
+    assert await history.get_table(date) is None
+
+    await history.save(RateTable('test_provider', 'EUR', date, {'USD': Decimal('1.1795'), 'GBP': Decimal('0.89183')}))
+    await history.save(RateTable('test_provider', 'EUR', date + datetime.timedelta(days=3), {'USD': Decimal('1.18')}))
+    # Saved rates are never overwritten
+    await history.save(RateTable('other_provider', 'EUR', date, {'USD': Decimal('2')}))
+
+    table = await history.get_table(date)
+    assert table.provider_name == 'test_provider'
+    assert table.rate('USD', 'GBP') == Decimal('0.89183') / Decimal('1.1795')
+    assert await history.get_dates(date, date + datetime.timedelta(days=7)) == {date, date + datetime.timedelta(days=3)}
+
+    end = date + datetime.timedelta(days=7)
+    assert await history.get_series('EUR', 'USD', date, end) == [(date, Decimal('1.1795')),
+                                                                 (date + datetime.timedelta(days=3), Decimal('1.18'))]
+    # GBP is missing for the second date
+    assert await history.get_series('GBP', 'USD', date, end) == [(date, Decimal('1.1795') / Decimal('0.89183'))]
+    assert await history.get_series('USD', 'GBP', date + datetime.timedelta(days=1), end) == []
+
+    # Weekends are saved as aliases of the last published date
+    saturday = date + datetime.timedelta(days=1)
+    await history.save(RateTable('test_provider', 'EUR', date, {'USD': Decimal('1.1795')}), date=saturday)
+    table = await history.get_table(saturday)
+    assert table.date == date
+    assert table.rate('EUR', 'GBP') == Decimal('0.89183')
+    assert await history.get_dates(date, end) == {date, date + datetime.timedelta(days=3)}
+    assert saturday in await history.get_dates(date, end, with_aliases=True)
+
+
+def test_backfill_rates(monkeypatch, capsys):
+    class StubProvider(object):
+        name = 'stub_provider'
+
+        async def call_method(self, method_name, base, date=None):
+            # Rates are published on business days only
+            published = date - datetime.timedelta(days=max(0, date.weekday() - 4))
+            rates_model = RatesModel(base=base, datetime=published.isoformat())
+            rates_model.rates = [RateModel(currency='USD', value=1.1795)]
+            return rates_model
+
+    monkeypatch.setattr(backfill_rates, 'get_application',
+                        lambda loop: get_application(loop=loop, config_module='sgateway.config.tests'))
+    monkeypatch.setattr(ServiceRegistry, 'get_provider_instances', lambda *args, **kwargs: [StubProvider()])
+    backfill_rates.Command().execute(start=datetime.date(2017, 11, 13), end=datetime.date(2017, 11, 19),
+                                     provider=None, concurrency=2, batch_size=4)
+
+    output = capsys.readouterr().out.splitlines()
+    assert output[0] == '7 dates to fetch from stub_provider'
+    # Weekend is saved as aliases of friday
+    assert output[-1] == '  2017-11-17 - 2017-11-19: 1 dates, 5 rates saved'
+
+
+@pytest.mark.asyncio
+async def test_convert_batch(gateway_app, service_registry, request_factory):
+    calls = []
+
+    class TestProvider(BaseServiceProvider):
+        __name__ = 'test_provider'
+
+        @provide_method(hedge_safe=True)
+        async def get_rates(self, base, date=None, currencies=None):
+            calls.append((base, currencies))
+            values = {'USD': 1.1795, 'GBP': 0.89183, 'VND': 27312.5}
+            rates_model = RatesModel(base=base, datetime='2017-11-17')
+            rates_model.rates = [RateModel(currency=x, value=values[x]) for x in currencies if x in values]
+            return rates_model
+
+    @service_registry.register()
+    class ServiceForTest(CurrencyExchangeService):
+        __name__ = 'test_currency_exchange'
+        providers = (TestProvider,)
+
+    service = ServiceForTest(gateway_app)
+    items = [
+        {'amount': '10.005', 'from_currency': 'EUR', 'to_currency': 'USD'},
+        {'amount': 20, 'from_currency': 'eur', 'to_currency': 'GBP'},
+        {'amount': '1', 'from_currency': 'EUR', 'to_currency': 'EUR'},
+        {'amount': '0.5', 'from_currency': 'EUR', 'to_currency': 'USD'},
+    ]
+    response = await service.convert_batch(request_factory(service, 'convert_batch', data={'items': items}))
+    # Rates of all the pairs with the same source currency are fetched at once
+    assert calls == [('EUR', ['EUR', 'GBP', 'USD'])]
+    assert [x['result'] for x in response.response_data['items']] == ['11.80', '17.84', '1.00', '0.59']
+    assert response.response_data['items'][1] == {'amount': '20', 'from_currency': 'EUR', 'to_currency': 'GBP',
+                                                  'result': '17.84'}
+
+    rate_tables = RateTableManager(gateway_app, ServiceForTest.__name__, 1, service_registry)
+    rate_tables.tables['test_provider'] = RateTable('test_provider', 'EUR', datetime.date.today(),
+                                                    {'USD': Decimal('1.1795'), 'GBP': Decimal('0.89183'),
+                                                     'VND': Decimal('27312.5')})
+    ServiceForTest._locals.rate_tables = rate_tables
+    items = [
+        {'amount': '100', 'from_currency': 'GBP', 'to_currency': 'USD'},
+        # Amounts float64 can't keep and results on a rounding tie are converted in Decimal
+        {'amount': '123456789012345.67', 'from_currency': 'EUR', 'to_currency': 'EUR'},
+        {'amount': '0.00005', 'from_currency': 'EUR', 'to_currency': 'EUR'},
+    ]
+    response = await service.convert_batch(request_factory(service, 'convert_batch',
+                                                           data={'items': items, 'precision': 4}))
+    assert len(calls) == 1
+    assert [x['result'] for x in response.response_data['items']] == ['132.2561', '123456789012345.6700',
+                                                                       '0.0001']
+
+    with pytest.raises(gateway_exceptions.ServiceBadRequestError):
+        items = [{'amount': '1', 'from_currency': 'EUR', 'to_currency': 'XXX'}]
+        await service.convert_batch(request_factory(service, 'convert_batch', data={'items': items}))
+
+    # Results must fit Decimal context precision: 20 integer digits and 12 decimal ones don't
+    items = [{'amount': '999999999999999', 'from_currency': 'EUR', 'to_currency': 'VND'}]
+    data = {'items': items, 'precision': 12}
+    get_validator(ConvertBatchQuerySchema.get_schema()).validate(data)
+    with pytest.raises(gateway_exceptions.ServiceBadRequestError):
+        await service.convert_batch(request_factory(service, 'convert_batch', data=data))
+    assert len(calls) == 1
@@ -1,12 +1,18 @@
+import asyncio
+import time
+
 import pytest
 
-from sgateway.core.gateway_exceptions import InternalError, FailoverFailError
+from sgateway.core.base_app import SGatewayRequest
+from sgateway.core.gateway_exceptions import InternalError, FailoverFailError, DeadlineExceeded, ProviderError
+from sgateway.core.gateway_exceptions import ServiceBadRequestError
 from sgateway.services.base.provider import BaseServiceProvider
-from sgateway.services.base.service import BaseService
+from sgateway.services.base.service import BaseService, ServiceMethod
+from sgateway.services.domains.service import DomainRegistrantStrategy
 from sgateway.services.registry import ServiceRegistry
 from sgateway.services.request import ServiceRequest
-from sgateway.services.strategies import RoundRobinStrategy
-from sgateway.services.utils import provide_method
+from sgateway.services.strategies import RoundRobinStrategy, LeastLoadedStrategy, PowerOfTwoChoicesStrategy
+from sgateway.services.utils import NO_DEADLINE, provide_method
 
 
 @pytest.mark.asyncio
@@ -120,3 +126,239 @@ async def test_failover(gateway_app):
 
         with pytest.raises(FailoverFailError):
             await service.failover_provider_call(sreq, 'test', _silent=True)
+
+
+@pytest.mark.asyncio
+async def test_least_loaded_strategy(gateway_app):
+    class TestProvider1(BaseServiceProvider):
+        __name__ = 'test_provider1'
+
+        @provide_method()
+        def test(self):
+            return 1
+
+    class TestProvider2(BaseServiceProvider):
+        __name__ = 'test_provider2'
+
+        @provide_method()
+        def test(self):
+            raise NotImplementedError()
+
+    class ServiceForTest(BaseService):
+        __name__ = 'test_service'
+        provider_strategy = LeastLoadedStrategy
+        providers = (TestProvider1, TestProvider2)
+
+    with ServiceRegistry(_as_context=True) as registry:
+        registry.register(ServiceForTest)
+        service = ServiceForTest(gateway_app)
+        sreq = ServiceRequest(service, None, gateway_app, None)
+        provider1, provider2 = service._get_available_providers()
+
+        # Not measured providers go first
+        provider1.stats.call_started()
+        provider1.stats.call_finished(0.1)
+        assert service._get_strategy().select(sreq, [provider1, provider2]) is provider2
+
+        assert await service.failover_provider_call(sreq, 'test', _silent=True) == 1
+        assert provider2.stats.errors == 1
+        assert provider2.stats.inflight == 0
+        assert provider1.stats.calls == 2
+
+        # Failing provider is avoided even though it fails fast
+        assert service._get_strategy().select(sreq, [provider1, provider2]) is provider1
+
+        # Slow provider gets less traffic
+        provider2.stats.error_rate = 0
+        provider2.stats.latency = 1
+        assert service._get_strategy().select(sreq, [provider1, provider2]) is provider1
+        provider1.stats.inflight = 20
+        assert service._get_strategy().select(sreq, [provider1, provider2]) is provider2
+
+        strategy = PowerOfTwoChoicesStrategy(gateway_app)
+        assert strategy.select(sreq, [provider1]) is provider1
+        assert strategy.select(sreq, []) is None
+
+
+@pytest.mark.asyncio
+async def test_hedged_call(gateway_app):
+    cancelled = []
+
+    class SlowProvider(BaseServiceProvider):
+        __name__ = 'test_provider1'
+
+        async def _slow(self, delay):
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                cancelled.append(self.name)
+                raise
+            return self.name
+
+        @provide_method(hedge_safe=True)
+        async def read(self):
+            return await self._slow(1)
+
+        @provide_method()
+        async def write(self):
+            return await self._slow(0.2)
+
+    class FastProvider(BaseServiceProvider):
+        __name__ = 'test_provider2'
+
+        @provide_method(hedge_safe=True)
+        async def read(self):
+            return self.name
+
+        @provide_method()
+        async def write(self):
+            return self.name
+
+    class ServiceForTest(BaseService):
+        __name__ = 'test_service'
+        providers = (SlowProvider, FastProvider)
+
+    gateway_app.config['HEDGING_CONFIG'] = dict(gateway_app.config['HEDGING_CONFIG'], DEFAULT_DELAY=0.05)
+    with ServiceRegistry(_as_context=True) as registry:
+        registry.register(ServiceForTest)
+        service = ServiceForTest(gateway_app)
+        assert [x.hedge_safe for x in SlowProvider._collect_methods()] == [True, False]
+
+        sreq = ServiceRequest(service, None, gateway_app, None)
+        started_at = time.monotonic()
+        assert await service.hedged_provider_call(sreq, 'read') == 'test_provider2'
+        assert time.monotonic() - started_at < 0.5
+        assert sreq.get_loggable_properties()['hedged']
+        await asyncio.sleep(0)
+        assert cancelled == ['test_provider1']
+
+        # Not hedge-safe calls are not duplicated
+        sreq = ServiceRequest(service, None, gateway_app, None)
+        assert await service.hedged_provider_call(sreq, 'write') == 'test_provider1'
+        assert 'hedged' not in sreq.get_loggable_properties()
+
+
+@pytest.mark.asyncio
+async def test_hedged_call_errors(gateway_app):
+    calls = []
+
+    class FailingProvider(BaseServiceProvider):
+        __name__ = 'test_provider1'
+
+        @provide_method(hedge_safe=True)
+        async def read(self, error):
+            calls.append(self.name)
+            raise error
+
+    class OtherFailingProvider(FailingProvider):
+        __name__ = 'test_provider2'
+
+    class ServiceForTest(BaseService):
+        __name__ = 'test_service'
+        providers = (FailingProvider, OtherFailingProvider)
+
+    with ServiceRegistry(_as_context=True) as registry:
+        registry.register(ServiceForTest)
+        service = ServiceForTest(gateway_app)
+
+        # Client errors are not provider failures, so the next provider is not tried
+        with pytest.raises(ServiceBadRequestError):
+            await service.hedged_provider_call(ServiceRequest(service, None, gateway_app, None), 'read',
+                                               ServiceBadRequestError("Incorrect data"), _silent=True)
+        assert len(calls) == 1
+
+        # Error of the last provider is raised when all of them failed
+        with pytest.raises(ProviderError):
+            await service.hedged_provider_call(ServiceRequest(service, None, gateway_app, None), 'read',
+                                               ProviderError("Not available"), _silent=True)
+        assert len(calls) == 3
+
+
+@pytest.mark.asyncio
+async def test_request_deadline(gateway_app):
+    calls = []
+
+    class SlowProvider(BaseServiceProvider):
+        __name__ = 'test_provider1'
+
+        @provide_method(hedge_safe=True)
+        async def test(self):
+            calls.append(self.name)
+            await asyncio.sleep(1)
+
+    class SlowProvider2(SlowProvider):
+        __name__ = 'test_provider2'
+
+    class ServiceForTest(BaseService):
+        __name__ = 'test_service'
+        providers = (SlowProvider, SlowProvider2)
+
+    def request_factory(timeout=None, method_timeout=None):
+        headers = {'X-Request-Timeout': timeout} if timeout else {}
+        request = SGatewayRequest('/'.encode(), headers, None, method='GET', transport=None)
+        method = ServiceMethod('test', 'test', False, 'GET', None, timeout=method_timeout)
+        return ServiceRequest(service, method, gateway_app, request)
+
+    with ServiceRegistry(_as_context=True) as registry:
+        registry.register(ServiceForTest)
+        service = ServiceForTest(gateway_app)
+
+        assert request_factory().time_left == pytest.approx(gateway_app.config['DEFAULT_REQUEST_TIMEOUT'], abs=1)
+        assert request_factory(method_timeout=5).time_left == pytest.approx(5, abs=1)
+        # Client can only shorten the budget
+        assert request_factory('2', method_timeout=5).time_left == pytest.approx(2, abs=1)
+        assert request_factory('10', method_timeout=5).time_left == pytest.approx(5, abs=1)
+        assert request_factory('bad', method_timeout=5).time_left == pytest.approx(5, abs=1)
+        # Methods with side effects opt out of deadlines
+        assert request_factory('2', method_timeout=NO_DEADLINE).time_left is None
+
+        started_at = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await service.failover_provider_call(request_factory('0.2'), 'test', _silent=True)
+        assert time.monotonic() - started_at < 0.5
+        assert len(calls) == 1
+
+        started_at = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await service.hedged_provider_call(request_factory('0.2'), 'test', _silent=True)
+        assert time.monotonic() - started_at < 0.5
+
+
+@pytest.mark.asyncio
+async def test_domain_registrant_strategy(gateway_app, monkeypatch):
+    calls = []
+
+    class TestRegistrar(BaseServiceProvider):
+        __name__ = 'registrar'
+        price = 10
+        delay = 0
+
+        @provide_method(hedge_safe=True)
+        async def check_availability(self, domain):
+            calls.append(self.name)
+            await asyncio.sleep(self.delay)
+            return {'available': True, 'price': self.price, 'currency': 'USD'}
+
+    class CheapRegistrar(TestRegistrar):
+        __name__ = 'cheap_registrar'
+        price = 5
+        delay = 0.1
+
+    class SlowRegistrar(TestRegistrar):
+        __name__ = 'slow_registrar'
+        price = 1
+        delay = 1
+
+    monkeypatch.setattr(DomainRegistrantStrategy, 'probe_timeout', 0.3)
+    providers = [TestRegistrar(gateway_app), CheapRegistrar(gateway_app), SlowRegistrar(gateway_app)]
+    strategy = DomainRegistrantStrategy(domain='test-strategy.com')
+
+    started_at = time.monotonic()
+    assert (await strategy.select(None, providers)).name == 'cheap_registrar'
+    assert time.monotonic() - started_at < 0.5
+    assert sorted(calls) == ['cheap_registrar', 'registrar', 'slow_registrar']
+
+    # Answers are reused
+    strategy = DomainRegistrantStrategy(domain='TEST-strategy.com')
+    assert (await strategy.select(None, providers)).name == 'cheap_registrar'
+    assert len(calls) == 4